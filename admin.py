@@ -1,12 +1,17 @@
 from aiogram import F, Router, Bot
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import (
+    Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
+    InlineKeyboardMarkup, InlineKeyboardButton
+)
 from aiogram.filters import Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 import asyncio
 import db
-from db import db_pool
+import stats
 import logging
+import broadcast
+from broadcast import Broadcast
 
 
 admin_router = Router()
@@ -16,6 +21,7 @@ admin_kb = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="📊 Статистика")],
         [KeyboardButton(text="📢 Сделать рассылку")],
+        [KeyboardButton(text="📋 Рассылки")],
         [KeyboardButton(text="🔙 В главное меню")]
     ],
     resize_keyboard=True
@@ -46,15 +52,14 @@ async def show_stats(message: Message):
         return
         
     try:
-        stats = await db.get_stats()
-        gift_stats = await db.get_today_gift_stats()
+        snapshot = await stats.get_snapshot()
         
         text = (
             "📊 <b>Статистика бота</b>\n\n"
-            f"👥 Всего пользователей: {stats['total_users']}\n"
-            f"🔥 Активных (30 дней): {stats['active_users']}\n"
-            f"🎁 Использований /gift сегодня: {gift_stats['used']}/{gift_stats['limit']}\n"
-            f"👤 Пользователей использовали: {gift_stats['users_count']}"
+            f"👥 Всего пользователей: {snapshot['total_users']}\n"
+            f"🔥 Активных (30 дней): {snapshot['active_users']}\n"
+            f"🎁 Использований /gift сегодня: {snapshot['gift_used']}/{snapshot['gift_limit']}\n"
+            f"👤 Пользователей использовали: {snapshot['gift_users']}"
         )
         await message.answer(text, parse_mode="HTML")
     except Exception as e:
@@ -82,47 +87,128 @@ async def cancel_broadcast(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("Рассылка отменена", reply_markup=admin_kb)
 
+# Ссылки на запущенные рассылки, чтобы задачи не собрал сборщик мусора
+_broadcast_tasks = set()
+
+def start_broadcast_task(job: Broadcast):
+    task = asyncio.create_task(run_broadcast(job))
+    _broadcast_tasks.add(task)
+    task.add_done_callback(_broadcast_tasks.discard)
+
 @admin_router.message(BroadcastStates.waiting_for_message)
-async def process_broadcast(message: Message, state: FSMContext, bot: Bot):
-    user_ids = await db.get_all_user_ids()
-    
-    success = 0
-    failed = 0
-    
-    progress_msg = await message.answer("🔄 Начата рассылка...")
-    
-    for user_id in user_ids:
-        try:
-            await bot.copy_message(
-                chat_id=user_id,
-                from_chat_id=message.chat.id,
-                message_id=message.message_id
-            )
-            success += 1
-            
-            # Обновляем прогресс каждые 10 отправок
-            if success % 10 == 0:
-                await progress_msg.edit_text(f"🔄 Отправлено: {success}, Не удалось: {failed}")
-                
-        except Exception as e:
-            failed += 1
-            
-        await asyncio.sleep(0.1)
-    
-    await progress_msg.delete()
+async def process_broadcast(message: Message, state: FSMContext):
+    job_id = await db.create_broadcast_job(
+        admin_id=message.chat.id,
+        from_chat_id=message.chat.id,
+        message_id=message.message_id,
+        text=message.text or message.caption or ""
+    )
+
+    # Рассылку из очереди запустит процесс с фоновыми задачами
     await state.clear()
-    await message.answer(
+    await message.answer(f"🔄 Рассылка #{job_id} поставлена в очередь", reply_markup=admin_kb)
+
+async def start_queued_broadcasts(bot: Bot):
+    """Запускает рассылки из очереди (только в процессе с фоновыми задачами)"""
+    for job in await db.claim_queued_broadcast_jobs():
+        start_broadcast_task(Broadcast(bot, job))
+
+async def run_broadcast(job: Broadcast):
+    try:
+        await job.run()
+    except Exception as e:
+        logging.error(f"Ошибка рассылки #{job.job_id}: {e}")
+        if not await db.set_broadcast_job_status(job.job_id, 'paused', 'running'):
+            return
+        await job.bot.send_message(
+            job.admin_id,
+            f"⚠️ Рассылка #{job.job_id} остановлена из-за ошибки. "
+            "Её можно продолжить с последней контрольной точки.",
+            reply_markup=broadcast_job_kb(job.job_id, 'paused')
+        )
+        return
+    if job.cancelled:
+        return
+    await job.bot.send_message(
+        job.admin_id,
         f"📢 Рассылка завершена:\n"
-        f"• Успешно: {success}\n"
-        f"• Не удалось: {failed}",
+        f"• Успешно: {job.success}\n"
+        f"• Не удалось: {job.failed}\n"
+        f"• Скорость: {job.rate:.1f} сообщ./с",
         reply_markup=admin_kb
     )
-async def log_broadcast(admin_id: int, message: str, success: int, failed: int):
-    async with db_pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
-                INSERT INTO broadcasts 
-                (admin_id, message, success_count, failed_count)
-                VALUES (%s, %s, %s, %s)
-            """, (admin_id, message, success, failed))
-            await conn.commit()
\ No newline at end of file
+
+def broadcast_job_kb(job_id: int, status: str) -> InlineKeyboardMarkup:
+    buttons = []
+    if status == 'paused':
+        buttons.append(InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bc_resume:{job_id}"))
+    buttons.append(InlineKeyboardButton(text="⏹ Отменить", callback_data=f"bc_cancel:{job_id}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+def broadcast_job_text(job: dict) -> str:
+    status = {'queued': "в очереди", 'running': "идёт"}.get(job['status'], "на паузе")
+    preview = (job['message'] or "")[:50]
+    return (
+        f"📢 Рассылка #{job['id']} ({status})\n"
+        f"«{preview}»\n"
+        f"• Успешно: {job['success_count']}, Не удалось: {job['failed_count']}\n"
+        f"• Дошла до user_id {job['cursor_user_id']}"
+    )
+
+@admin_router.message(F.text == "📋 Рассылки")
+async def show_broadcast_jobs(message: Message):
+    if not await db.is_admin(message.from_user.id):
+        return
+    jobs = await db.get_unfinished_broadcast_jobs()
+    if not jobs:
+        await message.answer("Незавершённых рассылок нет", reply_markup=admin_kb)
+        return
+    for job in jobs:
+        await message.answer(
+            broadcast_job_text(job),
+            reply_markup=broadcast_job_kb(job['id'], job['status'])
+        )
+
+@admin_router.callback_query(F.data.startswith("bc_resume:"))
+async def resume_broadcast(callback: CallbackQuery):
+    if not await db.is_admin(callback.from_user.id):
+        return
+    job_id = int(callback.data.split(":")[1])
+    # Обратно в очередь; продолжит с контрольной точки процесс с фоновыми задачами
+    if not await db.set_broadcast_job_status(job_id, 'queued', 'paused'):
+        await callback.answer("Рассылку нельзя продолжить")
+        return
+    await callback.message.edit_text(f"▶️ Рассылка #{job_id} продолжена", reply_markup=None)
+    await callback.answer()
+
+@admin_router.callback_query(F.data.startswith("bc_cancel:"))
+async def cancel_broadcast_job(callback: CallbackQuery):
+    if not await db.is_admin(callback.from_user.id):
+        return
+    job_id = int(callback.data.split(":")[1])
+    if not await db.cancel_broadcast_job(job_id):
+        await callback.answer("Рассылка уже завершена")
+        return
+    # Рассылка в другом процессе увидит отмену на ближайшей контрольной точке
+    job = broadcast.running.get(job_id)
+    if job:
+        job.cancel()
+    await callback.message.edit_text(f"⏹ Рассылка #{job_id} отменена", reply_markup=None)
+    await callback.answer()
+
+async def restore_broadcasts(bot: Bot):
+    """После рестарта ставит прерванные рассылки на паузу и предлагает админу продолжить.
+
+    Рассылки выполняет только процесс с фоновыми задачами, поэтому при его
+    старте задания в статусе running не выполняет никто.
+    """
+    for job in await db.pause_interrupted_broadcast_jobs():
+        job['status'] = 'paused'
+        try:
+            await bot.send_message(
+                job['admin_id'],
+                "⚠️ Рассылка прервана перезапуском бота.\n" + broadcast_job_text(job),
+                reply_markup=broadcast_job_kb(job['id'], 'paused')
+            )
+        except Exception as e:
+            logging.error(f"Не удалось сообщить о прерванной рассылке #{job['id']}: {e}")
@@ -0,0 +1,148 @@
+"""Общее для бенчмарков: фейковая сессия Telegram, перцентили, память, JSON.
+
+Бенчмарки запускают настоящий код бота против SQLite во временном файле
+(см. db_backends) и сессии, которая не ходит в сеть.
+"""
+import asyncio
+import atexit
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import CopyMessage, SendMessage
+from aiogram.types import Chat, Message, MessageId
+
+BENCH_TOKEN = "123456:bench"
+
+
+def setup_env(admin_id: int = 1) -> str:
+    """Переменные окружения для импорта bot/db без внешних сервисов.
+
+    Вызывать до импорта модулей бота. Возвращает путь к файлу SQLite;
+    временная папка с базой и каталогом удаляется при выходе из процесса.
+    """
+    directory = tempfile.mkdtemp(prefix="vibbot-bench-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    path = os.path.join(directory, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    # Каталог подарков пустой и во временной папке, чтобы не трогать рабочий
+    os.environ["GIFT_CATALOG_DIR"] = os.path.join(directory, "gift_catalog")
+    os.environ.setdefault("TELEGRAM_TOKEN", BENCH_TOKEN)
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+    os.environ["ADMIN_ID"] = str(admin_id)
+    os.environ["BACKGROUND_JOBS"] = "0"
+    return path
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot, которая отвечает сама: Message на send_message, True на остальное.
+
+    latency — искусственная задержка ответа API в секундах.
+    blocked — chat_id, для которых отправка падает с TelegramForbiddenError.
+    sent — сколько раз вызван каждый метод, recipients — кому ушли send_message.
+    """
+
+    def __init__(self, latency: float = 0.0, blocked=()):
+        super().__init__()
+        self.latency = latency
+        self.blocked = set(blocked)
+        self.sent = Counter()
+        self.recipients = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent[type(method).__name__] += 1
+        if isinstance(method, (SendMessage, CopyMessage)):
+            if method.chat_id in self.blocked:
+                from aiogram.exceptions import TelegramForbiddenError
+                raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+            self.recipients[method.chat_id] += 1
+        if isinstance(method, CopyMessage):
+            return MessageId(message_id=next(self._message_ids))
+        if method.__returning__ is Message:
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=getattr(method, "text", None),
+            ).as_(bot)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99/max в миллисекундах"""
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса (ru_maxrss — КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, params: dict, results: dict, output: str | None) -> Path:
+    """Пишет результаты в JSON (по умолчанию bench-results/<name>-<коммит>.json)"""
+    commit = git_commit()
+    path = Path(output) if output else Path("bench-results") / f"{name}-{commit or 'local'}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "benchmark": name,
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": params,
+        "results": results,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def compare(baseline_path: str, results: dict, prefix: str = ""):
+    """Печатает изменение числовых метрик относительно прошлого прогона"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))["results"]
+
+    def walk(old, new, path):
+        for key, value in new.items():
+            name = f"{path}{key}"
+            if isinstance(value, dict) and isinstance(old.get(key), dict):
+                walk(old[key], value, name + ".")
+            elif isinstance(value, (int, float)) and isinstance(old.get(key), (int, float)):
+                before = old[key]
+                change = f"{(value - before) / before * 100:+.1f}%" if before else "—"
+                print(f"{name:50} {before:>12} -> {value:<12} {change}")
+
+    walk(baseline, results, prefix)
@@ -0,0 +1,208 @@
+"""Нагрузочный прогон диспетчера: синтетические апдейты от N пользователей.
+
+Каждый пользователь проходит сценарий /start -> добавление даты -> /dates ->
+/delete -> /gift -> /timezone, администратор параллельно открывает панель,
+статистику, список рассылок и отменяет рассылку. Апдейты идут через
+bot.dp.feed_update с фейковой сессией Telegram, БД — SQLite во временном файле,
+ответ нейросети подменяется заглушкой.
+
+    python bench_dispatcher.py --users 500 --concurrency 100
+    python bench_dispatcher.py --compare bench-results/dispatcher-abc123.json
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from bench_common import FakeSession, compare, peak_rss_mb, percentiles, save_results, setup_env
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1000
+
+
+def user_script(event_day: str) -> list[tuple[str, str, str]]:
+    """Шаги пользователя: (имя шага, тип апдейта, текст или callback_data)"""
+    return [
+        ("start", "message", "/start"),
+        ("add_open", "message", "Загрузить дату 📅"),
+        ("add_date", "message", f"{event_day} День рождения мамы"),
+        ("add_finish", "callback", "finish"),
+        ("dates", "message", "/dates"),
+        ("delete_open", "message", "/delete"),
+        ("delete", "message", f"{event_day} День рождения мамы"),
+        ("gift_open", "message", "/gift"),
+        ("gift", "message", "Маме, любит сад, бюджет до 5000"),
+        ("timezone", "message", "/timezone Europe/Berlin 9"),
+    ]
+
+
+ADMIN_SCRIPT = [
+    ("admin", "message", "/admin"),
+    ("admin_stats", "message", "📊 Статистика"),
+    ("admin_jobs", "message", "📋 Рассылки"),
+    ("broadcast_open", "message", "📢 Сделать рассылку"),
+    ("broadcast_cancel", "message", "❌ Отменить рассылку"),
+]
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+                "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str, sender: dict) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": sender,
+            "text": text,
+        }
+
+    def build(self, user_id: int, kind: str, payload: str):
+        from aiogram.types import Update
+
+        update = {"update_id": next(self._update_ids)}
+        if kind == "message":
+            update["message"] = self._message(user_id, payload, self._user(user_id))
+        else:
+            bot_user = {"id": self.bot.id, "is_bot": True, "first_name": "Bot"}
+            update["callback_query"] = {
+                "id": str(update["update_id"]),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": payload,
+                "message": self._message(user_id, "✅ Сохранено", bot_user),
+            }
+        return Update.model_validate(update, context={"bot": self.bot})
+
+
+FAKE_ANSWER = "1. Секатор\n- Для сада.\n\n2. Семена\n- Редкие сорта."
+
+
+async def fake_completion(latency: float, **kwargs):
+    """Ответ OpenRouter: потоком по строкам (stream=True) или целиком"""
+    await asyncio.sleep(latency)
+    if not kwargs.get("stream"):
+        message = SimpleNamespace(content=FAKE_ANSWER)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def chunks():
+        for line in FAKE_ANSWER.splitlines(keepends=True):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=line))])
+    return chunks()
+
+
+async def run(args) -> dict:
+    import bot as bot_module
+    import db
+
+    logging.getLogger().setLevel(logging.WARNING)
+    session = FakeSession(latency=args.api_latency / 1000)
+    bot_module.bot.session = session
+    bot = bot_module.bot
+    bot_module.openai_client.chat.completions.create = (
+        lambda **kwargs: fake_completion(args.llm_latency / 1000, **kwargs)
+    )
+    await db.init_db_pool()
+
+    factory = UpdateFactory(bot)
+    latencies = defaultdict(list)
+    counters = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def play(user_id: int, script):
+        async with semaphore:
+            for step, kind, payload in script:
+                update = factory.build(user_id, kind, payload)
+                started = time.perf_counter()
+                await bot_module.dp.feed_update(bot, update)
+                latencies[step].append(time.perf_counter() - started)
+                # Счётчик запросов апдейта, заведённый RoundTripMiddleware (читаем в
+                # конце прогона). Хранилище FSM читает до этого middleware и пишет
+                # пачками сразу за нескольких пользователей, поэтому его запросы
+                # видны только в общем db_queries_per_update
+                counters[step].append(db._update_round_trips.get())
+
+    event_day = (date.today() + timedelta(days=30)).strftime("%d%m%Y")
+    users = [play(FIRST_USER_ID + i, user_script(event_day)) for i in range(args.users)]
+    admin = [play(ADMIN_ID, ADMIN_SCRIPT) for _ in range(args.admin_rounds)]
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    queries_before = db.query_stats["round_trips"]
+    started = time.perf_counter()
+    await asyncio.gather(*users, *admin)
+    await bot_module.fsm_storage.flush()
+    await bot_module.users.flush()
+    elapsed = time.perf_counter() - started
+    total_queries = db.query_stats["round_trips"] - queries_before
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    tracemalloc.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    updates = len(all_latencies)
+    results = {
+        "updates": updates,
+        "wall_time_s": round(elapsed, 3),
+        "updates_per_s": round(updates / elapsed, 1),
+        "latency_ms": percentiles(all_latencies),
+        "db_queries_per_update": round(total_queries / updates, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "telegram_calls": dict(session.sent),
+        "steps": {
+            step: {
+                "count": len(values),
+                "latency_ms": percentiles(values),
+                "db_queries_per_update": round(
+                    sum(c["round_trips"] for c in counters[step] if c) / len(values), 2
+                ),
+            }
+            for step, values in latencies.items()
+        },
+    }
+    if traced_peak is not None:
+        results["tracemalloc_peak_mb"] = round(traced_peak / (1024 * 1024), 1)
+    await db.db_pool.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="число пользователей")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно активных пользователей")
+    parser.add_argument("--admin-rounds", type=int, default=5, help="сколько раз админ проходит свой сценарий")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Telegram API, мс")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="задержка ответа нейросети, мс")
+    parser.add_argument("--tracemalloc", action="store_true", help="считать пик памяти Python (медленнее)")
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию bench-results/)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    setup_env(admin_id=ADMIN_ID)
+    results = asyncio.run(run(args))
+    path = save_results("dispatcher", vars(args), results, args.output)
+
+    print(f"Апдейтов: {results['updates']} за {results['wall_time_s']} с "
+          f"({results['updates_per_s']}/с), задержка {results['latency_ms']}")
+    print(f"Запросов к БД на апдейт: {results['db_queries_per_update']}, пик RSS: {results['peak_rss_mb']} МБ")
+    for step, values in results["steps"].items():
+        print(f"  {step:18} p50 {values['latency_ms']['p50']:>8} мс  p99 {values['latency_ms']['p99']:>8} мс  "
+              f"запросов {values['db_queries_per_update']}")
+    print(f"Результаты: {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Бенчмарк напоминаний: синтетические события и виртуальные часы.
+
+Заполняет SQLite во временном файле N пользователями с событиями по
+выбранному распределению дат, затем прогоняет daily_reminder_task минута за
+минутой по виртуальному времени (сутки за минуты реального) с фейковым ботом.
+Отчёт: время, отправки в секунду, обращения к БД, память. Набор полученных
+напоминаний сверяется с эталонной моделью правил (см. db.REMINDER_PLAN_SQL),
+при расхождении код выхода 1.
+
+    python bench_reminders.py --users 100000 --distribution near
+    python bench_reminders.py --users 10000 --days 8 --blocked-share 0.05
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from bench_common import BENCH_TOKEN, FakeSession, compare, peak_rss_mb, percentiles, save_results, setup_env
+
+FIRST_USER_ID = 1000
+TIMEZONES = ["Europe/Moscow", "Europe/Berlin", "Asia/Yekaterinburg", "Asia/Vladivostok", "America/New_York"]
+HOLIDAYS = [(1, 1), (2, 14), (2, 23), (3, 8), (9, 1), (12, 31)]
+SEED_CHUNK = 10000
+
+
+def event_offsets(rng: random.Random, distribution: str, count: int, horizon: int,
+                  start: date) -> list[int]:
+    """Смещения дат событий в днях от start"""
+    if distribution == "uniform":
+        return [rng.randrange(horizon) for _ in range(count)]
+    if distribution == "near":
+        # Много событий в ближайшие дни: экспоненциальное со средним horizon/10
+        return [min(horizon - 1, int(rng.expovariate(10 / horizon))) for _ in range(count)]
+    # holidays: события скучены вокруг праздников
+    offsets = []
+    for _ in range(count):
+        month, day = rng.choice(HOLIDAYS)
+        holiday = date(start.year, month, day)
+        if holiday < start:
+            holiday = date(start.year + 1, month, day)
+        offsets.append(min(horizon - 1, (holiday - start).days + rng.randint(-1, 1)))
+    return [max(0, offset) for offset in offsets]
+
+
+def generate(args, start: date) -> dict:
+    """Синтетические пользователи: user_id -> (часовой пояс, [(event_id, дата)])"""
+    rng = random.Random(args.seed)
+    users, event_id = {}, 0
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users):
+        events = []
+        count = rng.randint(1, args.max_events)
+        for offset in event_offsets(rng, args.distribution, count, args.horizon, start):
+            event_id += 1
+            events.append((event_id, start + timedelta(days=offset)))
+        users[user_id] = (rng.choice(TIMEZONES), events)
+    return users
+
+
+async def seed(db, reminder_time, users: dict, start_utc: datetime):
+    """Пишет пользователей в users, events и reminder_settings пачками"""
+    events, settings = [], []
+    registry = [(user_id, f"user{user_id}", start_utc, start_utc) for user_id in users]
+    for user_id, (tz_name, user_events) in users.items():
+        for event_id, event_date in user_events:
+            events.append((event_id, user_id, f"user{user_id}", f"Событие {event_id}", event_date))
+        minute = reminder_time.default_minute(user_id)
+        next_at, local_date = reminder_time.next_reminder(
+            tz_name, reminder_time.DEFAULT_HOUR, minute, start_utc
+        )
+        settings.append((user_id, tz_name, reminder_time.DEFAULT_HOUR, minute, next_at, local_date))
+
+    async with db.db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            for start in range(0, len(registry), SEED_CHUNK):
+                await cur.executemany("""
+                    INSERT INTO users (user_id, username, first_seen_at, last_seen_at)
+                    VALUES (%s, %s, %s, %s)
+                """, registry[start:start + SEED_CHUNK])
+            for start in range(0, len(events), SEED_CHUNK):
+                await cur.executemany("""
+                    INSERT INTO events (id, user_id, username, event_name, event_date)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, events[start:start + SEED_CHUNK])
+            for start in range(0, len(settings), SEED_CHUNK):
+                await cur.executemany("""
+                    INSERT INTO reminder_settings
+                    (user_id, timezone, remind_hour, remind_minute, next_remind_at, local_date)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, settings[start:start + SEED_CHUNK])
+
+
+def expected_reminders(reminder_time, users: dict, blocked: set, reprobe_after: timedelta,
+                       start_utc: datetime, end_utc: datetime) -> set:
+    """Эталон: (ключ идемпотентности, event_id) для каждого положенного напоминания.
+
+    Повторяет правила REMINDER_PLAN_SQL: в день события — всегда, за 1–3 дня —
+    раз в сутки, о дальних событиях — раз в неделю; напомненное в день
+    события удаляется. Заблокировавший бота после первого отказа пропускается
+    до повторной проверки через reprobe_after.
+    """
+    expected = set()
+    for user_id, (tz_name, user_events) in users.items():
+        events = sorted(user_events, key=lambda e: (e[1], e[0]))
+        minute = reminder_time.default_minute(user_id)
+        last_notified = blocked_at = None
+        fire, local_date = reminder_time.next_reminder(
+            tz_name, reminder_time.DEFAULT_HOUR, minute, start_utc
+        )
+        while fire <= end_utc:
+            upcoming = [e for e in events if e[1] >= local_date]
+            skipped = blocked_at is not None and blocked_at > fire - reprobe_after
+            if upcoming and not skipped:
+                event_id, event_date = upcoming[0]
+                days_left = (event_date - local_date).days
+                if (days_left == 0 or last_notified is None
+                        or (days_left <= 3 and last_notified != local_date)
+                        or (local_date - last_notified).days >= 7):
+                    expected.add((f"{user_id}:{local_date.isoformat()}", event_id))
+                    last_notified = local_date
+                    if user_id in blocked:
+                        blocked_at = fire
+                    if days_left == 0:
+                        events.remove(upcoming[0])
+            fire, local_date = reminder_time.next_reminder(
+                tz_name, reminder_time.DEFAULT_HOUR, minute, fire
+            )
+    return expected
+
+
+async def run(args) -> dict:
+    import broadcast
+    import daily_reminder
+    import db
+    import reminder_time
+    from aiogram import Bot
+
+    logging.getLogger().setLevel(logging.ERROR)
+    await db.init_db_pool()
+
+    start_utc = datetime.combine(args.start, datetime.min.time())
+    end_utc = start_utc + timedelta(days=args.days) - timedelta(minutes=1)
+
+    started = time.perf_counter()
+    users = generate(args, args.start)
+    await seed(db, reminder_time, users, start_utc)
+    seed_time = time.perf_counter() - started
+
+    rng = random.Random(args.seed + 1)
+    blocked = {user_id for user_id in users if rng.random() < args.blocked_share}
+    session = FakeSession(latency=args.api_latency / 1000, blocked=blocked)
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    # Лимиты Telegram в реальном времени не совпадают с виртуальным — по умолчанию снимаем
+    limited = args.telegram_rate > 0
+    daily_reminder.global_bucket = broadcast.TokenBucket(args.telegram_rate if limited else 1e9)
+    daily_reminder.chat_limiter = broadcast.ChatLimiter(broadcast.PER_CHAT_RATE if limited else 1e9)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    queries_before = db.query_stats["round_trips"]
+    ticks = []
+    started = time.perf_counter()
+    now = start_utc
+    while now <= end_utc:
+        tick_started = time.perf_counter()
+        await daily_reminder.daily_reminder_task(bot, now)
+        ticks.append(time.perf_counter() - tick_started)
+        now += timedelta(minutes=1)
+    elapsed = time.perf_counter() - started
+    round_trips = db.query_stats["round_trips"] - queries_before
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    tracemalloc.stop()
+
+    # Сверка с эталоном
+    expected = expected_reminders(reminder_time, users, blocked, db.BLOCKED_REPROBE_AFTER,
+                                  start_utc, end_utc)
+    async with db.db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT idempotency_key, event_id, user_id, status FROM reminder_outbox")
+            outbox = await cur.fetchall()
+    actual = {(key, event_id) for key, event_id, _, _ in outbox}
+    expected_recipients = sorted(int(key.split(":")[0]) for key, _ in expected
+                                 if int(key.split(":")[0]) not in blocked)
+    delivered = sorted(session.recipients.elements())
+    statuses = {}
+    for *_, status in outbox:
+        statuses[status] = statuses.get(status, 0) + 1
+    unfinished = statuses.get("pending", 0) + statuses.get("sending", 0)
+    missing, unexpected = expected - actual, actual - expected
+    correctness = {
+        "expected": len(expected),
+        "outbox": len(actual),
+        "missing": len(missing),
+        "unexpected": len(unexpected),
+        "delivered": len(delivered),
+        "delivered_matches": delivered == expected_recipients,
+        "statuses": statuses,
+        "ok": not missing and not unexpected and delivered == expected_recipients and not unfinished,
+        "examples": sorted(missing)[:5] + sorted(unexpected)[:5],
+    }
+
+    sends = sum(session.recipients.values())
+    results = {
+        "users": len(users),
+        "events": sum(len(events) for _, events in users.values()),
+        "seed_time_s": round(seed_time, 3),
+        "wall_time_s": round(elapsed, 3),
+        "ticks": len(ticks),
+        "tick_ms": percentiles(ticks),
+        "sends": sends,
+        "sends_per_s": round(sends / elapsed, 1),
+        "db_round_trips": round_trips,
+        "db_round_trips_per_send": round(round_trips / sends, 3) if sends else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "correctness": correctness,
+    }
+    if traced_peak is not None:
+        results["tracemalloc_peak_mb"] = round(traced_peak / (1024 * 1024), 1)
+    await db.db_pool.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000, help="число пользователей")
+    parser.add_argument("--max-events", type=int, default=5, help="событий на пользователя, до")
+    parser.add_argument("--distribution", choices=["uniform", "near", "holidays"], default="uniform",
+                        help="распределение дат событий")
+    parser.add_argument("--horizon", type=int, default=365, help="даты событий в пределах N дней")
+    parser.add_argument("--days", type=int, default=1, help="сколько виртуальных суток прогнать")
+    parser.add_argument("--start", type=date.fromisoformat, default=date.today(),
+                        help="первый виртуальный день (UTC), YYYY-MM-DD")
+    parser.add_argument("--blocked-share", type=float, default=0.0,
+                        help="доля пользователей, заблокировавших бота")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Telegram API, мс")
+    parser.add_argument("--telegram-rate", type=float, default=0,
+                        help="глобальный лимит отправок в секунду (0 — без лимита)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="считать пик памяти Python (медленнее)")
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию bench-results/)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    setup_env()
+    results = asyncio.run(run(args))
+    params = {**vars(args), "start": args.start.isoformat()}
+    path = save_results("reminders", params, results, args.output)
+
+    check = results["correctness"]
+    print(f"Пользователей: {results['users']}, событий: {results['events']}, "
+          f"заполнение {results['seed_time_s']} с")
+    print(f"{results['ticks']} минут за {results['wall_time_s']} с, минута: {results['tick_ms']}")
+    print(f"Отправлено {results['sends']} ({results['sends_per_s']}/с), обращений к БД "
+          f"{results['db_round_trips']} ({results['db_round_trips_per_send']} на отправку), "
+          f"пик RSS {results['peak_rss_mb']} МБ")
+    print(f"Сверка: ожидалось {check['expected']}, в outbox {check['outbox']}, "
+          f"не хватает {check['missing']}, лишних {check['unexpected']} — "
+          f"{'OK' if check['ok'] else 'ОШИБКА'}")
+    print(f"Результаты: {path}")
+    if args.compare:
+        compare(args.compare, results)
+    sys.exit(0 if check["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
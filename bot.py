@@ -1,18 +1,20 @@
 import os
+import re
+import signal
+import sys
 import logging
 import asyncio
 import aiomysql
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from aiogram import F
 from aiogram.types import BotCommand, Message
-from aiogram import Bot, Dispatcher, types
+from aiogram import BaseMiddleware, Bot, Dispatcher, types
 from aiogram.filters import Command, StateFilter
 
 from aiogram.enums import ChatAction
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -23,9 +25,23 @@ from openai import AsyncOpenAI
 from db import save_event
 from db import get_user_events
 from db import init_db_pool
+import daily_reminder
 from daily_reminder import daily_reminder_task
+from scheduler import scheduler
+import deferred
+import gift_cache
+import gift_catalog
+import llm
+from live_message import LiveMessage
+import metrics
+import stats
+import users
+import webhook
+import reminder_time
+from reminder_time import is_valid_timezone
 import db 
-from admin import admin_router
+from admin import admin_router, restore_broadcasts, start_queued_broadcasts
+from fsm_storage import MySQLStorage
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -34,14 +50,43 @@ logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и OpenAI
 bot = Bot(token=os.getenv('TELEGRAM_TOKEN'))
+bot.session.middleware(metrics.TelegramMetricsMiddleware())
 openai_client = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=os.getenv('OPENROUTER_API_KEY'),  # Добавьте новый ключ в .env
+    # Сроки и повторы задаёт шлюз llm: клиент не должен ждать и повторять сам
+    timeout=llm.CALL_DEADLINE,
+    max_retries=0,
 )
-dp = Dispatcher(storage=MemoryStorage())
+llm_gateway = llm.from_env(openai_client)
+gift_suggestions = gift_cache.GiftCache(path=os.getenv("GIFT_CACHE_PATH"))
+# Прошлые ответы модели; собирается офлайн: python gift_catalog.py seed ...
+gift_ideas = gift_catalog.GiftCatalog(os.getenv("GIFT_CATALOG_DIR", "data/gift_catalog"))
+# Кэш состояний годится, только когда апдейты идут в один процесс: при polling
+# это так, а веб-инстансов может быть несколько — там по умолчанию без кэша
+fsm_storage = MySQLStorage(
+    cache_ttl=float(os.getenv("FSM_CACHE_TTL", 0 if "--webhook" in sys.argv else 30))
+)
+dp = Dispatcher(storage=fsm_storage)
+
+
+class RoundTripMiddleware(BaseMiddleware):
+    """Считает обращения к БД за время обработки одного апдейта"""
 
-# Временное хранилище данных
-users_data = {}
+    async def __call__(self, handler, event, data):
+        counter = db.track_round_trips()
+        try:
+            return await handler(event, data)
+        finally:
+            logging.debug(f"Апдейт {event.update_id}: запросов к БД {counter['round_trips']}")
+
+
+dp.update.outer_middleware(RoundTripMiddleware())
+# Реестр пользователей: отправитель каждого апдейта попадает в users пакетом
+dp.update.outer_middleware(users.UserRegistryMiddleware())
+# Время обработчиков по имени; внутренние middleware действуют и во вложенных роутерах
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
 
 # Состояния
 class Form(StatesGroup):
@@ -119,7 +164,7 @@ async def finish_adding(callback: types.CallbackQuery, state: FSMContext):
 @dp.message(Command('start'))
 async def cmd_start(message: types.Message):
     user = message.from_user
-    users_data[user.id] = {"events": [], "username": user.username}
+    # В реестр users пользователя записывает UserRegistryMiddleware
     
     await message.answer(
        f"🕒 Привет, {user.first_name}! Я помогу тебе всегда помнить важные даты.\n\n"
@@ -195,20 +240,11 @@ async def process_event(message: types.Message, state: FSMContext):
         reply_markup=continue_keyboard
     )
 
-        await asyncio.sleep(300)
-        text = message.text.lower()
-        if any(keyword in text for keyword in keywords):
-        # Если одно из ключевых слов найдено, предлагаем выбор подарка
-        
-         await message.answer(
-            "🎁 Кажется, ты упомянул важное событие! Хочешь, я помогу выбрать подарок? Напиши /gift, и я подберу для тебя несколько идей!",
-            reply_markup=main_menu_kb  # кнопка с главного меню
-        )
-
-
+        # Предложение подарка уходит отложенной задачей, обработчик не ждёт
+        if keywords_re.search(message.text.lower()):
+            await deferred.defer("gift_nudge", GIFT_NUDGE_DELAY, persist=True, chat_id=message.chat.id)
 
         await state.clear()
-        
 
     except ValueError:
         await message.answer("❌ Неверный формат! Используйте: ДДММГГГГ Событие")
@@ -218,6 +254,20 @@ async def process_event(message: types.Message, state: FSMContext):
 
 # Список ключевых слов для фильтрации
 keywords = ["день рождение", "годовщина", "праздник", "юбилей", "подарок", "др", "8 марта","14 февраля","день влюбленных"]
+# Одно регулярное выражение на все ключевые слова вместо перебора в цикле
+keywords_re = re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+# Через сколько секунд после сохранения даты предложить подобрать подарок
+GIFT_NUDGE_DELAY = 300
+
+@deferred.handler("gift_nudge")
+async def send_gift_nudge(chat_id: int):
+    # Если одно из ключевых слов найдено, предлагаем выбор подарка
+    await bot.send_message(
+        chat_id,
+        "🎁 Кажется, ты упомянул важное событие! Хочешь, я помогу выбрать подарок? Напиши /gift, и я подберу для тебя несколько идей!",
+        reply_markup=main_menu_kb  # кнопка с главного меню
+    )
 
 
 
@@ -226,12 +276,13 @@ keywords = ["день рождение", "годовщина", "праздник
 async def cmd_gift(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     
-    # Проверяем лимит через БД
-    if not await db.check_gift_limit(user_id):
+    # Резервируем вызов из дневного лимита — его потратит get_gift_advice
+    if not await db.reserve_gift_call(user_id):
         await message.answer("❌ Лимит исчерпан! Попробуйте завтра.")
         return
     
     await state.set_state(Form.gift_advice)
+    await state.update_data(gift_reserved=True)
     await message.answer(
         "🎁 Расскажи, кому нужен подарок:\n"
         "• Кто это (друг, партнер, родитель)\n"
@@ -258,67 +309,74 @@ from datetime import date
 
 gift_usage_cache = defaultdict(lambda: {'count': 0, 'date': date.today()})
 
-async def reset_daily_limits():
-    while True:
-        now = datetime.now()
-        if now.hour == 0 and now.minute == 0:
-            async with db.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute("""
-                        UPDATE gift_usage 
-                        SET calls_today = 0
-                    """)
-                    await conn.commit()
-        await asyncio.sleep(60)  # Проверяем каждую минуту
+async def generate_gift_ideas(request: str, on_text=None) -> str:
+    """Варианты подарков от модели OpenRouter по описанию пользователя.
+
+    Ответ приходит потоком; on_text(текст_на_сейчас) вызывается на каждом
+    фрагменте. Модель, сроки и запасные варианты выбирает llm_gateway.
+    """
+    prompt = (
+        f"Ты помощник по выбору подарков. Пользователь ищет: {request}\n\n"
+        "Дай 5 вариантов подарка в формате:\n\n"
+        "1. [Название]\n"
+        "- Описание (1-2 предложения)\n\n"
+        "... и так далее для всех 5 вариантов\n\n"
+        "Учитывай современные тренды, практичность и бюджет."
+    )
+    
+    return await llm_gateway.complete(
+        [
+            {"role": "system", "content": "Ты эксперт по подаркам. Форматируй ответы четко."},
+            {"role": "user", "content": prompt}
+        ],
+        on_text=on_text,
+        temperature=0.7
+    )
 
+async def suggest_gifts(request: str, on_text=None) -> str:
+    """Ответ из локального каталога, а если похожего запроса там нет — от модели"""
+    answer = gift_ideas.search(request)
+    if answer is not None:
+        return answer
+    answer = await generate_gift_ideas(request, on_text)
+    gift_ideas.accept(request, answer)
+    return answer
 
 @dp.message(StateFilter(Form.gift_advice))
 async def get_gift_advice(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     
-    # Двойная проверка лимита (на случай если пользователь нашел способ обхода)
-    if not await db.check_gift_limit(user_id):
+    # Вызов уже зарезервирован в /gift; без резерва (обход /gift) списываем сейчас.
+    # Резерв тратится сразу, до генерации: сообщения, пришедшие за время ответа,
+    # уже не в Form.gift_advice и второй вызов по тому же резерву не получат
+    data = await state.get_data()
+    await state.clear()
+    if not data.get("gift_reserved") and not await db.reserve_gift_call(user_id):
         await message.answer("❌ Лимит исчерпан! Вы можете использовать эту команду только 5 раз в день.")
-        await state.clear()
         return
     
     
     wait_msg = await message.answer("⏳ Подождите, генерирую варианты подарков...")
 
+    # Ответ дописывается в это же сообщение по мере генерации
+    live = LiveMessage(wait_msg, header="🎁 *Варианты подарков:*\n\n")
     try:
-        prompt = (
-            f"Ты помощник по выбору подарков. Пользователь ищет: {message.text}\n\n"
-            "Дай 5 вариантов подарка в формате:\n\n"
-            "1. [Название]\n"
-            "- Описание (1-2 предложения)\n\n"
-            "... и так далее для всех 5 вариантов\n\n"
-            "Учитывай современные тренды, практичность и бюджет."
-        )
-        
-        response = await openai_client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            messages=[
-                {"role": "system", "content": "Ты эксперт по подаркам. Форматируй ответы четко."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7
+        # Повторный или уже генерируемый запрос отвечается без нового вызова
+        clean_response = await gift_suggestions.get_or_create(
+            message.text, lambda: suggest_gifts(message.text, on_text=live.update)
         )
+        await live.finish(clean_response)
         
-        clean_response = response.choices[0].message.content.strip()
-        
+    except llm.LLMUnavailable as e:
+        await live.cancel()
         await wait_msg.delete()
-        await message.answer(
-            f"🎁 *Варианты подарков:*\n\n{clean_response}",
-            parse_mode="Markdown"
-        )
-        
+        logging.warning(f"Подбор подарков недоступен: {e}")
+        await message.answer("⚠️ Сервис подбора подарков сейчас перегружен. Попробуйте через пару минут.")
     except Exception as e:
+        await live.cancel()
         await wait_msg.delete()
         logging.error(f"Ошибка генерации подарков: {e}")
         await message.answer("⚠️ Не удалось сгенерировать советы. Попробуйте позже.")
-    
-    # Очищаем состояние после завершения
-    await state.clear()
 
 @dp.message(F.text.in_({"Посмотреть даты 📅", "/dates"}))
 async def show_dates_handler(message: types.Message, state: FSMContext):
@@ -374,19 +432,41 @@ async def process_delete_event(message: Message, state: FSMContext):
         await message.answer("❌ Ошибка подключения к базе данных. Попробуйте позже.")
         return
 
-    async with db.db_pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "DELETE FROM events WHERE user_id=%s AND event_date=%s AND event_name=%s",
-                (user_id, event_date, event_name)
-            )
-            await conn.commit()
-            if cur.rowcount:
-                await message.answer("Событие успешно удалено ✅")
-            else:
-                await message.answer("Событие не найдено. Убедитесь, что ввели всё точно.")
+    if await db.delete_user_event(user_id, event_date, event_name):
+        await message.answer("Событие успешно удалено ✅")
+    else:
+        await message.answer("Событие не найдено. Убедитесь, что ввели всё точно.")
+
+    await state.clear()
+
 
+@dp.message(Command("timezone"))
+async def cmd_timezone(message: Message, state: FSMContext):
     await state.clear()
+    args = (message.text or "").split()[1:]
+    if not args or not is_valid_timezone(args[0]):
+        await message.answer(
+            "🕰 Укажите часовой пояс и, если нужно, час напоминаний (0–23):\n"
+            "`/timezone Europe/Moscow 20`",
+            parse_mode="Markdown"
+        )
+        return
+
+    tz_name = args[0]
+    hour = reminder_time.DEFAULT_HOUR
+    if len(args) > 1:
+        if not args[1].isdigit() or not 0 <= int(args[1]) <= 23:
+            await message.answer("❌ Час должен быть числом от 0 до 23")
+            return
+        hour = int(args[1])
+
+    next_at, local_date = await db.set_reminder_settings(message.from_user.id, tz_name, hour)
+    local_time = next_at.replace(tzinfo=timezone.utc).astimezone(reminder_time.get_zone(tz_name))
+    await message.answer(
+        f"✅ Напоминания будут приходить в {local_time.strftime('%H:%M')} ({tz_name}).\n"
+        f"Следующее: {local_date.strftime('%d.%m.%Y')}",
+        reply_markup=main_menu_kb
+    )
 
 
 async def setup_bot_commands(bot):
@@ -394,22 +474,83 @@ async def setup_bot_commands(bot):
         BotCommand(command="gift", description=" Подобрать подарок"),
         BotCommand(command="dates", description=" Посмотреть даты"),
         BotCommand(command="add", description=" Добавить дату"),
-        BotCommand(command="delete", description=" Удалить дату")
+        BotCommand(command="delete", description=" Удалить дату"),
+        BotCommand(command="timezone", description=" Часовой пояс и время напоминаний")
     ]
     await bot.set_my_commands(commands)
 
 
-async def main():
+# Фоновые задачи (напоминания, статистика, рассылки, отложенные задачи) нужны
+# в одном процессе. Веб-инстансов может быть несколько, поэтому с --webhook
+# они по умолчанию выключены и идут в отдельном процессе: python bot.py --jobs
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "0" if "--webhook" in sys.argv else "1") == "1"
+BROADCAST_POLL_INTERVAL = 5  # секунд между проверками очереди рассылок
+
+
+async def on_startup(bot: Bot):
     await init_db_pool()  # <-- СНАЧАЛА инициализируем базу данных
 
     await setup_bot_commands(bot)
-    dp.include_router(admin_router)
-    asyncio.create_task(daily_reminder_task(bot))
-    asyncio.create_task(reset_daily_limits())  # <-- потом запускаем задачи
+    # Буферы процесса сбрасываются на каждом инстансе, в том числе с BACKGROUND_JOBS=0
+    scheduler.every("stats_flush", stats.FLUSH_INTERVAL, stats.flush)
+    scheduler.every("users_flush", users.FLUSH_INTERVAL, users.flush)
+    gift_ideas.ensure_index()
+    # Кэш событий сбрасывают только изменения из своего процесса: он годится,
+    # лишь когда события меняет один процесс — polling вместе с фоновыми задачами
+    if BACKGROUND_JOBS and not {"--webhook", "--jobs"} & set(sys.argv):
+        db.enable_events_cache(float(os.getenv("EVENTS_CACHE_TTL", 300)))
+    if BACKGROUND_JOBS:
+        await restore_broadcasts(bot)
+        # Периодические задачи: планировщик спит до ближайшего запуска
+        await db.backfill_reminder_settings()
+        # Рассылки и сохранённые отложенные задачи ставят в БД все инстансы,
+        # а выполняет только этот процесс
+        scheduler.every("broadcasts", BROADCAST_POLL_INTERVAL, start_queued_broadcasts, bot)
+        scheduler.every("deferred", deferred.POLL_INTERVAL, deferred.run_due)
+        scheduler.cron("reminders", "* * * * *", daily_reminder_task, bot)
+        scheduler.cron("outbox_purge", "40 3 * * *", daily_reminder.purge_outbox)
+        scheduler.every("stats_recompute", stats.RECOMPUTE_INTERVAL, stats.recompute)
+        scheduler.cron("fsm_expire", "30 * * * *", fsm_storage.expire)
+    scheduler.start()
+
+
+async def on_shutdown():
+    # Дописываем то, что накопилось в памяти с последнего сброса
+    await scheduler.stop()
+    for flush in (users.flush, stats.flush):
+        try:
+            await flush()
+        except Exception as e:
+            logging.error(f"Ошибка записи при остановке: {e}")
+
+
+dp.include_router(admin_router)
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
+async def main():
     await dp.start_polling(bot)
 
 
+async def run_jobs():
+    """Только фоновые задачи, без приёма апдейтов (процесс worker рядом с веб-инстансами)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await on_startup(bot)
+    try:
+        await stop.wait()
+    finally:
+        await on_shutdown()
+        await bot.session.close()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if "--webhook" in sys.argv:
+        webhook.run(dp, bot)
+    elif "--jobs" in sys.argv:
+        asyncio.run(run_jobs())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import db
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+WORKERS = 8
+PROGRESS_INTERVAL = 3  # секунд между правками сообщения с прогрессом
+MAX_RETRIES = 3        # повторов после TelegramRetryAfter
+CHECKPOINT_SIZE = 200  # получателей между сохранениями курсора
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity за раз"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов, например по ответу RetryAfter"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.updated = self.paused_until
+        self.tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatLimiter:
+    """Отдельное ведро на каждый чат, давно неиспользуемые вёдра вытесняются"""
+
+    def __init__(self, rate: float, max_chats: int = 10000):
+        self.rate = rate
+        self.max_chats = max_chats
+        self._buckets = OrderedDict()
+
+    async def acquire(self, chat_id: int):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.rate, 1)
+            if len(self._buckets) > self.max_chats:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        await bucket.acquire()
+
+
+def is_unreachable(error: Exception) -> bool:
+    """Чат недоступен насовсем: бот заблокирован, аккаунт удалён или чата нет"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower()
+
+
+# Общие на процесс: все рассылки делят один бюджет Telegram
+global_bucket = TokenBucket(GLOBAL_RATE)
+chat_limiter = ChatLimiter(PER_CHAT_RATE)
+
+
+# Задания, которые выполняются в этом процессе: job_id -> Broadcast
+running = {}
+
+
+class Broadcast:
+    """Рассылка копии сообщения пулом воркеров с учётом лимитов Telegram.
+
+    Получатели идут порциями по возрастанию user_id; после каждой порции
+    курсор сохраняется в broadcast_jobs, и после рестарта рассылка
+    продолжается с последней контрольной точки. На контрольной точке
+    перечитывается статус: отмену мог записать другой процесс.
+    """
+
+    def __init__(self, bot: Bot, job: dict):
+        self.bot = bot
+        self.job_id = job['id']
+        self.admin_id = job['admin_id']
+        self.from_chat_id = job['from_chat_id']
+        self.message_id = job['message_id']
+        self.text = job['message']
+        self.cursor = job['cursor_user_id']
+        self.success = job['success_count']
+        self.failed = job['failed_count']
+        self.retried = job['retry_count']
+        self.unreachable = []  # недоступные чаты с последней контрольной точки
+        self.sent_in_run = 0
+        self.cancelled = False
+        self.started = None
+        self.finished = None
+
+    @property
+    def rate(self) -> float:
+        if not self.started:
+            return 0.0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.sent_in_run / elapsed if elapsed else 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    async def run(self):
+        running[self.job_id] = self
+        try:
+            await self._run()
+        finally:
+            running.pop(self.job_id, None)
+
+    async def _run(self):
+        self.started = time.monotonic()
+        progress_msg = await self.bot.send_message(self.admin_id, "🔄 Начата рассылка...")
+
+        queue = asyncio.Queue(maxsize=WORKERS * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(WORKERS)]
+        reporter = asyncio.create_task(self._report(progress_msg))
+        try:
+            while not self.cancelled:
+                batch = await db.get_recipients_after(self.cursor, CHECKPOINT_SIZE)
+                if not batch:
+                    break
+                for user_id in batch:
+                    await queue.put(user_id)
+                await queue.join()
+                self.cursor = batch[-1]
+                await db.mark_users_blocked(self.unreachable)
+                self.unreachable.clear()
+                await db.checkpoint_broadcast_job(
+                    self.job_id, self.cursor, self.success, self.failed, self.retried
+                )
+                if await db.get_broadcast_job_status(self.job_id) != 'running':
+                    self.cancel()
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+
+        self.finished = time.monotonic()
+        try:
+            await progress_msg.delete()
+        except TelegramBadRequest:
+            pass
+
+        if self.cancelled:
+            await db.set_broadcast_job_status(self.job_id, 'cancelled', 'running')
+            return
+        if not await db.set_broadcast_job_status(self.job_id, 'done', 'running'):
+            # Последнюю порцию отправили, но задание успели отменить
+            self.cancelled = True
+            return
+        await db.log_broadcast(
+            admin_id=self.admin_id,
+            message=self.text,
+            success=self.success,
+            failed=self.failed,
+            retried=self.retried,
+            duration=self.finished - self.started,
+            rate=self.rate
+        )
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                if not self.cancelled:
+                    await self._send(user_id)
+            finally:
+                queue.task_done()
+
+    async def _send(self, user_id: int):
+        self.sent_in_run += 1
+        for _ in range(MAX_RETRIES + 1):
+            await global_bucket.acquire()
+            await chat_limiter.acquire(user_id)
+            try:
+                await self.bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=self.from_chat_id,
+                    message_id=self.message_id
+                )
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать — тормозим все воркеры сразу
+                global_bucket.pause(e.retry_after)
+                self.retried += 1
+                continue
+            except Exception as e:
+                logging.debug(f"Рассылка: не доставлено {user_id}: {e}")
+                self.failed += 1
+                if is_unreachable(e):
+                    self.unreachable.append(user_id)
+                return
+            self.success += 1
+            return
+        self.failed += 1
+
+    async def _report(self, progress_msg):
+        # Прогресс обновляется по времени, а не по числу отправок
+        last = None
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            current = (self.success, self.failed)
+            if current == last:
+                continue
+            last = current
+            try:
+                await progress_msg.edit_text(
+                    f"🔄 Отправлено: {self.success}, Не удалось: {self.failed} "
+                    f"({self.rate:.1f} сообщ./с)"
+                )
+            except TelegramBadRequest:
+                pass
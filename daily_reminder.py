@@ -1,67 +1,145 @@
 import asyncio
-from datetime import datetime
+import logging
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramRetryAfter
+
 import db
+import reminder_time
+from broadcast import chat_limiter, global_bucket, is_unreachable
+
+SENDER_WORKERS = 4
+MAX_ATTEMPTS = 5          # попыток доставки одного напоминания
+RETRY_BASE = 60           # секунд до первого повтора, дальше удваивается
+MAX_RETRY_AFTER = 3       # ответов RetryAfter подряд, после которых попытка засчитывается
+OUTBOX_KEEP = timedelta(days=7)  # сколько хранить доставленные и отброшенные сообщения
+
+def reminder_text(event) -> str:
+    """Текст напоминания о ближайшем событии.
+
+    Кому напоминать сегодня, решает запрос планировщика (db.REMINDER_PLAN_SQL)
+    по истории напоминаний в reminder_history.
+    """
+    if event['reminder'] == 'today':
+        return f"🎉 Сегодня событие: *{event['event_name']}*!"
+    if event['reminder'] == 'soon':
+        return f"⏳ До события *{event['event_name']}* осталось {event['days_left']} дн."
+    return f"📅 Напоминание: ближайшее событие *{event['event_name']}* через {event['days_left']} дн."
 
-last_notified = {}
+async def plan_reminders(now):
+    """Кладёт в outbox напоминания для корзины пользователей, чьё время наступило.
 
-async def daily_reminder_task(bot):
+    now — время UTC. За один вызов обрабатываются только пользователи с
+    next_remind_at <= now, поэтому нагрузка размазана по суткам.
+    """
+    async for plan, outbox in db.iter_due_reminders(now):
+        for event in plan:
+            user_id = event['user_id']
+            outbox.append((
+                f"{user_id}:{event['local_date'].isoformat()}",  # одно напоминание в локальные сутки
+                user_id,
+                reminder_text(event),
+                event['id'],
+                event['reminder'] == 'today',
+                event['local_date']
+            ))
+
+async def drain_outbox(bot, now):
+    """Рассылает накопившиеся напоминания пулом отправителей.
+
+    Ошибка одного чата не останавливает остальных: сообщение уходит на повтор
+    с растущей задержкой. Сегодняшние события удаляются пачкой только после
+    того, как напоминание доставлено (или попытки исчерпаны). Недоступные
+    чаты отмечаются в users и не попадают в следующие планы.
+    """
     while True:
-        if db.db_pool is None:
-            print("[Напоминание] Ожидание инициализации базы данных...")
-            await asyncio.sleep(5)
-            continue
-
-        now = datetime.now()
-        today = now.date()
-
-        # Проверка: запускаем логику только в 9 утра
-        if now.hour == 20:
-            try:
-                user_ids = await db.get_all_user_ids()
-                for user_id in user_ids:
-                    event = await db.get_nearest_event(user_id)
-                    if not event:
-                        continue
-
-                    event_date = event['event_date']
-                    days_left = (event_date - today).days
-                    last_date = last_notified.get(user_id)
-
-                    if days_left == 0:
-                        await bot.send_message(
-                            user_id,
-                            f"🎉 Сегодня событие: *{event['event_name']}*!",
-                            parse_mode="Markdown"
-                        )
-                        await db.delete_event(event['id'])
-                        last_notified[user_id] = today
-                        continue
-
-                    if 0 < days_left <= 3:
-                        if last_date != today:
-                            await bot.send_message(
-                                user_id,
-                                f"⏳ До события *{event['event_name']}* осталось {days_left} дн.",
-                                parse_mode="Markdown"
-                            )
-                            last_notified[user_id] = today
-                        continue
-
-                    if days_left > 3:
-                        if last_date is None or (today - last_date).days >= 7:
-                            await bot.send_message(
-                                user_id,
-                                f"📅 Напоминание: ближайшее событие *{event['event_name']}* через {days_left} дн.",
-                                parse_mode="Markdown"
-                            )
-                            last_notified[user_id] = today
-
-            except Exception as e:
-                print(f"[Напоминание] Ошибка: {e}")
-
-            # Ждём до следующего дня (24 часа), чтобы снова попасть в 9:00
-            await asyncio.sleep(86400)
-
-        else:
-            # Если сейчас не 9 утра — подождать 60 секунд и снова проверить
-            await asyncio.sleep(60)
+        rows = await db.claim_outbox(now)
+        if not rows:
+            return
+
+        queue = asyncio.Queue()
+        for row in rows:
+            queue.put_nowait(row)
+        sent, failures, unreachable = [], [], []
+        workers = [
+            asyncio.create_task(_sender(bot, queue, sent, failures, unreachable, now))
+            for _ in range(SENDER_WORKERS)
+        ]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+
+        await db.complete_outbox(sent, now)
+        await db.reschedule_outbox([failure for failure, _ in failures])
+        await db.mark_users_blocked(unreachable, now)
+        finished = sent + [row for failure, row in failures if failure[0] == 'failed']
+        finished = [row for row in finished if row['delete_event']]
+        await db.delete_events(
+            [row['event_id'] for row in finished],
+            [row['user_id'] for row in finished]
+        )
+
+        if len(rows) < db.REMINDER_CHUNK_SIZE:
+            return
+
+async def _sender(bot, queue, sent, failures, unreachable, now):
+    while True:
+        row = await queue.get()
+        try:
+            await _deliver(bot, row)
+            sent.append(row)
+        except Exception as e:
+            failures.append((_failure(row, e, now), row))
+            if is_unreachable(e):
+                unreachable.append(row['user_id'])
+        finally:
+            queue.task_done()
+
+async def _deliver(bot, row):
+    for _ in range(MAX_RETRY_AFTER):
+        await global_bucket.acquire()
+        await chat_limiter.acquire(row['user_id'])
+        try:
+            await bot.send_message(row['user_id'], row['text'], parse_mode="Markdown")
+            return
+        except TelegramRetryAfter as e:
+            global_bucket.pause(e.retry_after)
+            error = e
+    raise error
+
+def _failure(row, error, now) -> tuple:
+    """Строка для db.reschedule_outbox: повтор с задержкой или окончательный отказ"""
+    attempts = row['attempts'] + 1
+    logging.warning(f"[Напоминание] Не доставлено {row['user_id']} (попытка {attempts}): {error}")
+    if is_unreachable(error) or attempts >= MAX_ATTEMPTS:
+        return ('failed', now, row['id'])
+    delay = timedelta(seconds=RETRY_BASE * 2 ** (attempts - 1))
+    return ('pending', now + delay, row['id'])
+
+async def purge_outbox(now=None):
+    """Задание планировщика: удаляет из outbox завершённые сообщения старше OUTBOX_KEEP"""
+    now = now or reminder_time.utc_now()
+    deleted = await db.purge_outbox(now - OUTBOX_KEEP)
+    if deleted:
+        logging.info(f"[Напоминание] Из outbox удалено {deleted} завершённых сообщений")
+
+async def daily_reminder_task(bot, now=None):
+    """Задание планировщика: раз в минуту планирует очередную корзину и разбирает outbox.
+
+    now — время UTC (naive); по умолчанию текущее. Бенчмарк передаёт
+    виртуальное время, чтобы прогнать сутки напоминаний за минуты.
+    """
+    if db.db_pool is None:
+        print("[Напоминание] База данных не инициализирована, пропускаем запуск")
+        return
+    now = now or reminder_time.utc_now()
+    try:
+        await plan_reminders(now)
+    except Exception as e:
+        print(f"[Напоминание] Ошибка планирования: {e}")
+    try:
+        await drain_outbox(bot, now)
+    except Exception as e:
+        print(f"[Напоминание] Ошибка отправки: {e}")
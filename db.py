@@ -3,44 +3,143 @@ import aiomysql
 from datetime import date
 from datetime import datetime, timedelta
 import os
+import sys
+import time
 import asyncio
-import ssl
-from urllib.parse import urlparse
+from contextvars import ContextVar
+from collections import Counter
+import reminder_time
+import migrations
+import db_backends
+import metrics
+from cache import TTLCache
 db_pool = None
 
+# Обращения к БД: всего за время работы и в рамках текущего апдейта
+# (счётчик апдейта ставит RoundTripMiddleware в bot.py)
+query_stats = {'round_trips': 0}
+_update_round_trips = ContextVar("db_update_round_trips", default=None)
+
+def track_round_trips() -> dict:
+    """Начинает подсчёт обращений к БД для текущей задачи и вложенных в неё"""
+    counter = {'round_trips': 0}
+    _update_round_trips.set(counter)
+    return counter
+
+def _query_name() -> str:
+    """Имя функции db.py, из которой пришёл запрос (метка для метрик)"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals is globals() and frame.f_code.co_name not in ("execute", "_record_query"):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "unknown"
+
+def _record_query(duration: float, rows: int):
+    """Учёт одного запроса: обращения за апдейт, время и строки по функции db.py"""
+    query_stats['round_trips'] += 1
+    counter = _update_round_trips.get()
+    if counter is not None:
+        counter['round_trips'] += 1
+    name = _query_name()
+    metrics.db_query_duration.observe(duration, query=name)
+    if rows > 0:
+        metrics.db_query_rows.inc(rows, query=name)
+
+def _record_pool_wait(wait: float):
+    metrics.db_pool_wait.observe(wait)
+
+class Cursor(db_backends.MySQLCursor):
+    """Курсор, учитывающий каждый запрос к серверу (executemany — тоже через execute)"""
+
+    async def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, args)
+        finally:
+            _record_query(time.perf_counter() - started, self.rowcount)
+
+class DictCursor(aiomysql.cursors._DictCursorMixin, Cursor):
+    pass
+
+# Приращения счётчиков статистики, ещё не записанные в stats_counters:
+# (имя, время в мс) -> приращение. Копит add_counter_delta, сбрасывает stats.flush;
+# по времени отбрасываются приращения, которые уже учёл точный пересчёт
+counter_deltas = Counter()
+# Строка stats_counters с временем последнего точного пересчёта (мс Unix-времени)
+RECOMPUTED_AT = 'recomputed_at_ms'
+
+def add_counter_delta(name: str, value: int = 1):
+    counter_deltas[name, int(time.time() * 1000)] += value
+
+def fresh_counter_deltas(deltas: dict, recomputed_at: int) -> Counter:
+    """Приращения по счётчикам без тех, что накоплены до пересчёта recomputed_at"""
+    totals = Counter()
+    for (name, at), value in deltas.items():
+        if at >= recomputed_at:
+            totals[name] += value
+    return totals
+
+def gift_counter_names(day: date) -> tuple[str, str]:
+    """Имена дневных счётчиков /gift: вызовы и уникальные пользователи"""
+    return f"gift_calls:{day.isoformat()}", f"gift_users:{day.isoformat()}"
+
+# Кэш событий пользователя (у каждого не больше 10 событий). Записи
+# сбрасываются только при изменениях из этого процесса, поэтому по умолчанию
+# кэша нет: его включает enable_events_cache, когда события меняет один процесс.
+events_cache = None
+
+def enable_events_cache(ttl: float):
+    """Включает кэш событий на ttl секунд; 0 — выключает"""
+    global events_cache
+    events_cache = TTLCache(maxsize=10000, ttl=ttl) if ttl > 0 else None
+
+def forget_events(user_ids: list[int] | None = None):
+    """Сбрасывает кэш событий пользователей user_ids (None — всех)"""
+    if events_cache is None:
+        return
+    if user_ids is None:
+        events_cache.clear()
+    for user_id in user_ids or ():
+        events_cache.pop(user_id)
+
+# Попыток подключиться при старте (между ними 2, 4, 8… секунд)
+CONNECT_ATTEMPTS = 5
+
+metrics.Gauge(
+    "bot_db_pool_connections", "Соединения пула БД: in_use, free, waiting, max",
+    lambda: db_pool.stats() if db_pool else {}, ("state",)
+)
+
 async def init_db_pool():
     global db_pool
     
-    # Берем правильную переменную окружения
-    db_url = os.getenv("SCALINGO_MYSQL_URL")
+    # DATABASE_URL (mysql://… или sqlite:///bot.db), иначе MySQL от Scalingo
+    db_url = os.getenv("DATABASE_URL") or os.getenv("SCALINGO_MYSQL_URL")
     if not db_url:
-        raise ValueError("SCALINGO_MYSQL_URL не задана!")
-
-    parsed = urlparse(db_url)
-
-    # Создаем SSL-контекст
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
-
-    # Создаем пул
-    db_pool = await aiomysql.create_pool(
-        host=parsed.hostname,
-        port=parsed.port or 3306,
-        user=parsed.username,
-        password=parsed.password,
-        db=parsed.path.lstrip('/'),  # убираем начальный "/"
-        autocommit=True,
-        ssl=ssl_context
-    )
-
-    try:
-        async with db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("SELECT 1")
-                print("✅ Успешное подключение к MySQL!")
-    except Exception as e:
-        print(f"❌ Ошибка подключения к MySQL: {e}")
+        raise ValueError("DATABASE_URL или SCALINGO_MYSQL_URL не задана!")
+
+    # Создаем пул (сразу открывает DB_POOL_MINSIZE соединений) и проверяем его.
+    # Без рабочей БД бот не запускается: платформа перезапустит процесс.
+    for attempt in range(1, CONNECT_ATTEMPTS + 1):
+        try:
+            pool = await db_backends.connect(
+                db_url, cursorclass=Cursor, on_execute=_record_query, on_acquire=_record_pool_wait
+            )
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT 1")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка подключения к БД (попытка {attempt}/{CONNECT_ATTEMPTS}): {e}")
+            if attempt == CONNECT_ATTEMPTS:
+                raise
+            await asyncio.sleep(2 ** attempt)
+    db_pool = pool
+    print(f"✅ Успешное подключение к БД ({db_pool.dialect})! Пул: {db_pool.stats()}")
+
+    # Создаём недостающие таблицы и индексы
+    await migrations.migrate(db_pool)
 
 async def save_event(user_id: int, username: str, event_name: str, event_date: date):
     async with db_pool.acquire() as conn:
@@ -49,39 +148,325 @@ async def save_event(user_id: int, username: str, event_name: str, event_date: d
                 INSERT INTO events (user_id, username, event_name, event_date)
                 VALUES (%s, %s, %s, %s)
             """, (user_id, username, event_name, event_date))
+            # Первое событие пользователя — заводим ему время напоминаний
+            await cur.execute(
+                INSERT_REMINDER_SETTINGS_SQL,
+                _default_reminder_row(user_id, reminder_time.utc_now())
+            )
+    forget_events([user_id])
 
 async def get_user_events(user_id: int):
+    """События пользователя по дате; повторные вызовы обслуживает events_cache, если он включён"""
+    events = events_cache.get(user_id) if events_cache is not None else None
+    if events is not None:
+        return events
     async with db_pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+        async with conn.cursor(DictCursor) as cur:
             await cur.execute("""
                 SELECT id, event_name, event_date
                 FROM events
                 WHERE user_id = %s
                 ORDER BY event_date ASC
             """, (user_id,))
-            return await cur.fetchall()
+            events = list(await cur.fetchall())
+    if events_cache is not None:
+        events_cache.set(user_id, events)
+    return events
 
-async def get_all_user_ids():
+async def delete_event(event_id: int, user_id: int | None = None):
     async with db_pool.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT DISTINCT user_id FROM events")
-            return [row[0] for row in await cur.fetchall()]
+            await cur.execute("DELETE FROM events WHERE id = %s", (event_id,))
+    forget_events(None if user_id is None else [user_id])
+
+# Размер порции для планировщика напоминаний и пакетного удаления
+REMINDER_CHUNK_SIZE = 500
+
+# Ближайшее событие каждого пользователя из порции, которой пора напомнить.
+# days_left считается от локальной даты пользователя (reminder_settings.local_date).
+# Уже получившие напоминание отсекаются здесь же по reminder_history:
+# о событии через 1–3 дня напоминаем раз в сутки, о дальних — раз в неделю.
+REMINDER_PLAN_SQL = """
+    SELECT id, nearest.user_id, event_name, event_date, local_date, days_left,
+           CASE
+               WHEN days_left = 0 THEN 'today'
+               WHEN days_left <= 3 THEN 'soon'
+               ELSE 'weekly'
+           END AS reminder
+    FROM (
+        SELECT e.id, e.user_id, e.event_name, e.event_date, s.local_date,
+               DATEDIFF(e.event_date, s.local_date) AS days_left,
+               ROW_NUMBER() OVER (
+                   PARTITION BY e.user_id ORDER BY e.event_date, e.id
+               ) AS rn
+        FROM reminder_settings s
+        JOIN events e ON e.user_id = s.user_id AND e.event_date >= s.local_date
+        LEFT JOIN users u ON u.user_id = s.user_id
+        WHERE s.user_id IN ({placeholders})
+          AND (u.blocked_at IS NULL OR u.blocked_at <= %s)
+    ) nearest
+    LEFT JOIN reminder_history h ON h.user_id = nearest.user_id
+    WHERE rn = 1
+      AND (
+          days_left = 0
+          OR h.last_notified IS NULL
+          OR (days_left <= 3 AND h.last_notified <> local_date)
+          OR DATEDIFF(local_date, h.last_notified) >= 7
+      )
+    ORDER BY nearest.user_id
+"""
 
-async def get_nearest_event(user_id: int):
+async def iter_due_reminders(now: datetime, chunk_size: int = REMINDER_CHUNK_SIZE):
+    """Отдаёт порциями ближайшие события пользователей, которым пора напомнить.
+
+    now — время UTC. Берутся пользователи с next_remind_at <= now (индекс по
+    времени), для них одним запросом считается ближайшее событие и класс:
+    'today' — событие сегодня, 'soon' — через 1–3 дня, 'weekly' — позже.
+    Недоступные чаты (users.blocked_at) пропускаются до повторной проверки.
+
+    Генератор отдаёт пару (plan, outbox): вызывающий код кладёт в outbox
+    строки для reminder_outbox (см. OUTBOX_COLUMNS). После этого одной
+    транзакцией строки пишутся в outbox, а next_remind_at переносится на
+    следующее локальное время пользователей. В reminder_history дата
+    попадает только после доставки (complete_outbox).
+    """
+    while True:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(DictCursor) as cur:
+                await cur.execute("""
+                    SELECT user_id, timezone, remind_hour, remind_minute
+                    FROM reminder_settings
+                    WHERE next_remind_at <= %s
+                    ORDER BY next_remind_at
+                    LIMIT %s
+                """, (now, chunk_size))
+                due = await cur.fetchall()
+                if not due:
+                    return
+                user_ids = [row['user_id'] for row in due]
+                placeholders = ", ".join(["%s"] * len(user_ids))
+                await cur.execute(
+                    REMINDER_PLAN_SQL.format(placeholders=placeholders),
+                    user_ids + [now - BLOCKED_REPROBE_AFTER]
+                )
+                plan = await cur.fetchall()
+
+        outbox = []
+        yield plan, outbox
+        await _commit_reminder_plan(due, outbox, now)
+
+# Строка outbox: ключ идемпотентности, получатель, текст, событие, нужно ли
+# удалить его после доставки и локальная дата напоминания (для reminder_history)
+OUTBOX_COLUMNS = ("idempotency_key", "user_id", "text", "event_id", "delete_event", "local_date")
+
+async def _commit_reminder_plan(settings: list[dict], outbox: list[tuple], now: datetime):
+    advance = []
+    for row in settings:
+        next_at, local_date = reminder_time.next_reminder(
+            row['timezone'], row['remind_hour'], row['remind_minute'], now
+        )
+        advance.append((
+            row['user_id'], row['timezone'], row['remind_hour'], row['remind_minute'],
+            next_at, local_date
+        ))
     async with db_pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+        async with conn.cursor() as cur:
+            await conn.begin()
+            try:
+                if outbox:
+                    # Повторное планирование той же порции не создаст дублей
+                    await cur.executemany("""
+                        INSERT IGNORE INTO reminder_outbox
+                        (idempotency_key, user_id, text, event_id, delete_event, local_date,
+                         status, attempts, next_attempt_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """, [row + ('pending', 0, now) for row in outbox])
+                # Многострочный upsert — один запрос на порцию вместо UPDATE на каждого
+                await cur.executemany("""
+                    INSERT INTO reminder_settings
+                    (user_id, timezone, remind_hour, remind_minute, next_remind_at, local_date)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                    next_remind_at = VALUES(next_remind_at),
+                    local_date = VALUES(local_date)
+                """, advance)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+# Строки в статусе sending дольше этого считаются брошенными (упал процесс)
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+async def claim_outbox(now: datetime, limit: int = REMINDER_CHUNK_SIZE):
+    """Забирает пачку сообщений к отправке, помечая их sending.
+
+    SKIP LOCKED позволяет нескольким процессам разбирать outbox параллельно.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await conn.begin()
+            try:
+                await cur.execute("""
+                    SELECT id, user_id, text, event_id, delete_event, local_date, attempts
+                    FROM reminder_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= %s)
+                       OR (status = 'sending' AND claimed_at < %s)
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                """, (now, now - OUTBOX_CLAIM_TIMEOUT, limit))
+                rows = await cur.fetchall()
+                if rows:
+                    placeholders = ", ".join(["%s"] * len(rows))
+                    await cur.execute(
+                        f"UPDATE reminder_outbox SET status = 'sending', claimed_at = %s "
+                        f"WHERE id IN ({placeholders})",
+                        [now] + [row['id'] for row in rows]
+                    )
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+            return rows
+
+async def complete_outbox(rows: list[dict], now: datetime):
+    """Отмечает доставленные сообщения и записывает их в reminder_history.
+
+    История пишется по факту доставки: напоминание, которое так и не
+    дошло, не считается отправленным и не откладывает следующее.
+    """
+    if not rows:
+        return
+    history = {row['user_id']: row['local_date'] for row in rows if row['local_date'] is not None}
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await conn.begin()
+            try:
+                placeholders = ", ".join(["%s"] * len(rows))
+                await cur.execute(
+                    f"UPDATE reminder_outbox SET status = 'sent', sent_at = %s "
+                    f"WHERE id IN ({placeholders})",
+                    [now] + [row['id'] for row in rows]
+                )
+                if history:
+                    await cur.executemany("""
+                        INSERT INTO reminder_history (user_id, last_notified)
+                        VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE last_notified = VALUES(last_notified)
+                    """, list(history.items()))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+async def purge_outbox(before: datetime, chunk_size: int = REMINDER_CHUNK_SIZE) -> int:
+    """Удаляет завершённые (sent, failed) сообщения с последней попыткой до before.
+
+    Порциями по chunk_size, чтобы не держать долгих блокировок; -> сколько удалено.
+    """
+    deleted = 0
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            while True:
+                await cur.execute("""
+                    SELECT id FROM reminder_outbox
+                    WHERE status IN ('sent', 'failed') AND next_attempt_at < %s
+                    LIMIT %s
+                """, (before, chunk_size))
+                ids = [row[0] for row in await cur.fetchall()]
+                if not ids:
+                    return deleted
+                placeholders = ", ".join(["%s"] * len(ids))
+                await cur.execute(f"DELETE FROM reminder_outbox WHERE id IN ({placeholders})", ids)
+                deleted += len(ids)
+
+async def reschedule_outbox(failures: list[tuple]):
+    """Возвращает недоставленные сообщения в очередь или помечает failed.
+
+    failures — строки (status, next_attempt_at, id).
+    """
+    if not failures:
+        return
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany("""
+                UPDATE reminder_outbox
+                SET status = %s, next_attempt_at = %s, attempts = attempts + 1
+                WHERE id = %s
+            """, failures)
+
+def _default_reminder_row(user_id: int, now: datetime) -> tuple:
+    tz_name = reminder_time.DEFAULT_TIMEZONE
+    hour = reminder_time.DEFAULT_HOUR
+    minute = reminder_time.default_minute(user_id)
+    next_at, local_date = reminder_time.next_reminder(tz_name, hour, minute, now)
+    return (user_id, tz_name, hour, minute, next_at, local_date)
+
+INSERT_REMINDER_SETTINGS_SQL = """
+    INSERT IGNORE INTO reminder_settings
+    (user_id, timezone, remind_hour, remind_minute, next_remind_at, local_date)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+async def backfill_reminder_settings(chunk_size: int = REMINDER_CHUNK_SIZE):
+    """Создаёт настройки по умолчанию для пользователей с событиями, у которых их нет"""
+    now = reminder_time.utc_now()
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            while True:
+                await cur.execute("""
+                    SELECT DISTINCT e.user_id
+                    FROM events e
+                    LEFT JOIN reminder_settings s ON s.user_id = e.user_id
+                    WHERE s.user_id IS NULL
+                    LIMIT %s
+                """, (chunk_size,))
+                user_ids = [row[0] for row in await cur.fetchall()]
+                if not user_ids:
+                    return
+                await cur.executemany(
+                    INSERT_REMINDER_SETTINGS_SQL,
+                    [_default_reminder_row(user_id, now) for user_id in user_ids]
+                )
+
+async def set_reminder_settings(user_id: int, tz_name: str, hour: int):
+    """Сохраняет часовой пояс и час напоминаний пользователя"""
+    minute = reminder_time.default_minute(user_id)
+    next_at, local_date = reminder_time.next_reminder(tz_name, hour, minute, reminder_time.utc_now())
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
             await cur.execute("""
-                SELECT id, event_name, event_date
-                FROM events
-                WHERE user_id = %s AND event_date >= CURDATE()
-                ORDER BY event_date ASC LIMIT 1
-            """, (user_id,))
-            return await cur.fetchone()
+                INSERT INTO reminder_settings
+                (user_id, timezone, remind_hour, remind_minute, next_remind_at, local_date)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                timezone = VALUES(timezone),
+                remind_hour = VALUES(remind_hour),
+                remind_minute = VALUES(remind_minute),
+                next_remind_at = VALUES(next_remind_at),
+                local_date = VALUES(local_date)
+            """, (user_id, tz_name, hour, minute, next_at, local_date))
+    return next_at, local_date
+
+async def delete_events(event_ids: list[int], user_ids: list[int],
+                        chunk_size: int = REMINDER_CHUNK_SIZE):
+    """Удаляет события пачками по chunk_size id за запрос.
 
-async def delete_event(event_id: int):
+    user_ids — владельцы событий, их записи в events_cache сбрасываются.
+    """
+    if not event_ids:
+        return
     async with db_pool.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("DELETE FROM events WHERE id = %s", (event_id,))
+            for start in range(0, len(event_ids), chunk_size):
+                batch = event_ids[start:start + chunk_size]
+                placeholders = ", ".join(["%s"] * len(batch))
+                await cur.execute(
+                    f"DELETE FROM events WHERE id IN ({placeholders})",
+                    batch
+                )
+    forget_events(user_ids)
 # Функция для ручного удаления события по имени
 async def delete_event_by_name(user_id: int, event_name: str):
     async with db_pool.acquire() as conn:
@@ -90,6 +475,20 @@ async def delete_event_by_name(user_id: int, event_name: str):
             await cur.execute("DELETE FROM events WHERE user_id = %s AND event_name = %s", (user_id, event_name))
             # Сохраняем изменения
             await conn.commit()
+    forget_events([user_id])
+
+async def delete_user_event(user_id: int, event_date: date, event_name: str) -> bool:
+    """Удаляет событие пользователя по дате и названию; True, если оно было"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "DELETE FROM events WHERE user_id=%s AND event_date=%s AND event_name=%s",
+                (user_id, event_date, event_name)
+            )
+            await conn.commit()
+            deleted = cur.rowcount > 0
+    forget_events([user_id])
+    return deleted
 
 # db.py
 
@@ -105,78 +504,91 @@ async def update_user_event(user_id: int, event_id: int, new_name: str, new_date
                 (new_name, new_date, event_id, user_id)
             )
             await conn.commit()
+    forget_events([user_id])
 
-async def check_gift_limit(user_id: int) -> bool:
-    """Проверяет, может ли пользователь вызвать команду /gift"""
+# Сколько раз в день можно вызвать /gift
+GIFT_DAILY_LIMIT = 5
+
+async def reserve_gift_call(user_id: int) -> bool:
+    """Списывает один вызов /gift из дневного лимита, если он не исчерпан.
+
+    Один условный upsert: счётчик за прошлый день сбрасывается прямо здесь,
+    поэтому ночной сброс всей таблицы не нужен. Затронутые строки:
+    1 — первая запись, 2 — счётчик увеличен, 0 — лимит на сегодня исчерпан.
+    LAST_INSERT_ID(...) возвращает новое значение calls_today в lastrowid —
+    по нему видно первый вызов за день без отдельного запроса.
+    """
+    today = datetime.now().date()
+    if db_pool.dialect == "sqlite":
+        granted, first_today = await _reserve_gift_call_sqlite(user_id, today)
+    else:
+        granted, first_today = await _reserve_gift_call_mysql(user_id, today)
+    if granted:
+        calls_name, users_name = gift_counter_names(today)
+        add_counter_delta(calls_name)
+        if first_today:
+            add_counter_delta(users_name)
+    return granted
+
+async def _reserve_gift_call_mysql(user_id: int, today: date) -> tuple[bool, bool]:
     async with db_pool.acquire() as conn:
         async with conn.cursor() as cur:
-            today = datetime.now().date()
-            
-            # Получаем текущее состояние
             await cur.execute("""
-                SELECT calls_today FROM gift_usage 
-                WHERE user_id = %s AND last_call_date = %s
-                FOR UPDATE
-            """, (user_id, today))
-            
-            result = await cur.fetchone()
-            
-            if not result:  # Первый вызов сегодня
-                await cur.execute("""
-                    INSERT INTO gift_usage (user_id, calls_today, last_call_date)
-                    VALUES (%s, 1, %s)
-                    ON DUPLICATE KEY UPDATE
-                    calls_today = 1,
-                    last_call_date = %s
-                """, (user_id, today, today))
-                await conn.commit()
-                return True
-                
-            if result[0] < 5:  # Лимит не исчерпан
-                await cur.execute("""
-                    UPDATE gift_usage 
-                    SET calls_today = calls_today + 1
-                    WHERE user_id = %s
-                """, (user_id,))
-                await conn.commit()
-                return True
-                
-            return False  # Лимит исчерпан
-        
-async def reset_daily_limits():
-    while True:
-        now = datetime.now()
-        if now.hour == 0 and now.minute == 0:
-            async with db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute("""
-                        UPDATE gift_usage 
-                        SET calls_today = 0
-                    """)
-                    await conn.commit()
-        await asyncio.sleep(60)  # Проверяем каждую минуту
+                INSERT INTO gift_usage (user_id, calls_today, last_call_date)
+                VALUES (%s, 1, %s)
+                ON DUPLICATE KEY UPDATE
+                calls_today = LAST_INSERT_ID(CASE
+                    WHEN last_call_date <> VALUES(last_call_date) THEN 1
+                    WHEN calls_today < %s THEN calls_today + 1
+                    ELSE calls_today
+                END),
+                last_call_date = VALUES(last_call_date)
+            """, (user_id, today, GIFT_DAILY_LIMIT))
+            granted = cur.rowcount > 0
+            first_today = cur.rowcount == 1 or (cur.rowcount == 2 and cur.lastrowid == 1)
+    return granted, first_today
+
+async def _reserve_gift_call_sqlite(user_id: int, today: date) -> tuple[bool, bool]:
+    # В SQLite нет LAST_INSERT_ID(expr): условие — в WHERE, новое значение — через RETURNING
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO gift_usage (user_id, calls_today, last_call_date)
+                VALUES (%s, 1, %s)
+                ON CONFLICT (user_id) DO UPDATE SET
+                calls_today = CASE
+                    WHEN last_call_date <> excluded.last_call_date THEN 1
+                    ELSE calls_today + 1
+                END,
+                last_call_date = excluded.last_call_date
+                WHERE last_call_date <> excluded.last_call_date OR calls_today < %s
+                RETURNING calls_today
+            """, (user_id, today, GIFT_DAILY_LIMIT))
+            row = await cur.fetchone()
+    return row is not None, row is not None and row[0] == 1
 
 async def get_stats() -> dict:
+    today = datetime.now().date()
     async with db_pool.acquire() as conn:
         async with conn.cursor() as cur:
-            # Уникальные пользователи (используем DISTINCT)
-            await cur.execute("SELECT COUNT(DISTINCT user_id) FROM events")
+            # Все, кто писал боту (реестр users)
+            await cur.execute("SELECT COUNT(*) FROM users")
             total_users = (await cur.fetchone())[0]
             
             # Активные пользователи (DISTINCT + дата)
             await cur.execute("""
                 SELECT COUNT(DISTINCT user_id)
                 FROM events
-                WHERE event_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-            """)
+                WHERE event_date >= %s
+            """, (today - timedelta(days=30),))
             active_users = (await cur.fetchone())[0]
             
             # Статистика по /gift (из таблицы gift_usage)
             await cur.execute("""
                 SELECT COUNT(DISTINCT user_id)
                 FROM gift_usage
-                WHERE last_call_date = CURDATE()
-            """)
+                WHERE last_call_date = %s
+            """, (today,))
             gift_users = (await cur.fetchone())[0] or 0
 
             
@@ -193,12 +605,217 @@ async def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь админом"""
     return user_id == int(os.getenv("ADMIN_ID"))
 
-async def get_all_user_ids() -> list[int]:
-    """Возвращает список всех user_id"""
+async def log_broadcast(admin_id: int, message: str, success: int, failed: int,
+                        retried: int = 0, duration: float = 0.0, rate: float = 0.0):
+    """Сохраняет итоги рассылки: доставки, ошибки, повторы и скорость"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO broadcasts
+                (admin_id, message, success_count, failed_count,
+                 retry_count, duration_sec, messages_per_sec)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (admin_id, message, success, failed, retried, duration, rate))
+            await conn.commit()
+
+async def create_broadcast_job(admin_id: int, from_chat_id: int, message_id: int, text: str) -> int:
+    """Ставит задание рассылки в очередь и возвращает его id"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO broadcast_jobs
+                (admin_id, from_chat_id, message_id, message, status, cursor_user_id)
+                VALUES (%s, %s, %s, %s, 'queued', 0)
+            """, (admin_id, from_chat_id, message_id, text))
+            return cur.lastrowid
+
+async def claim_queued_broadcast_jobs():
+    """Забирает задания из очереди: статус queued -> running.
+
+    Задание достаётся тому, чей UPDATE его перевёл, — даже если очередь
+    читают два процесса, одну рассылку не запустят дважды.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await cur.execute(
+                "SELECT * FROM broadcast_jobs WHERE status = 'queued' ORDER BY id"
+            )
+            claimed = []
+            for job in await cur.fetchall():
+                await cur.execute(
+                    "UPDATE broadcast_jobs SET status = 'running' WHERE id = %s AND status = 'queued'",
+                    (job['id'],)
+                )
+                if cur.rowcount:
+                    job['status'] = 'running'
+                    claimed.append(job)
+            return claimed
+
+async def get_broadcast_job(job_id: int):
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await cur.execute("SELECT * FROM broadcast_jobs WHERE id = %s", (job_id,))
+            return await cur.fetchone()
+
+async def get_unfinished_broadcast_jobs():
+    """Задания, которые ещё идут или стоят на паузе"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await cur.execute("""
+                SELECT * FROM broadcast_jobs
+                WHERE status IN ('queued', 'running', 'paused')
+                ORDER BY id
+            """)
+            return await cur.fetchall()
+
+async def pause_interrupted_broadcast_jobs():
+    """После рестарта: задания в статусе running никто не выполняет — ставим на паузу"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await cur.execute("SELECT * FROM broadcast_jobs WHERE status = 'running'")
+            jobs = await cur.fetchall()
+            if jobs:
+                await cur.execute(
+                    "UPDATE broadcast_jobs SET status = 'paused' WHERE status = 'running'"
+                )
+            return jobs
+
+async def checkpoint_broadcast_job(job_id: int, cursor_user_id: int,
+                                   success: int, failed: int, retried: int):
+    """Фиксирует, до какого user_id рассылка уже дошла"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                UPDATE broadcast_jobs
+                SET cursor_user_id = %s, success_count = %s,
+                    failed_count = %s, retry_count = %s
+                WHERE id = %s
+            """, (cursor_user_id, success, failed, retried, job_id))
+
+async def get_broadcast_job_status(job_id: int) -> str | None:
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT status FROM broadcast_jobs WHERE id = %s", (job_id,))
+            row = await cur.fetchone()
+            return row[0] if row else None
+
+async def set_broadcast_job_status(job_id: int, status: str, current: str) -> bool:
+    """Меняет статус, только если задание всё ещё в статусе current.
+
+    Так отмена, записанная другим процессом, не затирается итогом рассылки.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "UPDATE broadcast_jobs SET status = %s WHERE id = %s AND status = %s",
+                (status, job_id, current)
+            )
+            return cur.rowcount > 0
+
+async def cancel_broadcast_job(job_id: int) -> bool:
+    """Отменяет незавершённое задание; выполняющая его рассылка увидит это на контрольной точке"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                UPDATE broadcast_jobs SET status = 'cancelled'
+                WHERE id = %s AND status IN ('queued', 'running', 'paused')
+            """, (job_id,))
+            return cur.rowcount > 0
+
+async def save_deferred_job(kind: str, payload: str, run_at: datetime) -> int:
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO deferred_jobs (kind, payload, run_at)
+                VALUES (%s, %s, %s)
+            """, (kind, payload, run_at))
+            return cur.lastrowid
+
+async def delete_deferred_job(job_id: int) -> bool:
+    """Удаляет задачу; True — удалил этот вызов (задача досталась ему)"""
     async with db_pool.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT DISTINCT user_id FROM events")
+            await cur.execute("DELETE FROM deferred_jobs WHERE id = %s", (job_id,))
+            return cur.rowcount > 0
+
+async def get_due_deferred_jobs(now: datetime, limit: int):
+    """Задачи, срок которых наступил, начиная с самых давних"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await cur.execute("""
+                SELECT id, kind, payload, run_at FROM deferred_jobs
+                WHERE run_at <= %s
+                ORDER BY run_at
+                LIMIT %s
+            """, (now, limit))
+            return await cur.fetchall()
+
+async def get_recipients_after(cursor_user_id: int, limit: int) -> list[int]:
+    """Следующая порция получателей рассылки по возрастанию user_id.
+
+    Диапазон по первичному ключу users: каждая порция — короткий запрос,
+    память не растёт с числом пользователей, а курсор годится для возобновления.
+    Недоступные чаты пропускаются до повторной проверки.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT user_id FROM users
+                WHERE user_id > %s
+                  AND (blocked_at IS NULL OR blocked_at <= %s)
+                ORDER BY user_id
+                LIMIT %s
+            """, (cursor_user_id, reminder_time.utc_now() - BLOCKED_REPROBE_AFTER, limit))
             return [row[0] for row in await cur.fetchall()]
+
+async def save_users(rows: list[tuple]):
+    """Пакетная запись реестра: строки (user_id, username, first_name, seen_at).
+
+    Сначала INSERT IGNORE — его rowcount даёт число новых пользователей для
+    счётчика total_users, затем upsert обновляет имя и время последнего визита.
+    Раз пользователь пишет боту, чат снова доступен — blocked_at сбрасывается.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany("""
+                INSERT IGNORE INTO users (user_id, username, first_name, first_seen_at, last_seen_at)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(user_id, username, first_name, seen_at, seen_at)
+                  for user_id, username, first_name, seen_at in rows])
+            added = cur.rowcount
+            await cur.executemany("""
+                INSERT INTO users (user_id, username, first_name, first_seen_at, last_seen_at)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    username = VALUES(username),
+                    first_name = VALUES(first_name),
+                    last_seen_at = VALUES(last_seen_at),
+                    blocked_at = NULL
+            """, [(user_id, username, first_name, seen_at, seen_at)
+                  for user_id, username, first_name, seen_at in rows])
+    if added > 0:
+        add_counter_delta('total_users', added)
+
+# Через столько после блокировки чат снова попадает в рассылки и напоминания.
+# Если бот разблокировали, доставка пройдёт и blocked_at останется в прошлом;
+# если нет — отказ обновит blocked_at, и следующая проверка будет нескоро
+BLOCKED_REPROBE_AFTER = timedelta(days=30)
+
+async def mark_users_blocked(user_ids: list[int], now: datetime | None = None):
+    """Отмечает чаты недоступными: бот заблокирован, аккаунт удалён или чата нет.
+
+    now — время UTC (naive), по умолчанию текущее.
+    """
+    if not user_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"UPDATE users SET blocked_at = %s WHERE user_id IN ({placeholders})",
+                [now or reminder_time.utc_now(), *user_ids]
+            )
+
 async def get_today_gift_stats():
     """Возвращает статистику по использованию команды /gift за сегодня"""
     async with db_pool.acquire() as conn:
@@ -223,16 +840,145 @@ async def get_today_gift_stats():
             
             return {
                 'used': total_used,
-                'limit': 5,  # Ваш лимит на пользователя
+                'limit': GIFT_DAILY_LIMIT,  # Ваш лимит на пользователя
                 'users_count': users_count
             }
-async def check_events_limit(user_id: int) -> bool:
-    """Проверяет, не достигнут ли лимит (10 событий)"""
+async def add_to_counters(deltas: dict):
+    """Прибавляет приращения к счётчикам одним многострочным upsert.
+
+    Приращения, накопленные до последнего точного пересчёта, отбрасываются:
+    их события он уже сосчитал. Пока идёт пересчёт, сброс ждёт на строке
+    RECOMPUTED_AT.
+    """
+    if not deltas:
+        return
     async with db_pool.acquire() as conn:
         async with conn.cursor() as cur:
+            await conn.begin()
+            try:
+                await cur.execute(
+                    "SELECT value FROM stats_counters WHERE name = %s FOR UPDATE", (RECOMPUTED_AT,)
+                )
+                row = await cur.fetchone()
+                totals = fresh_counter_deltas(deltas, row[0] if row else 0)
+                await cur.executemany("""
+                    INSERT INTO stats_counters (name, value)
+                    VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+                """, list(totals.items()))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+async def recompute_counters(values: dict):
+    """Точный пересчёт счётчиков, которые копят приращения, плюс готовые values.
+
+    Пересчёт и отметка RECOMPUTED_AT пишутся одной транзакцией под блокировкой
+    её строки: приращения до отметки (на любом инстансе) в пересчёт попали и
+    при сбросе отбрасываются, более поздние — прибавятся.
+    """
+    today = datetime.now().date()
+    calls_name, users_name = gift_counter_names(today)
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await conn.begin()
+            try:
+                await cur.execute(
+                    "SELECT value FROM stats_counters WHERE name = %s FOR UPDATE", (RECOMPUTED_AT,)
+                )
+                recomputed_at = int(time.time() * 1000)
+                await cur.execute("SELECT COUNT(*) FROM users")
+                values['total_users'] = (await cur.fetchone())[0]
+                await cur.execute("""
+                    SELECT SUM(calls_today), COUNT(*)
+                    FROM gift_usage
+                    WHERE last_call_date = %s AND calls_today > 0
+                """, (today,))
+                calls, gift_users = await cur.fetchone()
+                values[calls_name] = calls or 0
+                values[users_name] = gift_users
+                values[RECOMPUTED_AT] = recomputed_at
+                await cur.executemany("""
+                    INSERT INTO stats_counters (name, value)
+                    VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE value = VALUES(value)
+                """, list(values.items()))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+async def get_counters(names: list[str]) -> dict:
+    """Значения счётчиков одним запросом по первичному ключу"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            placeholders = ", ".join(["%s"] * len(names))
             await cur.execute(
-                "SELECT COUNT(*) FROM events WHERE user_id = %s",
-                (user_id,)
+                f"SELECT name, value FROM stats_counters WHERE name IN ({placeholders})",
+                names
             )
-            result = await cur.fetchone()
-            return result[0] < 10 if result else True
+            return {name: value for name, value in await cur.fetchall()}
+
+async def get_fsm_record(storage_key: str, fresh_after: datetime):
+    """Состояние FSM по ключу; брошенные (старше fresh_after) не возвращаются"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:
+            await cur.execute("""
+                SELECT state, data FROM fsm_states
+                WHERE storage_key = %s AND updated_at >= %s
+            """, (storage_key, fresh_after))
+            return await cur.fetchone()
+
+FSM_UPSERT_SQL = {
+    # (меняется state, меняется data) -> запрос; незатронутый столбец не перезаписываем
+    (True, True): """
+        INSERT INTO fsm_states (storage_key, state, data, updated_at)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE state = VALUES(state), data = VALUES(data),
+                                updated_at = VALUES(updated_at)
+    """,
+    (True, False): """
+        INSERT INTO fsm_states (storage_key, state, updated_at)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE state = VALUES(state), updated_at = VALUES(updated_at)
+    """,
+    (False, True): """
+        INSERT INTO fsm_states (storage_key, data, updated_at)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE data = VALUES(data), updated_at = VALUES(updated_at)
+    """,
+}
+
+async def save_fsm_records(rows: list[tuple], deleted_keys: list[str]):
+    """Пачка изменений FSM: rows — (key, has_state, state, has_data, data).
+
+    Строки одной формы уходят одним многострочным upsert, обычно это
+    единственный запрос на всю пачку.
+    """
+    now = datetime.now()
+    groups = {}
+    for key, has_state, state, has_data, data in rows:
+        values = (key,) + ((state,) if has_state else ()) + ((data,) if has_data else ()) + (now,)
+        groups.setdefault((has_state, has_data), []).append(values)
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            for shape, values in groups.items():
+                await cur.executemany(FSM_UPSERT_SQL[shape], values)
+            if deleted_keys:
+                placeholders = ", ".join(["%s"] * len(deleted_keys))
+                await cur.execute(
+                    f"DELETE FROM fsm_states WHERE storage_key IN ({placeholders})",
+                    deleted_keys
+                )
+
+async def expire_fsm_records(older_than: datetime) -> int:
+    """Удаляет состояния FSM, не менявшиеся с older_than"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM fsm_states WHERE updated_at < %s", (older_than,))
+            return cur.rowcount
+
+async def check_events_limit(user_id: int) -> bool:
+    """Проверяет, не достигнут ли лимит (10 событий)"""
+    return len(await get_user_events(user_id)) < 10
@@ -0,0 +1,449 @@
+"""Хранилища для db.py: MySQL (aiomysql) и встроенный SQLite.
+
+Функции db.py написаны против общего интерфейса пула:
+
+    async with pool.acquire() as conn:
+        async with conn.cursor(DictCursor) as cur:   # или conn.cursor()
+            await cur.execute(sql, args)             # плейсхолдеры %s
+            rows = await cur.fetchall()
+        await conn.begin() / conn.commit() / conn.rollback()
+
+    cur.query_timeout = None — снять с курсора таймаут запроса (миграции).
+
+    pool.dialect — "mysql" или "sqlite", для редких запросов без общего вида.
+
+aiomysql-пул уже так выглядит, SQLiteBackend повторяет его поверх sqlite3.
+Бэкенд выбирается по схеме URL: mysql://… или sqlite:///путь/к/файлу.db.
+
+on_acquire(ожидание) вызывается, когда запрос получил соединение, — для
+метрик ожидания пула; счёт запросов у MySQL делает класс курсора, у SQLite —
+on_execute(длительность, строки). pool.stats() — занятые, свободные и
+ожидающие соединения.
+
+Размер пула, таймауты и повторы задаются переменными окружения (см.
+pool_settings) и читаются при создании пула, после load_dotenv().
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from functools import lru_cache
+from urllib.parse import urlparse
+
+import aiomysql
+from pymysql.constants import CR
+from pymysql.err import OperationalError
+
+
+def pool_settings() -> dict:
+    """Настройки пула из окружения"""
+    return {
+        # minsize соединений открываются сразу при создании пула
+        "minsize": int(os.getenv("DB_POOL_MINSIZE", 2)),
+        "maxsize": int(os.getenv("DB_POOL_MAXSIZE", 10)),
+        # Соединение старше стольких секунд пересоздаётся при выдаче из пула
+        # (меньше wait_timeout сервера, иначе получим закрытое сервером соединение)
+        "recycle": int(os.getenv("DB_POOL_RECYCLE", 280)),
+        "connect_timeout": float(os.getenv("DB_CONNECT_TIMEOUT", 10)),
+        # Сколько ждать свободного соединения, прежде чем вернуть ошибку
+        "acquire_timeout": float(os.getenv("DB_ACQUIRE_TIMEOUT", 10)),
+        "query_timeout": float(os.getenv("DB_QUERY_TIMEOUT", 15)),
+        # Повторов запроса после обрыва соединения
+        "retries": int(os.getenv("DB_QUERY_RETRIES", 2)),
+    }
+
+
+# Обрывы, после которых запрос не дошёл до сервера — повтор безопасен
+_NOT_SENT = {CR.CR_CONN_HOST_ERROR, CR.CR_SERVER_GONE_ERROR}
+# Соединение потеряно во время запроса — он мог выполниться, повторяем только чтение
+_LOST = {CR.CR_SERVER_LOST, CR.CR_SERVER_LOST_EXTENDED}
+_READ_QUERY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+class MySQLCursor(aiomysql.Cursor):
+    """Курсор с таймаутом запроса и переподключением после обрыва соединения.
+
+    Запрос, не уложившийся в query_timeout, прерывается, а соединение
+    закрывается — пул его не вернёт. Внутри транзакции не повторяем: её
+    начало осталось на потерянном соединении.
+    """
+
+    query_timeout = None
+    retries = 0
+
+    async def execute(self, query, args=None):
+        attempt = 0
+        while True:
+            in_transaction = self.connection.get_transaction_status()
+            try:
+                return await asyncio.wait_for(super().execute(query, args), self.query_timeout)
+            except asyncio.TimeoutError:
+                # Ответ сервера ещё придёт в это соединение — использовать его нельзя
+                self.connection.close()
+                raise
+            except OperationalError as e:
+                code = e.args[0] if e.args else None
+                retryable = code in _NOT_SENT or (code in _LOST and _READ_QUERY.match(query))
+                if in_transaction or not retryable or attempt >= self.retries:
+                    raise
+                attempt += 1
+                logging.warning(f"Обрыв соединения с БД ({e}), повтор {attempt}/{self.retries}")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+                await self.connection.ping(reconnect=True)
+
+
+class MySQLBackend:
+    dialect = "mysql"
+
+    def __init__(self, pool, acquire_timeout: float | None = None, on_acquire=None):
+        self._pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.on_acquire = on_acquire
+        self.waiting = 0
+
+    @classmethod
+    async def create(cls, url: str, cursorclass=MySQLCursor, on_acquire=None):
+        parsed = urlparse(url)
+        settings = pool_settings()
+        cursorclass.query_timeout = settings["query_timeout"]
+        cursorclass.retries = settings["retries"]
+
+        # Создаем SSL-контекст
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+        pool = await aiomysql.create_pool(
+            host=parsed.hostname,
+            port=parsed.port or 3306,
+            user=parsed.username,
+            password=parsed.password,
+            db=parsed.path.lstrip('/'),  # убираем начальный "/"
+            autocommit=True,
+            ssl=ssl_context,
+            cursorclass=cursorclass,
+            minsize=settings["minsize"],
+            maxsize=settings["maxsize"],
+            pool_recycle=settings["recycle"],
+            connect_timeout=settings["connect_timeout"]
+        )
+        return cls(pool, acquire_timeout=settings["acquire_timeout"], on_acquire=on_acquire)
+
+    @asynccontextmanager
+    async def acquire(self):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            # Не ждём бесконечно, если все соединения заняты зависшими запросами
+            conn = await asyncio.wait_for(self._pool.acquire(), self.acquire_timeout)
+        finally:
+            self.waiting -= 1
+        if self.on_acquire:
+            self.on_acquire(time.perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            self._pool.release(conn)
+
+    def stats(self) -> dict:
+        return {
+            "in_use": self._pool.size - self._pool.freesize,
+            "free": self._pool.freesize,
+            "waiting": self.waiting,
+            "max": self._pool.maxsize,
+        }
+
+    async def close(self):
+        self._pool.close()
+        await self._pool.wait_closed()
+
+
+# --- SQLite ---
+
+# Стандартные адаптеры дат в sqlite3 устарели: храним ISO-строки сами
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATE", lambda raw: date.fromisoformat(raw.decode()))
+sqlite3.register_converter("DATETIME", lambda raw: datetime.fromisoformat(raw.decode()))
+
+_VALUES_REF = re.compile(r"\bVALUES\((\w+)\)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def translate(sql: str) -> str:
+    """MySQL-диалект запросов db.py -> SQLite"""
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"\bINSERT IGNORE\b", "INSERT OR IGNORE", sql, flags=re.IGNORECASE)
+    # Писатель один, транзакция и так исключительная
+    sql = re.sub(r"\bFOR UPDATE( SKIP LOCKED)?", "", sql, flags=re.IGNORECASE)
+    if re.search(r"\bON DUPLICATE KEY UPDATE\b", sql, re.IGNORECASE):
+        sql = re.sub(r"\bON DUPLICATE KEY UPDATE\b", "ON CONFLICT DO UPDATE SET", sql,
+                     flags=re.IGNORECASE)
+        sql = _VALUES_REF.sub(r"excluded.\1", sql)
+    return sql
+
+
+def _datediff(end, start):
+    if end is None or start is None:
+        return None
+    return (date.fromisoformat(end[:10]) - date.fromisoformat(start[:10])).days
+
+
+def _connect(path: str, uri: bool, read_only: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path, uri=uri, isolation_level=None, check_same_thread=False,
+        detect_types=sqlite3.PARSE_DECLTYPES
+    )
+    conn.execute("PRAGMA busy_timeout = 5000")
+    if not read_only:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    else:
+        conn.execute("PRAGMA query_only = 1")
+    conn.create_function("DATEDIFF", 2, _datediff, deterministic=True)
+    return conn
+
+
+class _Worker:
+    """Соединение sqlite3 и собственный поток: все вызовы к соединению идут через него"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def query(self, timeout: float | None, *args):
+        """execute() в потоке соединения; по таймауту запрос прерывается"""
+        try:
+            return await asyncio.wait_for(self.run(self.execute, *args), timeout)
+        except asyncio.TimeoutError:
+            self.conn.interrupt()
+            raise
+
+    def execute(self, sql: str, args, many: bool, as_dict: bool):
+        cur = self.conn.cursor()
+        try:
+            if many:
+                cur.executemany(sql, args)
+            else:
+                cur.execute(sql, args or ())
+            rows = cur.fetchall() if cur.description else []
+            columns = [d[0] for d in cur.description] if cur.description else []
+            if as_dict:
+                rows = [dict(zip(columns, row)) for row in rows]
+            return rows, columns, cur.rowcount, cur.lastrowid
+        finally:
+            cur.close()
+
+    def close(self):
+        self.conn.close()
+        self._executor.shutdown(wait=False)
+
+
+class SQLiteCursor:
+    def __init__(self, conn: "SQLiteConnection", as_dict: bool):
+        self._conn = conn
+        self._as_dict = as_dict
+        self.query_timeout = conn.backend.query_timeout
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    async def execute(self, query, args=None):
+        return await self._run(query, args, many=False)
+
+    async def executemany(self, query, args):
+        if not args:
+            return 0
+        return await self._run(query, list(args), many=True)
+
+    async def _run(self, query, args, many):
+        sql = translate(query)
+        started = time.perf_counter()
+        rows, columns, self.rowcount, self.lastrowid = await self._conn._execute(
+            sql, args, many, self._as_dict, self.query_timeout
+        )
+        self.description = [(name,) + (None,) * 6 for name in columns] or None
+        self._rows = list(rows)
+        if self._conn.backend.on_execute:
+            self._conn.backend.on_execute(
+                time.perf_counter() - started, len(rows) if columns else self.rowcount
+            )
+        return self.rowcount
+
+    async def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    async def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    async def close(self):
+        self._rows = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class SQLiteConnection:
+    """Аналог соединения aiomysql в режиме autocommit.
+
+    Чтения вне транзакции идут в пул читателей, записи и транзакции — в
+    единственное пишущее соединение под замком.
+    """
+
+    def __init__(self, backend: "SQLiteBackend"):
+        self.backend = backend
+        self._in_transaction = False
+
+    def cursor(self, cursor_class=None) -> SQLiteCursor:
+        # aiomysql.DictCursor и его наследники задают dict_type
+        return SQLiteCursor(self, as_dict=getattr(cursor_class, "dict_type", None) is not None)
+
+    async def _execute(self, sql, args, many, as_dict, timeout):
+        backend = self.backend
+        if self._in_transaction:
+            return await backend.writer.query(timeout, sql, args, many, as_dict)
+        if backend.readers and not many and _READ_QUERY.match(sql):
+            reader = await backend.wait_for(backend.readers.get())
+            try:
+                return await reader.query(timeout, sql, args, many, as_dict)
+            finally:
+                backend.readers.put_nowait(reader)
+        await backend.wait_for(backend.write_lock.acquire())
+        try:
+            return await backend.writer.query(timeout, sql, args, many, as_dict)
+        finally:
+            backend.write_lock.release()
+
+    async def begin(self):
+        await self.backend.wait_for(self.backend.write_lock.acquire())
+        try:
+            await self.backend.writer.run(self.backend.writer.conn.execute, "BEGIN IMMEDIATE")
+        except Exception:
+            self.backend.write_lock.release()
+            raise
+        self._in_transaction = True
+
+    async def commit(self):
+        await self._finish("COMMIT")
+
+    async def rollback(self):
+        await self._finish("ROLLBACK")
+
+    async def _finish(self, statement: str):
+        # Вне транзакции (autocommit) — ничего не делаем, как aiomysql
+        if not self._in_transaction:
+            return
+        writer = self.backend.writer
+        try:
+            # Прерванный по таймауту запрос SQLite откатывает вместе с транзакцией
+            if writer.conn.in_transaction or statement == "COMMIT":
+                await writer.run(writer.conn.execute, statement)
+        finally:
+            self._in_transaction = False
+            self.backend.write_lock.release()
+
+
+class SQLiteBackend:
+    """SQLite в режиме WAL: одно пишущее соединение и пул читающих.
+
+    Каждое соединение работает в своём потоке, event loop не блокируется.
+    Для ":memory:" читателей нет — все запросы идут в пишущее соединение.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str, readers: int = 4, query_timeout: float | None = None,
+                 acquire_timeout: float | None = None, on_execute=None, on_acquire=None):
+        self.path = path
+        self.query_timeout = query_timeout
+        self.acquire_timeout = acquire_timeout
+        self.on_execute = on_execute
+        self.on_acquire = on_acquire
+        self.waiting = 0
+        in_memory = path == ":memory:"
+        self.writer = _Worker(_connect(path, uri=False, read_only=False))
+        self.write_lock = asyncio.Lock()
+        self.readers = None
+        self.reader_count = 0 if in_memory else readers
+        if self.reader_count:
+            self.readers = asyncio.Queue()
+            for _ in range(readers):
+                self.readers.put_nowait(_Worker(_connect(path, uri=False, read_only=True)))
+
+    @classmethod
+    async def create(cls, url: str, on_execute=None, on_acquire=None):
+        # sqlite:///bot.db — относительный путь, sqlite:////var/lib/bot.db — абсолютный
+        path = url.split("://", 1)[1][1:] or ":memory:"
+        settings = pool_settings()
+        return cls(
+            path,
+            readers=max(1, settings["maxsize"] - 1),  # плюс одно пишущее соединение
+            query_timeout=settings["query_timeout"],
+            acquire_timeout=settings["acquire_timeout"],
+            on_execute=on_execute,
+            on_acquire=on_acquire
+        )
+
+    async def wait_for(self, acquire):
+        """Ждёт читателя или писателя не дольше acquire_timeout, учитывая ожидание"""
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            result = await asyncio.wait_for(acquire, self.acquire_timeout)
+        finally:
+            self.waiting -= 1
+        if self.on_acquire:
+            self.on_acquire(time.perf_counter() - started)
+        return result
+
+    def stats(self) -> dict:
+        free = (self.readers.qsize() if self.readers else 0) + (not self.write_lock.locked())
+        return {
+            "in_use": self.reader_count + 1 - free,
+            "free": free,
+            "waiting": self.waiting,
+            "max": self.reader_count + 1,
+        }
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = SQLiteConnection(self)
+        try:
+            yield conn
+        finally:
+            # Незавершённую транзакцию откатываем, чтобы освободить писателя
+            await conn.rollback()
+
+    async def close(self):
+        async with self.write_lock:
+            self.writer.close()
+        while self.readers and not self.readers.empty():
+            self.readers.get_nowait().close()
+
+
+async def connect(url: str, cursorclass=aiomysql.Cursor, on_execute=None, on_acquire=None):
+    """Пул по URL: схема mysql:// — MySQLBackend, sqlite:// — SQLiteBackend"""
+    scheme = urlparse(url).scheme
+    if scheme == "sqlite":
+        return await SQLiteBackend.create(url, on_execute=on_execute, on_acquire=on_acquire)
+    if scheme.startswith("mysql"):
+        return await MySQLBackend.create(url, cursorclass=cursorclass, on_acquire=on_acquire)
+    raise ValueError(f"Неизвестная схема URL базы данных: {scheme!r}")
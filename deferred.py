@@ -0,0 +1,68 @@
+import itertools
+import json
+import logging
+from datetime import datetime, timedelta
+
+import db
+from scheduler import scheduler
+
+# Отложенная задача, опоздавшая больше чем на сутки (бот долго лежал), отбрасывается
+MAX_DELAY = timedelta(days=1)
+POLL_INTERVAL = 10  # секунд между проверками deferred_jobs
+BATCH_SIZE = 100
+
+# Обработчики по типу задачи: по имени задачу можно поднять из БД после рестарта
+_handlers = {}
+_seq = itertools.count(1)
+
+
+def handler(kind: str):
+    """Декоратор: регистрирует обработчик отложенных задач типа kind"""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+async def defer(kind: str, delay: float, persist: bool = False, **payload):
+    """Ставит задачу kind(**payload) в очередь через delay секунд.
+
+    С persist=True задача сохраняется в deferred_jobs, переживает рестарт и
+    выполняется в процессе с фоновыми задачами; payload при этом должен
+    сериализоваться в JSON.
+    """
+    run_at = datetime.now() + timedelta(seconds=delay)
+    if persist:
+        # Выполнит процесс с фоновыми задачами (run_due), а не тот, что поставил
+        await db.save_deferred_job(kind, json.dumps(payload), run_at)
+        return
+    scheduler.at(
+        f"deferred:{kind}:{next(_seq)}", run_at, _run, kind, payload,
+        misfire_grace=MAX_DELAY.total_seconds()
+    )
+
+
+async def _run(kind: str, payload: dict):
+    await _handlers[kind](**payload)
+
+
+async def run_due():
+    """Выполняет сохранённые задачи, срок которых наступил.
+
+    Задачу забирает тот, кто удалил её строку, поэтому она выполняется не
+    больше одного раза, даже если run_due идёт в нескольких процессах.
+    """
+    while True:
+        jobs = await db.get_due_deferred_jobs(datetime.now(), BATCH_SIZE)
+        for job in jobs:
+            if not await db.delete_deferred_job(job['id']):
+                continue
+            if job['kind'] not in _handlers or datetime.now() - job['run_at'] > MAX_DELAY:
+                logging.warning(f"Отложенная задача #{job['id']} устарела и удалена")
+                continue
+            try:
+                await _handlers[job['kind']](**json.loads(job['payload']))
+            except Exception as e:
+                logging.error(f"Отложенная задача #{job['id']} ({job['kind']}) не выполнена: {e}")
+        if len(jobs) < BATCH_SIZE:
+            return
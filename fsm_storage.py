@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import db
+from cache import TTLCache
+
+# Состояние, которое не менялось дольше этого, считается брошенным и удаляется
+STATE_TTL = timedelta(days=1)
+
+
+class MySQLStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states на общем пуле db.db_pool.
+
+    Чтения обслуживает ограниченный LRU-кэш (запись кэша живёт cache_ttl
+    секунд). Кэш годится, только когда апдейты пользователя приходят в один
+    процесс (polling); если процессов несколько, передавайте cache_ttl=0 —
+    тогда каждое чтение идёт в БД. Записи копятся в памяти и уходят в БД
+    одним запросом на следующем шаге event loop, поэтому пара
+    set_state + update_data в обработчике стоит одно обращение к БД.
+    """
+
+    def __init__(self, cache_size: int = 10000, cache_ttl: float = 30):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+        # Ключ -> изменённые поля {'state': ..., 'data': ...}, ещё не записанные в БД
+        self._pending = {}
+        # Изменения, которые flush() пишет прямо сейчас: до коммита их нет в БД
+        self._inflight = {}
+        # Ключ -> поля, записанные в БД, пока по ключу идёт чтение (по словарю на чтение)
+        self._reading = {}
+        self._flush_task = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._write(key, state=state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._read(key))['state']
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(key, data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._read(key))['data'].copy()
+
+    async def close(self) -> None:
+        await self.flush()
+
+    async def _read(self, key: StorageKey) -> dict:
+        raw_key = self.key_builder.build(key)
+        if self._cache is not None:
+            record = self._cache.get(raw_key)
+            if record is not None:
+                return record
+        # Запись, закоммиченная во время чтения, могла в него не попасть
+        committed = {}
+        self._reading.setdefault(raw_key, []).append(committed)
+        try:
+            row = await db.get_fsm_record(raw_key, datetime.now() - STATE_TTL)
+        finally:
+            readers = self._reading[raw_key]
+            readers.remove(committed)
+            if not readers:
+                del self._reading[raw_key]
+        record = {
+            'state': row['state'] if row else None,
+            'data': json.loads(row['data']) if row and row['data'] else {},
+        }
+        # Изменения этого процесса новее того, что прочитано из БД
+        record.update(committed)
+        record.update(self._inflight.get(raw_key, {}))
+        record.update(self._pending.get(raw_key, {}))
+        if self._cache is not None:
+            self._cache.set(raw_key, record)
+        return record
+
+    async def _write(self, key: StorageKey, **fields):
+        raw_key = self.key_builder.build(key)
+        record = self._cache.get(raw_key) if self._cache is not None else None
+        if record is not None:
+            record.update(fields)
+            self._cache.set(raw_key, record)
+        self._pending.setdefault(raw_key, {}).update(fields)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        # Отдаём управление, чтобы соседние записи того же обработчика попали в ту же пачку
+        await asyncio.sleep(0)
+        await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения в БД"""
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            self._inflight = pending
+            rows, deleted = [], []
+            for raw_key, fields in pending.items():
+                if fields.get('state', 1) is None and fields.get('data', 1) == {}:
+                    deleted.append(raw_key)  # state.clear() — строка больше не нужна
+                else:
+                    data = fields.get('data')
+                    rows.append((
+                        raw_key,
+                        'state' in fields,
+                        fields.get('state'),
+                        'data' in fields,
+                        json.dumps(data, ensure_ascii=False) if data is not None else None,
+                    ))
+            try:
+                await db.save_fsm_records(rows, deleted)
+            except Exception as e:
+                self._inflight = {}
+                logging.error(f"Не удалось сохранить состояния FSM: {e}")
+                # Возвращаем в очередь под более свежими изменениями и повторим позже
+                for raw_key, fields in pending.items():
+                    self._pending[raw_key] = {**fields, **self._pending.get(raw_key, {})}
+                asyncio.get_running_loop().call_later(1, self._schedule_flush)
+                return
+            self._inflight = {}
+            for raw_key, fields in pending.items():
+                for committed in self._reading.get(raw_key, ()):
+                    committed.update(fields)
+
+    async def expire(self):
+        """Удаляет брошенные состояния (задание планировщика)"""
+        await db.expire_fsm_records(datetime.now() - STATE_TTL)
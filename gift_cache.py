@@ -0,0 +1,115 @@
+"""Кэш советов по подаркам: одинаковые запросы не ходят в OpenRouter повторно.
+
+Ключ — нормализованный текст запроса («Подарок маме, бюджет 3 000!» и
+«подарок маме бюджет 3000» совпадают, порядок слов важен). Записи живут
+CACHE_TTL секунд, при переполнении вытесняются давно не запрошенные. С path
+ответы дописываются в JSONL-файл и переживают рестарт (в bot.py —
+GIFT_CACHE_PATH).
+Одинаковые запросы, пришедшие, пока первый ещё генерируется, ждут его
+результат вместо собственного вызова.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+import metrics
+from cache import TTLCache
+
+CACHE_SIZE = 1000
+CACHE_TTL = 24 * 3600  # секунд
+
+_WORD = re.compile(r"\w+")
+_DIGIT_GROUPS = re.compile(r"(?<=\d)[\s.,](?=\d{3}\b)")
+
+requests_total = metrics.Counter(
+    "bot_gift_cache_requests_total", "Запросы советов по подаркам по исходу: hit, shared, miss",
+    ("result",)
+)
+
+
+def normalize(text: str) -> str:
+    """Ключ кэша: регистр, ё, пунктуация и разделители тысяч не важны.
+
+    Порядок и повторы слов сохраняются: «не люблю спорт, люблю книги» и
+    «не люблю книги, люблю спорт» — разные запросы.
+    """
+    text = _DIGIT_GROUPS.sub("", text.lower().replace("ё", "е"))
+    return " ".join(_WORD.findall(text))
+
+
+class GiftCache:
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL, path: str | None = None):
+        self.ttl = ttl
+        self.path = path
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight = {}
+        if path:
+            self._load()
+
+    async def get_or_create(self, text: str, create) -> str:
+        """Ответ из кэша или результат await create(); ошибки не кэшируются"""
+        key = normalize(text)
+        answer = self._cache.get(key)
+        if answer is not None:
+            requests_total.inc(result="hit")
+            return answer
+        task = self._inflight.get(key)
+        if task is not None:
+            requests_total.inc(result="shared")
+            # shield: отмена одного ожидающего не отменяет генерацию для остальных
+            return await asyncio.shield(task)
+        requests_total.inc(result="miss")
+        task = self._inflight[key] = asyncio.ensure_future(self._create(key, text, create))
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        # Ошибку забираем здесь: ожидающих к этому моменту может не остаться
+        if not task.cancelled() and task.exception():
+            logging.debug(f"Кэш подарков: генерация не удалась: {task.exception()}")
+
+    async def _create(self, key: str, text: str, create) -> str:
+        # Отдельной задачей: ответ попадёт в кэш, даже если первый запросивший ушёл
+        answer = await create()
+        self._cache.set(key, answer)
+        if self.path:
+            await asyncio.to_thread(self._append, key, answer, text)
+        return answer
+
+    def _load(self):
+        """Поднимает живые записи из файла и переписывает его без устаревших"""
+        now = time.time()
+        entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        # Исходный текст запроса (4-й элемент) нужен каталогу подарков
+                        created, key, answer, *text = json.loads(line)
+                    except ValueError:
+                        continue
+                    if now - created < self.ttl:
+                        entries[key] = (created, answer, text)
+        except FileNotFoundError:
+            return
+        for key, (created, answer, _) in sorted(entries.items(), key=lambda item: item[1][0]):
+            self._cache.set(key, answer, ttl=self.ttl - (now - created))
+        # В файле остаются только записи, попавшие в кэш
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for key, (created, answer, text) in entries.items():
+                if key in self._cache:
+                    f.write(json.dumps([created, key, answer, *text], ensure_ascii=False) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        logging.info(f"Кэш подарков: загружено {len(self._cache)} ответов из {self.path}")
+
+    def _append(self, key: str, answer: str, text: str):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps([time.time(), key, answer, text], ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.warning(f"Кэш подарков: не удалось записать {self.path}: {e}")
+
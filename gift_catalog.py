@@ -0,0 +1,416 @@
+"""Локальный каталог идей подарков: похожий запрос отвечается без OpenRouter.
+
+Каталог — прошлые ответы модели (запрос -> варианты подарков). Запросы
+ищутся по TF-IDF на символьных n-граммах: признаки хешируются в DIM
+корзин, индекс хранится столбцами (для каждого признака — строки, где он
+встречается, и вес), поэтому запрос из десятка слов трогает только свои
+признаки, а не весь каталог. Косинусная близость считается в NumPy.
+
+Адресат (мама, коллега...) и ценовой диапазон — жёсткие фильтры, поэтому
+близость считается только по интересам: из запроса убираются адресат,
+суммы и общие слова («подарок», «бюджет», «любит»...), иначе они дают
+высокую близость запросам про разные увлечения. Найденный ответ годится,
+если совпали адресат и диапазон, а близость не ниже MIN_SCORE; запросы для
+нескольких адресатов и с отрицанием («не любит спорт») каталог не берёт —
+их отвечает модель.
+
+Файлы в каталоге (GIFT_CATALOG_DIR):
+    entries.jsonl   — все записи {"request", "answer", "at"}, источник правды
+    index/*.npy     — собранный индекс, открывается через mmap при старте
+
+Новые принятые ответы сразу ищутся из памяти, а каждые REBUILD_EVERY
+записей индекс пересобирается в фоне и подменяется целиком.
+
+    python gift_catalog.py seed gift_cache.jsonl ...  — добавить прошлые ответы и собрать индекс
+    python gift_catalog.py build                      — пересобрать индекс
+    python gift_catalog.py query "подарок маме 3000"  — проверить поиск
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from gift_cache import _DIGIT_GROUPS, normalize
+
+DIM = 1 << 18              # корзин хеширования признаков
+NGRAMS = (3, 4, 5)         # длины символьных n-грамм
+MIN_SCORE = 0.75           # косинусная близость интересов, с которой ответ каталога принимается
+REBUILD_EVERY = 100        # новых записей до фоновой пересборки индекса
+MIN_ANSWER_LENGTH = 200    # короче — скорее отказ или обрыв, в каталог не берём
+
+# Адресат подарка по словоформам (ё -> е); 0 — не понятно
+PERSONAS = {
+    1: ("мама", "мамы", "маме", "маму", "мамой", "мамочка", "мамочки", "мамочке", "мамочку",
+        "мамуля", "мамули", "мамуле", "мать", "матери"),
+    2: ("папа", "папы", "папе", "папу", "папой", "папочке", "папуле", "отец", "отца", "отцу", "отцом"),
+    3: ("бабушка", "бабушки", "бабушке", "бабушку", "бабуля", "бабули", "бабуле"),
+    4: ("дедушка", "дедушки", "дедушке", "дедушку", "дед", "деда", "деду", "дедуле"),
+    5: ("муж", "мужа", "мужу", "мужем"),
+    6: ("жена", "жены", "жене", "жену", "женой"),
+    7: ("парень", "парня", "парню", "парнем", "бойфренд", "бойфренда", "бойфренду"),
+    8: ("девушка", "девушки", "девушке", "девушку", "девушкой"),
+    9: ("сын", "сына", "сыну", "сыном", "дочь", "дочери", "дочка", "дочки", "дочке", "дочку",
+        "ребенок", "ребенка", "ребенку", "дети", "детей", "детям"),
+    10: ("друг", "друга", "другу", "другом", "друзей", "друзьям",
+         "подруга", "подруги", "подруге", "подругу", "подругой"),
+    11: ("коллега", "коллеги", "коллеге", "коллегу", "коллег", "коллегам", "начальник", "начальника",
+         "начальнику", "начальница", "начальницы", "начальнице", "босс", "босса", "боссу",
+         "руководитель", "руководителя", "руководителю"),
+    12: ("брат", "брата", "брату", "братом", "братику"),
+    13: ("сестра", "сестры", "сестре", "сестру", "сестренке"),
+    14: ("учитель", "учителя", "учителю", "учителям", "учительница", "учительницы", "учительнице",
+         "преподаватель", "преподавателя", "преподавателю"),
+}
+SEVERAL_PERSONAS = -1  # в запросе несколько адресатов — каталог не угадывает, кому подарок
+_PERSONA_BY_WORD = {word: code for code, words in PERSONAS.items() for word in words}
+# Верхние границы ценовых диапазонов в рублях; 0 — бюджет не указан
+BUDGET_BANDS = (1000, 3000, 10000, 30000)
+
+_NUMBER = re.compile(r"(\d+(?:[.,]\d+)?)\s*(к\b|k\b|тыс\w*)?(?!\d)")
+_DIGIT = re.compile(r"\d")
+
+# Слова, которые есть почти в каждом запросе и ничего не говорят об интересах
+STOPWORDS = frozenset("""
+    подарок подарка подарку подарком подарки подарков подарить подарю подари
+    что чем какой какая какое какие какую идея идеи идей вариант варианты
+    посоветуй посоветуйте подскажи подскажите помоги нужен нужна нужно хочу хочется
+    для на в во с со и а или но до от за по о об про к у из около примерно
+    бюджет бюджета бюджетом рублей рубля рубль руб р тыс тысяч тысячи тысяча k
+    он она они ему ей им его ее их мой моя мое мои моему моей моего моим мне я
+    любит любят нравится нравятся увлекается увлекаются интересуется интересуются
+    лет года год
+""".split())
+# Отрицание меняет смысл, а на похожесть n-грамм почти не влияет
+NEGATIONS = frozenset(("не", "нет", "без", "кроме", "ни"))
+FEATURES_VERSION = 2       # меняется вместе с features(): индекс старой версии пересобирается
+
+requests_total = metrics.Counter(
+    "bot_gift_catalog_requests_total", "Поиск в каталоге подарков: hit, miss", ("result",)
+)
+
+
+def persona(text: str) -> int:
+    """Код адресата подарка; от порядка слов не зависит, одинаков для запроса и ключа кэша"""
+    codes = {_PERSONA_BY_WORD.get(word) for word in normalize(text).split()} - {None}
+    if len(codes) > 1:
+        return SEVERAL_PERSONAS
+    return codes.pop() if codes else 0
+
+
+def budget_band(text: str) -> int:
+    """Ценовой диапазон по самой большой сумме в тексте: 1..len(BUDGET_BANDS)+1, 0 — нет суммы"""
+    amounts = []
+    # «1 500» и «3.000» — одно число, а не 1 и 500
+    text = _DIGIT_GROUPS.sub("", text.lower().replace("ё", "е"))
+    for number, suffix in _NUMBER.findall(text):
+        value = float(number.replace(",", "."))
+        if suffix:
+            value *= 1000
+        elif 2020 <= value < 2100:
+            continue  # скорее год, чем бюджет
+        amounts.append(value)
+    # Возраст и количество не путаем с бюджетом: меньше 100 рублей не бывает
+    amounts = [amount for amount in amounts if amount >= 100]
+    if not amounts:
+        return 0
+    amount = max(amounts)
+    for band, bound in enumerate(BUDGET_BANDS, start=1):
+        if amount <= bound:
+            return band
+    return len(BUDGET_BANDS) + 1
+
+
+def interests(text: str) -> str:
+    """Часть запроса про интересы: без адресата, сумм и общих слов"""
+    return " ".join(
+        word for word in normalize(text).split()
+        if word not in _PERSONA_BY_WORD and word not in STOPWORDS and not _DIGIT.search(word)
+    )
+
+
+def has_negation(text: str) -> bool:
+    return not NEGATIONS.isdisjoint(normalize(text).split())
+
+
+def features(text: str) -> dict[int, float]:
+    """Хешированные символьные n-граммы интересов запроса с весом 1 + log(tf)"""
+    text = interests(text)
+    if not text:
+        return {}
+    text = f" {text} "
+    counts = {}
+    for n in NGRAMS:
+        for i in range(len(text) - n + 1):
+            feature = zlib.crc32(text[i:i + n].encode()) % DIM
+            counts[feature] = counts.get(feature, 0) + 1
+    return {feature: 1 + math.log(count) for feature, count in counts.items()}
+
+
+def build_index(requests: list[str], path: Path):
+    """Собирает индекс по запросам в каталог path (файлы .npy)"""
+    rows, cols, tfs = [], [], []
+    for row, request in enumerate(requests):
+        for feature, tf in features(request).items():
+            rows.append(row)
+            cols.append(feature)
+            tfs.append(tf)
+    rows = np.array(rows, dtype=np.int32)
+    cols = np.array(cols, dtype=np.int32)
+    tfs = np.array(tfs, dtype=np.float32)
+
+    count = len(requests)
+    df = np.bincount(cols, minlength=DIM)
+    idf = (np.log((count + 1) / (df + 1)) + 1).astype(np.float32)
+    weights = tfs * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=count))
+    weights /= np.maximum(norms, 1e-9)[rows].astype(np.float32)
+
+    # По столбцам: строки каждого признака подряд, indptr — границы признаков
+    order = np.argsort(cols, kind="stable")
+    indptr = np.zeros(DIM + 1, dtype=np.int64)
+    np.cumsum(df, out=indptr[1:])
+
+    path.mkdir(parents=True, exist_ok=True)
+    np.save(path / "indptr.npy", indptr)
+    np.save(path / "rows.npy", rows[order])
+    np.save(path / "weights.npy", weights[order].astype(np.float32))
+    np.save(path / "idf.npy", idf)
+    np.save(path / "persona.npy", np.array([persona(r) for r in requests], dtype=np.int8))
+    np.save(path / "band.npy", np.array([budget_band(r) for r in requests], dtype=np.int8))
+    (path / "meta.json").write_text(json.dumps(
+        {"count": count, "dim": DIM, "ngrams": NGRAMS, "features": FEATURES_VERSION}
+    ))
+
+
+class _Index:
+    """Собранный индекс, открытый через mmap: страницы читаются с диска по мере надобности"""
+
+    def __init__(self, path: Path):
+        self.count = json.loads((path / "meta.json").read_text())["count"]
+        load = lambda name: np.load(path / f"{name}.npy", mmap_mode="r")
+        self.indptr = load("indptr")
+        self.rows = load("rows")
+        self.weights = load("weights")
+        self.idf = load("idf")
+        self.persona = load("persona")
+        self.band = load("band")
+
+    def vector(self, text: str) -> dict[int, float]:
+        vector = {feature: tf * float(self.idf[feature]) for feature, tf in features(text).items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {feature: w / norm for feature, w in vector.items()}
+
+    def search(self, vector: dict[int, float], who: int, band: int) -> tuple[int, float]:
+        """Лучшая строка индекса и её близость; (-1, 0.0), если подходящих нет"""
+        if not self.count:
+            return -1, 0.0
+        slices = [(self.indptr[f], self.indptr[f + 1], w) for f, w in vector.items()]
+        slices = [(start, end, w) for start, end, w in slices if end > start]
+        if not slices:
+            return -1, 0.0
+        rows = np.concatenate([self.rows[start:end] for start, end, _ in slices])
+        weights = np.concatenate([self.weights[start:end] * w for start, end, w in slices])
+        scores = np.bincount(rows, weights=weights, minlength=self.count)
+        scores[(self.persona != who) | (self.band != band)] = 0
+        best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+
+class GiftCatalog:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.entries = []     # [(запрос, ответ)] в порядке entries.jsonl
+        self._index = None
+        self._indexed = 0     # сколько первых записей покрывает индекс
+        self._recent = {}     # номер записи вне индекса -> (вектор, адресат, бюджет)
+        self._rebuild_task = None
+        self._tasks = set()   # фоновые записи новых ответов
+        self._load()
+
+    def _load(self):
+        entries_path = self.path / "entries.jsonl"
+        if entries_path.exists():
+            with open(entries_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries.append((entry["request"], entry["answer"]))
+        meta_path = self.path / "index" / "meta.json"
+        # Индекс прежней версии признаков не открываем: ensure_index соберёт новый
+        if meta_path.exists() and json.loads(meta_path.read_text()).get("features") == FEATURES_VERSION:
+            self._index = _Index(self.path / "index")
+            self._indexed = min(self._index.count, len(self.entries))
+        if self.entries:
+            logging.info(f"Каталог подарков: {len(self.entries)} записей, в индексе {self._indexed}")
+
+    def search(self, text: str) -> str | None:
+        """Ответ из каталога для похожего запроса или None"""
+        if not self.entries:
+            return None
+        who, band = persona(text), budget_band(text)
+        if who == SEVERAL_PERSONAS or has_negation(text):
+            requests_total.inc(result="miss")
+            return None
+        best, score = -1, 0.0
+        if self._index is not None:
+            vector = self._index.vector(text)
+            best, score = self._index.search(vector, who, band)
+            # Записи после последней сборки сравниваются напрямую, с весами idf того же индекса
+            for row in range(self._indexed, len(self.entries)):
+                if row not in self._recent:
+                    request = self.entries[row][0]
+                    self._recent[row] = (self._index.vector(request), persona(request), budget_band(request))
+                other, other_who, other_band = self._recent[row]
+                if other_who != who or other_band != band:
+                    continue
+                similarity = sum(w * other.get(f, 0.0) for f, w in vector.items())
+                if similarity > score:
+                    best, score = row, similarity
+        if best < 0 or score < MIN_SCORE:
+            requests_total.inc(result="miss")
+            return None
+        requests_total.inc(result="hit")
+        return self.entries[best][1]
+
+    def accept(self, request: str, answer: str):
+        """Принимает новый ответ модели в каталог фоном, не задерживая ответ пользователю"""
+        if len(answer) < MIN_ANSWER_LENGTH:
+            return
+        task = asyncio.create_task(self.add(request, answer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(_log_task_error)
+
+    async def add(self, request: str, answer: str):
+        """Дописывает ответ в entries.jsonl; не записанный на диск в каталог не попадает"""
+        if len(answer) < MIN_ANSWER_LENGTH:
+            return
+        line = json.dumps({"request": request, "answer": answer, "at": int(time.time())},
+                          ensure_ascii=False)
+        if not await asyncio.to_thread(self._append, line):
+            return
+        self.entries.append((request, answer))
+        if len(self.entries) - self._indexed >= REBUILD_EVERY or self._index is None:
+            self.rebuild_in_background()
+
+    def _append(self, line: str) -> bool:
+        # Номера строк индекса — это номера записей в файле: без записи нельзя и в память
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / "entries.jsonl", "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logging.warning(f"Каталог подарков: не удалось записать {self.path}: {e}")
+            return False
+        return True
+
+    def ensure_index(self):
+        """При старте: пересобрать индекс, если записи добавлены после сборки"""
+        if self._indexed < len(self.entries):
+            self.rebuild_in_background()
+
+    def rebuild_in_background(self):
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = asyncio.create_task(self.rebuild())
+            self._rebuild_task.add_done_callback(_log_task_error)
+
+    async def rebuild(self):
+        """Пересобирает индекс в потоке и подменяет открытый"""
+        requests = [request for request, _ in self.entries]
+        started = time.perf_counter()
+        await asyncio.to_thread(self._build, requests)
+        self._index = _Index(self.path / "index")
+        self._indexed = len(requests)
+        self._recent.clear()  # векторы считались с idf прежнего индекса
+        logging.info(f"Каталог подарков: индекс на {len(requests)} записей собран "
+                     f"за {time.perf_counter() - started:.2f} с")
+
+    def _build(self, requests: list[str]):
+        new, current, old = (self.path / name for name in ("index.new", "index", "index.old"))
+        shutil.rmtree(new, ignore_errors=True)
+        build_index(requests, new)
+        # Открытые mmap старого индекса остаются валидными и после удаления файлов
+        shutil.rmtree(old, ignore_errors=True)
+        if current.exists():
+            os.replace(current, old)
+        os.replace(new, current)
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _log_task_error(task):
+    if not task.cancelled() and task.exception():
+        logging.error(f"Ошибка фоновой задачи каталога подарков: {task.exception()!r}")
+
+
+def _read_seed(path: str) -> list[tuple[str, str]]:
+    """Прошлые ответы: файл кэша подарков ([время, ключ, ответ, запрос]) или {"request", "answer"}
+
+    В старых строках кэша ([время, ключ, ответ]) вместо запроса только ключ —
+    набор слов без порядка, по нему не прочесть бюджет, такие строки пропускаются.
+    """
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, list) and len(item) == 4:
+                pairs.append((item[3], item[2]))
+            elif isinstance(item, dict) and "request" in item and "answer" in item:
+                pairs.append((item["request"], item["answer"]))
+    return pairs
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["seed", "build", "query"])
+    parser.add_argument("args", nargs="*", help="файлы для seed или текст запроса для query")
+    parser.add_argument("--path", default=os.getenv("GIFT_CATALOG_DIR", "data/gift_catalog"))
+    args = parser.parse_args()
+
+    catalog = GiftCatalog(args.path)
+    if args.command == "query":
+        text = " ".join(args.args)
+        print(f"адресат {persona(text)}, бюджет {budget_band(text)}")
+        print(catalog.search(text) or "— нет подходящего ответа")
+        return 0
+    if args.command == "seed":
+        known = {normalize(request) for request, _ in catalog.entries}
+        added = 0
+        for path in args.args:
+            for request, answer in _read_seed(path):
+                if normalize(request) in known or len(answer) < MIN_ANSWER_LENGTH:
+                    continue
+                known.add(normalize(request))
+                line = json.dumps({"request": request, "answer": answer, "at": int(time.time())},
+                                  ensure_ascii=False)
+                if not catalog._append(line):
+                    return 1
+                catalog.entries.append((request, answer))
+                added += 1
+        print(f"Добавлено записей: {added}")
+    started = time.perf_counter()
+    catalog._build([request for request, _ in catalog.entries])
+    print(f"Индекс на {len(catalog.entries)} записей собран за {time.perf_counter() - started:.2f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Сообщение, которое дописывается по мере генерации ответа.
+
+Текст правится на месте через edit_text не чаще раза в EDIT_INTERVAL
+секунд: у Telegram свой лимит на правки, а частые правки одного сообщения
+получают RetryAfter. Незаконченный кусок Markdown (открытая *, _, `, ```
+или [) перед отправкой закрывается, чтобы Telegram не отклонил разметку.
+"""
+import asyncio
+import logging
+import re
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+EDIT_INTERVAL = 1.5        # секунд между правками одного сообщения
+MIN_GROWTH = 20            # символов, ради которых стоит править ещё раз
+MAX_LENGTH = 4096          # предел длины сообщения Telegram
+MARKUP_RESERVE = 64        # запас длины под символы, добавленные repair_markdown
+CURSOR = " ▌"              # признак, что ответ ещё пишется
+
+_DOUBLE_MARKERS = re.compile(r"\*\*|__")
+
+
+def repair_markdown(text: str) -> str:
+    """Приводит текст к разметке, которую примет parse_mode="Markdown".
+
+    **жирный** и __курсив__ из ответов моделей становятся *жирным* и _курсивом_,
+    незакрытые *, _, ` и ``` закрываются в конце, а [ без пары экранируется.
+    """
+    text = _DOUBLE_MARKERS.sub(lambda m: m.group(0)[0], text)
+    result = []
+    open_marker = None   # внутри какого элемента разметки мы сейчас
+    link_start = None    # позиция [ в result, если ссылка ещё не закрыта
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if open_marker in ("`", "```"):
+            # Внутри кода разметка не действует, ищем только закрывающий маркер
+            if text.startswith(open_marker, i):
+                result.append(open_marker)
+                i += len(open_marker)
+                open_marker = None
+                continue
+            result.append(char)
+            i += 1
+            continue
+        if char == "\\" and i + 1 < len(text):
+            result.append(text[i:i + 2])
+            i += 2
+            continue
+        if text.startswith("```", i) and open_marker is None:
+            open_marker = "```"
+            result.append("```")
+            i += 3
+            continue
+        if char == "_" and open_marker is None and _inside_word(text, i):
+            # snake_case и подобное — не курсив
+            result.append("\\")
+        elif char in "*_`":
+            # Внутри * или _ чужой маркер — обычный символ (вложенности нет)
+            if open_marker is None:
+                open_marker = char
+            elif open_marker == char:
+                open_marker = None
+        elif char == "[" and open_marker is None and link_start is None:
+            link_start = len(result)
+        elif char == "]" and link_start is not None:
+            # Ссылка считается целой, только если сразу идёт (адрес)
+            end = text.find(")", i)
+            if text.startswith("(", i + 1) and end != -1:
+                result.append(text[i:end + 1])
+                i = end + 1
+                link_start = None
+                continue
+            result.insert(link_start, "\\")
+            link_start = None
+        result.append(char)
+        i += 1
+    if link_start is not None:
+        result.insert(link_start, "\\")
+    if open_marker is not None:
+        if open_marker == "```" and not result[-1].endswith("\n"):
+            result.append("\n")
+        result.append(open_marker)
+    return "".join(result)
+
+
+def _inside_word(text: str, i: int) -> bool:
+    return 0 < i < len(text) - 1 and text[i - 1].isalnum() and text[i + 1].isalnum()
+
+
+def split_text(text: str, limit: int = MAX_LENGTH) -> list[str]:
+    """Режет длинный текст на сообщения по границам строк"""
+    parts, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current or not parts:
+        parts.append(current)
+    return parts
+
+
+class LiveMessage:
+    """Правит одно сообщение по мере роста текста: update() по частям, finish() в конце"""
+
+    def __init__(self, message, header: str = ""):
+        self.message = message
+        self.header = header
+        self._text = ""
+        self._shown = ""
+        self._restarted = False
+        self._last_edit = 0.0
+        self._task = None
+
+    def update(self, text: str):
+        """Запоминает текущий текст; правка уходит фоном, не задерживая поток ответа.
+
+        Текст, который не продолжает прежний, — ответ начался заново (шлюз
+        перешёл на запасную модель): показанное убирается ближайшей правкой.
+        """
+        if not text.startswith(self._text):
+            self._shown = ""
+            self._restarted = True
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def finish(self, text: str):
+        """Показывает окончательный текст; не влезающее в одно сообщение уходит следующими"""
+        await self.cancel()
+        first, *rest = split_text(text, MAX_LENGTH - MARKUP_RESERVE - len(self.header))
+        await self._edit(self.header + first, final=True)
+        for part in rest:
+            await self._send(part)
+
+    async def cancel(self):
+        """Останавливает промежуточные правки"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # Не удалась промежуточная правка — окончательная попробует ещё раз
+                logging.warning(f"Не удалось обновить сообщение: {e}")
+            self._task = None
+
+    async def _run(self):
+        while self._restarted or len(self._text) - len(self._shown) >= MIN_GROWTH:
+            delay = self._last_edit + EDIT_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = self._text
+            preview = text[:MAX_LENGTH - MARKUP_RESERVE - len(self.header) - len(CURSOR) - 1]
+            if len(preview) < len(text):
+                preview += "…"
+            self._restarted = False
+            await self._edit(self.header + preview + CURSOR)
+            if not self._restarted:  # за время правки ответ мог снова начаться заново
+                self._shown = text
+
+    async def _edit(self, text: str, final: bool = False):
+        self._last_edit = time.monotonic()
+        try:
+            await self.message.edit_text(repair_markdown(text), parse_mode="Markdown")
+        except TelegramRetryAfter as e:
+            if not final:
+                # Промежуточную правку можно пропустить, следующая будет позже
+                self._last_edit = time.monotonic() + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            await self._edit(text, final)
+        except TelegramBadRequest as e:
+            if "not modified" in e.message:
+                return
+            if "parse" not in e.message:
+                raise
+            # Разметку не удалось починить — показываем текст как есть
+            logging.warning(f"Разметка ответа не принята Telegram: {e.message}")
+            await self.message.edit_text(text)
+
+    async def _send(self, text: str):
+        try:
+            await self.message.answer(repair_markdown(text), parse_mode="Markdown")
+        except TelegramBadRequest as e:
+            if "parse" not in e.message:
+                raise
+            await self.message.answer(text)
@@ -0,0 +1,266 @@
+"""Шлюз к OpenRouter: все вызовы LLM идут через него.
+
+Что бы ни происходило у провайдера, бот остаётся отзывчивым:
+- одновременно выполняется не больше max_concurrency запросов, остальные
+  ждут слот не дольше QUEUE_TIMEOUT и получают LLMUnavailable;
+- у запроса есть сроки: до первого фрагмента, между фрагментами и общий;
+- у каждой модели свой автомат отключения (circuit breaker): после
+  нескольких ошибок подряд модель пропускается, пока не пройдёт пауза;
+- модели перебираются по порядку списка, при ошибке берётся следующая;
+- с хеджированием, если первая модель молчит дольше своего p95 времени до
+  первого фрагмента, параллельно запускается следующая, побеждает та,
+  что ответит первой.
+
+Настройки из окружения читает from_env (после load_dotenv).
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+
+DEFAULT_MODELS = [
+    "deepseek/deepseek-chat-v3-0324:free",
+    "meta-llama/llama-3.3-70b-instruct:free",
+]
+QUEUE_TIMEOUT = 5           # секунд ожидания свободного слота
+FIRST_TOKEN_TIMEOUT = 20    # секунд до первого фрагмента ответа
+STALL_TIMEOUT = 15          # секунд тишины между фрагментами
+CALL_DEADLINE = 90          # секунд на весь вызов со всеми запасными моделями
+FAILURE_THRESHOLD = 3       # ошибок подряд, после которых модель отключается
+RESET_AFTER = 60            # секунд до пробного запроса к отключённой модели
+HEDGE_MIN_SAMPLES = 20      # замеров, после которых p95 модели считается известным
+
+hedged_total = metrics.Counter(
+    "bot_llm_hedged_total", "Запросы, для которых запущена запасная модель", ("model",)
+)
+rejected_total = metrics.Counter(
+    "bot_llm_rejected_total", "Запросы, отклонённые шлюзом сразу", ("reason",)
+)
+
+
+_gateways = []
+circuit_open = metrics.Gauge(
+    "bot_llm_circuit_open", "1, если модель отключена автоматом",
+    lambda: {model: int(breaker.is_open)
+             for gateway in _gateways for model, breaker in gateway._breakers.items()},
+    ("model",)
+)
+
+
+class LLMUnavailable(Exception):
+    """Шлюз не стал ждать провайдера: все модели отключены или нет свободного слота"""
+
+
+class CircuitBreaker:
+    """Закрыт — запросы идут; открыт — отклоняются; после паузы — один пробный запрос"""
+
+    def __init__(self, name: str, threshold: int = FAILURE_THRESHOLD, reset_after: float = RESET_AFTER):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def available(self) -> bool:
+        """Можно ли рассчитывать на модель (без побочных эффектов)"""
+        return not self.is_open or (
+            not self.probing and time.monotonic() - self.opened_at >= self.reset_after
+        )
+
+    def allow(self) -> bool:
+        """Пропускает запрос; у открытого автомата — только один пробный после паузы"""
+        if not self.available():
+            return False
+        if self.is_open:
+            self.probing = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            if not self.is_open:
+                logging.warning(f"LLM: модель {self.name} отключена после ошибок подряд")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self):
+        """Запрос отменён, не дойдя до результата: пробу можно повторить"""
+        self.probing = False
+
+
+class LLMGateway:
+    def __init__(self, client, models: list[str], max_concurrency: int = 4, hedge: bool = False):
+        self.client = client
+        self.models = models
+        self.hedge = hedge
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._breakers = {model: CircuitBreaker(model) for model in models}
+        self._first_token = {model: deque(maxlen=200) for model in models}
+        _gateways.append(self)
+
+    async def complete(self, messages: list[dict], on_text=None, temperature: float = 0.7) -> str:
+        """Текст ответа первой сработавшей модели.
+
+        on_text(текст_на_сейчас) вызывается по мере прихода фрагментов; при
+        переходе на запасную модель текст начинается заново.
+        """
+        if not any(breaker.available() for breaker in self._breakers.values()):
+            rejected_total.inc(reason="circuit_open")
+            raise LLMUnavailable("все модели временно отключены")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            rejected_total.inc(reason="queue_full")
+            raise LLMUnavailable("нет свободного слота для запроса") from None
+        try:
+            # Срок проверяется в каждом ожидании _stream: зависшая до него модель
+            # получает TimeoutError и считается отказом своего автомата
+            deadline = time.monotonic() + CALL_DEADLINE
+            return await self._with_fallback(messages, on_text, temperature, deadline)
+        finally:
+            self._slots.release()
+
+    async def _with_fallback(self, messages, on_text, temperature, deadline) -> str:
+        remaining = [model for model in self.models if self._breakers[model].available()]
+        error = LLMUnavailable("все модели временно отключены")
+        while remaining and time.monotonic() < deadline:
+            failed_models = []
+            try:
+                return await self._race(remaining[:2], messages, on_text, temperature, deadline,
+                                        failed_models)
+            except Exception as e:
+                error = e
+                logging.warning(f"LLM: {failed_models or remaining[:1]} не ответили: {e!r}")
+            # Запасная модель, которую только отменили, остаётся в очереди
+            failed_models = failed_models or remaining[:1]
+            remaining = [model for model in remaining if model not in failed_models]
+        raise error
+
+    async def _race(self, models, messages, on_text, temperature, deadline, failed_models) -> str:
+        """Первая модель списка; вторая — только при хеджировании, если первая медлит.
+
+        В failed_models попадают модели, завершившиеся ошибкой (не отменённые).
+        """
+        winner = None
+        tasks = {}
+
+        def forward(model):
+            def callback(text):
+                nonlocal winner
+                if winner is None:
+                    winner = model
+                    # Ответ пошёл — проигравшую модель больше не ждём
+                    for other, task in tasks.items():
+                        if other != model:
+                            task.cancel()
+                if winner == model and on_text:
+                    on_text(text)
+            return callback
+
+        def start(model):
+            tasks[model] = asyncio.create_task(
+                self._stream(model, messages, temperature, deadline, forward(model))
+            )
+
+        start(models[0])
+        try:
+            delay = self._hedge_delay(models[0]) if self.hedge and len(models) > 1 else None
+            if delay is not None and delay < deadline - time.monotonic():
+                await asyncio.wait(tasks.values(), timeout=delay)
+                if winner is None and not tasks[models[0]].done():
+                    hedged_total.inc(model=models[0])
+                    start(models[1])
+            error = None
+            task_models = {task: model for model, task in tasks.items()}
+            pending = set(tasks.values())
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    failed_models.append(task_models[task])
+            raise error or LLMUnavailable("запрос отменён")
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    def _hedge_delay(self, model: str) -> float | None:
+        samples = self._first_token[model]
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    async def _stream(self, model: str, messages, temperature, deadline, on_text) -> str:
+        breaker = self._breakers[model]
+        if not breaker.allow():
+            raise LLMUnavailable(f"модель {model} временно отключена")
+        started = time.perf_counter()
+        parts = []
+        try:
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=model, messages=messages, temperature=temperature, stream=True
+                ),
+                max(min(FIRST_TOKEN_TIMEOUT, deadline - time.monotonic()), 0)
+            )
+            chunks = stream.__aiter__()
+            while True:
+                timeout = STALL_TIMEOUT if parts else FIRST_TOKEN_TIMEOUT - (time.perf_counter() - started)
+                timeout = min(timeout, deadline - time.monotonic())
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), max(timeout, 0))
+                except StopAsyncIteration:
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    latency = time.perf_counter() - started
+                    self._first_token[model].append(latency)
+                    metrics.openrouter_first_token.observe(latency, model=model)
+                parts.append(delta)
+                on_text("".join(parts).strip())
+            answer = "".join(parts).strip()
+            if not answer:
+                raise ValueError("модель вернула пустой ответ")
+        except asyncio.CancelledError:
+            # Отменили проигравшую хеджированную модель или весь запрос — модель не виновата
+            breaker.release()
+            metrics.observe_openrouter(model, "cancelled", started)
+            raise
+        except Exception as e:
+            breaker.failure()
+            metrics.observe_openrouter(model, type(e).__name__, started)
+            raise
+        breaker.success()
+        metrics.observe_openrouter(model, "ok", started)
+        return answer
+
+
+def from_env(client) -> LLMGateway:
+    """Шлюз с настройками окружения: LLM_MODELS (через запятую, по приоритету),
+    LLM_MAX_CONCURRENCY, LLM_HEDGE=1 — включить хеджирование"""
+    models = [m.strip() for m in os.getenv("LLM_MODELS", "").split(",") if m.strip()]
+    return LLMGateway(
+        client,
+        models=models or DEFAULT_MODELS,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 4)),
+        hedge=os.getenv("LLM_HEDGE", "0") == "1"
+    )
@@ -0,0 +1,171 @@
+"""Метрики процесса в текстовом формате Prometheus (GET /metrics веб-процесса).
+
+Счётчики и гистограммы живут в памяти процесса; у каждого инстанса свои,
+суммирует Prometheus.
+"""
+import time
+from collections import defaultdict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = defaultdict(float)
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[tuple(labels.get(name, "") for name in self.labels)] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """Значение снимается в момент запроса /metrics функцией collect() -> {метки: значение}"""
+
+    def __init__(self, name: str, help_text: str, collect, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.collect().items()):
+            key = key if isinstance(key, tuple) else (key,) if self.labels else ()
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.labels, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# --- Метрики бота ---
+
+handler_duration = Histogram(
+    "bot_handler_duration_seconds", "Время обработчика апдейта", ("handler",)
+)
+handler_errors = Counter(
+    "bot_handler_errors_total", "Исключения, вылетевшие из обработчика", ("handler",)
+)
+db_query_duration = Histogram(
+    "bot_db_query_duration_seconds", "Время запроса к БД по функциям db.py", ("query",)
+)
+db_query_rows = Counter(
+    "bot_db_query_rows_total", "Строк прочитано или изменено запросами", ("query",)
+)
+db_pool_wait = Histogram(
+    "bot_db_pool_wait_seconds", "Ожидание свободного соединения в пуле БД"
+)
+openrouter_requests = Counter(
+    "bot_openrouter_requests_total", "Запросы к OpenRouter", ("model", "status")
+)
+openrouter_duration = Histogram(
+    "bot_openrouter_duration_seconds", "Время ответа OpenRouter", ("model",),
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+openrouter_first_token = Histogram(
+    "bot_openrouter_first_token_seconds", "Время до первого фрагмента потокового ответа", ("model",),
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 20, 30)
+)
+telegram_requests = Counter(
+    "bot_telegram_requests_total", "Вызовы Telegram Bot API", ("method",)
+)
+telegram_errors = Counter(
+    "bot_telegram_api_errors_total", "Ошибки Telegram Bot API", ("method", "error")
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого обработчика по его имени"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, handler=name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: считает вызовы API и ошибки по методу и классу ошибки"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        telegram_requests.inc(method=name)
+        try:
+            return await make_request(bot, method)
+        except TelegramAPIError as e:
+            telegram_errors.inc(method=name, error=type(e).__name__)
+            raise
+
+
+def observe_openrouter(model: str, status: str, started: float):
+    """Учитывает запрос к OpenRouter; started — time.perf_counter() перед запросом"""
+    openrouter_requests.inc(model=model, status=status)
+    openrouter_duration.observe(time.perf_counter() - started, model=model)
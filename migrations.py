@@ -0,0 +1,390 @@
+"""Схема БД: версионные миграции и проверка запросов db.py через EXPLAIN.
+
+    python migrations.py          — применить недостающие миграции
+    python migrations.py --check  — EXPLAIN каждого запроса из db.py; код
+                                    выхода 1, если какой-то запрос читает
+                                    таблицу целиком без подходящего индекса
+
+Таблицы, столбцы и индексы, которые нужны новому коду, добавляются новой
+версией в MIGRATIONS в том же изменении, что и сам код: иначе код уедет
+на сервер раньше схемы, которую он читает.
+"""
+import ast
+import asyncio
+import re
+import sys
+from pathlib import Path
+
+
+def add_index(table: str, name: str, columns: str, unique: bool = False):
+    """Шаг миграции: создать индекс, если его ещё нет (в MySQL нет CREATE INDEX IF NOT EXISTS)"""
+    async def step(cur, dialect):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        if dialect == "sqlite":
+            await cur.execute(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns})")
+            return
+        await cur.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+        """, (table, name))
+        if not await cur.fetchone():
+            await cur.execute(f"CREATE {kind} {name} ON {table} ({columns})")
+    return step
+
+
+def add_column(table: str, column: str, definition: str):
+    """Шаг миграции: добавить столбец, если его ещё нет"""
+    async def step(cur, dialect):
+        if dialect == "sqlite":
+            await cur.execute(f"SELECT 1 FROM pragma_table_info('{table}') WHERE name = %s", (column,))
+        else:
+            await cur.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            """, (table, column))
+        if not await cur.fetchone():
+            await cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+# (версия, описание, шаги). Шаг — SQL-строка (DDL MySQL) или корутина step(cur, dialect).
+# Новые миграции добавляются только в конец, старые не меняются.
+MIGRATIONS = [
+    (1, "исходные таблицы", [
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            event_name VARCHAR(255) NOT NULL,
+            event_date DATE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS gift_usage (
+            user_id BIGINT PRIMARY KEY,
+            calls_today INT NOT NULL DEFAULT 0,
+            last_call_date DATE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            admin_id BIGINT NOT NULL,
+            message TEXT,
+            success_count INT NOT NULL DEFAULT 0,
+            failed_count INT NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "индексы под запросы по user_id, дате и last_call_date", [
+        # Выборки событий пользователя, лимит, планировщик напоминаний, DISTINCT user_id
+        add_index("events", "idx_events_user_date", "user_id, event_date"),
+        # Активные пользователи в get_stats
+        add_index("events", "idx_events_date_user", "event_date, user_id"),
+        add_index("gift_usage", "idx_gift_usage_date", "last_call_date, calls_today"),
+    ]),
+    (3, "статистика рассылок", [
+        add_column("broadcasts", "retry_count", "INT NOT NULL DEFAULT 0"),
+        add_column("broadcasts", "duration_sec", "FLOAT NOT NULL DEFAULT 0"),
+        add_column("broadcasts", "messages_per_sec", "FLOAT NOT NULL DEFAULT 0"),
+    ]),
+    (4, "задания рассылок с контрольными точками", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            admin_id BIGINT NOT NULL,
+            from_chat_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            message TEXT,
+            status VARCHAR(16) NOT NULL,
+            cursor_user_id BIGINT NOT NULL DEFAULT 0,
+            success_count INT NOT NULL DEFAULT 0,
+            failed_count INT NOT NULL DEFAULT 0,
+            retry_count INT NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_broadcast_jobs_status (status)
+        )
+        """,
+    ]),
+    (5, "напоминания: расписание, outbox и история", [
+        """
+        CREATE TABLE IF NOT EXISTS reminder_settings (
+            user_id BIGINT PRIMARY KEY,
+            timezone VARCHAR(64) NOT NULL,
+            remind_hour TINYINT NOT NULL,
+            remind_minute TINYINT NOT NULL,
+            next_remind_at DATETIME NOT NULL,
+            local_date DATE NOT NULL,
+            INDEX idx_reminder_settings_due (next_remind_at)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reminder_outbox (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            idempotency_key VARCHAR(64) NOT NULL,
+            user_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            event_id INT,
+            delete_event BOOLEAN NOT NULL DEFAULT FALSE,
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME NOT NULL,
+            claimed_at DATETIME,
+            sent_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_reminder_outbox_key (idempotency_key),
+            INDEX idx_reminder_outbox_due (status, next_attempt_at),
+            INDEX idx_reminder_outbox_claimed (status, claimed_at)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reminder_history (
+            user_id BIGINT PRIMARY KEY,
+            last_notified DATE NOT NULL
+        )
+        """,
+    ]),
+    (6, "отложенные задачи", [
+        """
+        CREATE TABLE IF NOT EXISTS deferred_jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(32) NOT NULL,
+            payload TEXT NOT NULL,
+            run_at DATETIME NOT NULL,
+            INDEX idx_deferred_jobs_run_at (run_at)
+        )
+        """,
+    ]),
+    (7, "счётчики статистики", [
+        """
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name VARCHAR(64) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (8, "состояния FSM", [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            storage_key VARCHAR(255) PRIMARY KEY,
+            state VARCHAR(255),
+            data TEXT,
+            updated_at DATETIME NOT NULL,
+            INDEX idx_fsm_states_updated (updated_at)
+        )
+        """,
+    ]),
+    (9, "реестр пользователей", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            first_seen_at DATETIME NOT NULL,
+            last_seen_at DATETIME NOT NULL
+        )
+        """,
+        # Уже известные пользователи — те, у кого есть события
+        """
+        INSERT IGNORE INTO users (user_id, username, first_seen_at, last_seen_at)
+        SELECT user_id, MAX(username), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM events
+        GROUP BY user_id
+        """,
+    ]),
+    (10, "недоступные чаты", [
+        add_column("users", "blocked_at", "DATETIME NULL"),
+    ]),
+    (11, "отметка пересчёта статистики", [
+        # Строка всегда есть: сбросы счётчиков блокируют её, а не пустой промежуток индекса
+        "INSERT IGNORE INTO stats_counters (name, value) VALUES ('recomputed_at_ms', 0)",
+    ]),
+    (12, "дата напоминания в outbox", [
+        # reminder_history пишется при доставке, ей нужна локальная дата напоминания
+        add_column("reminder_outbox", "local_date", "DATE"),
+    ]),
+]
+
+
+_INLINE_INDEX = re.compile(r",\s*(UNIQUE KEY|INDEX)\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+
+
+def sqlite_ddl(sql: str) -> list[str]:
+    """CREATE TABLE в диалекте MySQL -> операторы SQLite.
+
+    Индексы, объявленные внутри таблицы, выносятся в отдельные CREATE INDEX.
+    """
+    table = re.search(r"CREATE TABLE IF NOT EXISTS (\w+)", sql, re.IGNORECASE)
+    indexes = []
+    for kind, name, columns in _INLINE_INDEX.findall(sql):
+        unique = "UNIQUE " if kind.upper().startswith("UNIQUE") else ""
+        indexes.append(
+            f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {table.group(1)} ({columns})"
+        )
+    sql = _INLINE_INDEX.sub("", sql)
+    sql = re.sub(r"\b(BIG)?INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT",
+                 sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\s+ON UPDATE CURRENT_TIMESTAMP", "", sql, flags=re.IGNORECASE)
+    return [sql] + indexes
+
+
+async def _execute_ddl(cur, sql: str, dialect: str):
+    for statement in sqlite_ddl(sql) if dialect == "sqlite" else [sql]:
+        await cur.execute(statement)
+
+
+async def migrate(pool):
+    """Применяет миграции, которых ещё нет в schema_version. Вызывается из db.init_db_pool"""
+    dialect = pool.dialect
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            # CREATE INDEX и заполнение таблиц на больших данных идут дольше DB_QUERY_TIMEOUT,
+            # а прерванная миграция повторялась бы при каждом старте
+            cur.query_timeout = None
+            await _execute_ddl(cur, """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255),
+                    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """, dialect)
+            await cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current = (await cur.fetchone())[0]
+
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        await step(cur, dialect)
+                    else:
+                        await _execute_ddl(cur, step, dialect)
+                await cur.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                print(f"✅ Миграция {version}: {description}")
+
+
+# --- Проверка запросов через EXPLAIN ---
+
+# Функции db.py, которые читают таблицу целиком намеренно
+SCAN_ALLOWED = {
+}
+
+# Подстановки вместо %s: EXPLAIN не принимает параметры
+_DATE_PARAM = re.compile(r"(date|_at|_notified)\s*(<=|>=|<>|=|<|>)\s*$", re.IGNORECASE)
+_LIMIT_PARAM = re.compile(r"LIMIT\s*$", re.IGNORECASE)
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|UPDATE|DELETE|INSERT\b.*\bSELECT\b)", re.IGNORECASE | re.DOTALL)
+
+
+def _sql_text(node, constants: dict) -> str | None:
+    """SQL из аргумента execute: строка, константа модуля, .format() или f-строка"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Name):
+        return constants.get(node.id)
+    if isinstance(node, ast.JoinedStr):
+        # Подставляемые части — списки плейсхолдеров для IN (...)
+        return "".join(
+            part.value if isinstance(part, ast.Constant) else "%s"
+            for part in node.values
+        )
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "format"):
+        base = _sql_text(node.func.value, constants)
+        if base is not None:
+            return re.sub(r"\{\w+\}", "%s", base)
+    return None
+
+
+def collect_queries(path: Path) -> list[tuple[str, str]]:
+    """Все запросы, которые функции db.py передают в cur.execute/executemany"""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    constants = {
+        target.id: node.value.value
+        for node in tree.body if isinstance(node, ast.Assign)
+        and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+        for target in node.targets if isinstance(target, ast.Name)
+    }
+    queries = []
+    for func in tree.body:
+        if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for node in ast.walk(func):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ("execute", "executemany") and node.args):
+                sql = _sql_text(node.args[0], constants)
+                if sql:
+                    queries.append((func.name, sql))
+    return queries
+
+
+def with_sample_params(sql: str) -> str:
+    parts = sql.split("%s")
+    out = [parts[0]]
+    for part in parts[1:]:
+        before = "".join(out)
+        if _LIMIT_PARAM.search(before):
+            out.append("100")
+        elif _DATE_PARAM.search(before):
+            out.append("'2000-01-01'")
+        else:
+            out.append("'1'")
+        out.append(part)
+    # FOR UPDATE внутри EXPLAIN не нужен
+    return re.sub(r"FOR UPDATE( SKIP LOCKED)?", "", "".join(out))
+
+
+async def check(pool, path: Path) -> list[str]:
+    """EXPLAIN каждого запроса; возвращает описания запросов с полным сканированием.
+
+    Полное сканирование — строка плана с type = ALL по настоящей таблице,
+    для которой у оптимизатора нет ни одного подходящего индекса
+    (possible_keys пуст). На почти пустой таблице MySQL может выбрать
+    сканирование и при наличии индекса — это не считается ошибкой.
+    """
+    problems = []
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            for func_name, sql in collect_queries(path):
+                if not _EXPLAINABLE.match(sql):
+                    continue
+                await cur.execute("EXPLAIN " + with_sample_params(sql))
+                columns = [d[0] for d in cur.description]
+                for row in await cur.fetchall():
+                    plan = dict(zip(columns, row))
+                    table = plan.get("table") or ""
+                    if (plan.get("type") == "ALL" and not plan.get("possible_keys")
+                            and not table.startswith("<") and func_name not in SCAN_ALLOWED):
+                        problems.append(f"{func_name}: полное сканирование таблицы {table}")
+    return problems
+
+
+async def main(argv: list[str]) -> int:
+    from dotenv import load_dotenv
+    import db
+
+    load_dotenv()
+    await db.init_db_pool()  # применяет миграции
+    if "--check" not in argv:
+        return 0
+    if db.db_pool.dialect != "mysql":
+        print("Проверка EXPLAIN доступна только для MySQL")
+        return 0
+
+    problems = await check(db.db_pool, Path(db.__file__))
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print("✅ Все запросы db.py используют индексы")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,48 @@
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Часовой пояс и час напоминаний для пользователей, которые их не меняли
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Europe/Moscow")
+DEFAULT_HOUR = 20
+
+
+def default_minute(user_id: int) -> int:
+    """Минута внутри часа напоминаний: размазывает пользователей по 60 корзинам"""
+    return user_id % 60
+
+
+def get_zone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def utc_now() -> datetime:
+    """Текущее время UTC без tzinfo — в таком виде оно хранится в БД"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def next_reminder(tz_name: str, hour: int, minute: int, after: datetime) -> tuple[datetime, date]:
+    """Следующее напоминание строго после after (UTC, naive).
+
+    Возвращает время в UTC (naive) и локальную дату пользователя в этот момент.
+    """
+    zone = get_zone(tz_name)
+    local_now = after.replace(tzinfo=timezone.utc).astimezone(zone)
+    local_day = local_now.date()
+    while True:
+        local_fire = datetime.combine(local_day, time(hour, minute), tzinfo=zone)
+        fire_utc = local_fire.astimezone(timezone.utc).replace(tzinfo=None)
+        if fire_utc > after:
+            return fire_utc, local_day
+        local_day += timedelta(days=1)
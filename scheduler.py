@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+
+class Cron:
+    """Расписание в формате cron: "минута час день месяц день_недели".
+
+    Поддерживаются *, числа, списки (1,15), диапазоны (1-5) и шаг (*/10).
+    День недели: 0 или 7 — воскресенье. Если заданы и день месяца, и день
+    недели, срабатывает любой из них, как в обычном cron.
+    """
+
+    _bounds = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Ожидается 5 полей cron: {expr!r}")
+        self.expr = expr
+        parsed = [self._parse(f, lo, hi) for f, (lo, hi) in zip(fields, self._bounds)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # В cron воскресенье — 0 и 7, в Python — 6
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> list[int]:
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start, end = map(int, part.split("-"))
+            else:
+                start = end = int(part)
+            if start < lo or end > hi or start > end:
+                raise ValueError(f"Значение вне диапазона {lo}-{hi}: {field!r}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return sorted(values)
+
+    def _day_matches(self, day) -> bool:
+        if day.month not in self.months:
+            return False
+        by_day = day.day in self.days
+        by_weekday = day.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return by_day and by_weekday
+        return by_day or by_weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайшее время срабатывания строго после moment"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = moment.date()
+        # Пять лет хватает для любого корректного выражения (в т.ч. 29 февраля)
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                same_day = day == moment.date()
+                for hour in self.hours:
+                    if same_day and hour < moment.hour:
+                        continue
+                    for minute in self.minutes:
+                        if same_day and hour == moment.hour and minute < moment.minute:
+                            continue
+                        return datetime(day.year, day.month, day.day, hour, minute)
+            day += timedelta(days=1)
+        raise ValueError(f"Выражение cron никогда не срабатывает: {self.expr!r}")
+
+    def prev_before(self, moment: datetime, limit: timedelta) -> datetime | None:
+        """Последнее срабатывание не раньше moment - limit (для пропущенных запусков)"""
+        fire = self.next_after(moment - limit - timedelta(minutes=1))
+        if fire > moment:
+            return None
+        while True:
+            following = self.next_after(fire)
+            if following > moment:
+                return fire
+            fire = following
+
+
+class Job:
+    def __init__(self, name: str, func, args: tuple, cron: Cron | None = None,
+                 interval: float | None = None, misfire_grace: float = 60):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.cron = cron
+        self.interval = interval
+        self.misfire_grace = misfire_grace
+        self.next_run = None
+        self.task = None
+
+    def next_after(self, moment: datetime) -> datetime | None:
+        if self.cron:
+            return self.cron.next_after(moment)
+        if self.interval:
+            return moment + timedelta(seconds=self.interval)
+        return None  # разовое задание
+
+
+class Scheduler:
+    """Планировщик задач в процессе: куча по времени следующего запуска.
+
+    Цикл спит ровно до ближайшего задания, а не просыпается каждую минуту.
+    Запуск, опоздавший больше чем на misfire_grace секунд (занятый event
+    loop, перевод часов), пропускается. Задание не запускается повторно,
+    пока не завершился его предыдущий запуск.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._runner = None
+
+    def cron(self, name: str, expr: str, func, *args, misfire_grace: float = 60) -> Job:
+        """Регистрирует задание по расписанию cron.
+
+        Если процесс стартовал в пределах misfire_grace после времени запуска,
+        задание выполняется сразу, а не ждёт следующего срабатывания.
+        """
+        job = Job(name, func, args, cron=Cron(expr), misfire_grace=misfire_grace)
+        now = datetime.now()
+        missed = job.cron.prev_before(now, timedelta(seconds=misfire_grace))
+        self._schedule(job, missed or job.cron.next_after(now))
+        return job
+
+    def every(self, name: str, seconds: float, func, *args) -> Job:
+        """Регистрирует задание, повторяющееся каждые seconds секунд"""
+        job = Job(name, func, args, interval=seconds, misfire_grace=seconds)
+        self._schedule(job, datetime.now() + timedelta(seconds=seconds))
+        return job
+
+    def at(self, name: str, run_at: datetime, func, *args, misfire_grace: float = 60) -> Job:
+        """Регистрирует разовое задание на момент run_at"""
+        job = Job(name, func, args, misfire_grace=misfire_grace)
+        self._schedule(job, run_at)
+        return job
+
+    def _schedule(self, job: Job, run_at: datetime):
+        job.next_run = run_at
+        self._jobs[job.name] = job
+        heapq.heappush(self._heap, (run_at, next(self._seq), job))
+        self._wakeup.set()
+
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            self._runner = None
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            run_at, _, job = self._heap[0]
+            delay = (run_at - datetime.now()).total_seconds()
+            if delay > 0:
+                # Просыпаемся раньше, если добавили задание с более ранним сроком
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if self._jobs.get(job.name) is not job or job.next_run != run_at:
+                continue  # задание заменено или перенесено
+
+            self._fire(job, run_at)
+            next_run = job.next_after(max(run_at, datetime.now()))
+            if next_run:
+                self._schedule(job, next_run)
+            else:
+                self._jobs.pop(job.name, None)
+
+    def _fire(self, job: Job, run_at: datetime):
+        late = (datetime.now() - run_at).total_seconds()
+        if late > job.misfire_grace:
+            logging.warning(f"[Планировщик] {job.name}: пропущен запуск {run_at}, опоздание {late:.0f} с")
+            return
+        if job.task and not job.task.done():
+            logging.warning(f"[Планировщик] {job.name}: предыдущий запуск ещё идёт, пропускаем")
+            return
+        job.task = asyncio.create_task(self._execute(job))
+        # Держим ссылку, пока задача не завершится (разовые задания уже удалены из _jobs)
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _execute(job: Job):
+        try:
+            await job.func(*job.args)
+        except Exception as e:
+            logging.error(f"[Планировщик] {job.name}: ошибка: {e}")
+
+
+scheduler = Scheduler()
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from datetime import datetime
+
+import db
+from cache import TTLCache
+
+FLUSH_INTERVAL = 10        # секунд между записью накопленных приращений
+RECOMPUTE_INTERVAL = 3600  # секунд между точными пересчётами из events/gift_usage
+SNAPSHOT_TTL = 30          # секунд, сколько админ-панель видит один и тот же снимок
+
+_snapshot = TTLCache(maxsize=1, ttl=SNAPSHOT_TTL)
+_recompute_task = None
+
+
+async def flush():
+    """Пишет накопленные в db.counter_deltas приращения одним запросом"""
+    if not db.counter_deltas:
+        return
+    deltas = dict(db.counter_deltas)
+    db.counter_deltas.clear()
+    try:
+        await db.add_to_counters(deltas)
+    except Exception:
+        # Не теряем приращения: вернём их и попробуем в следующий раз
+        db.counter_deltas.update(deltas)
+        raise
+
+
+async def recompute():
+    """Точный пересчёт счётчиков полными запросами (в фоне, по расписанию).
+
+    Инкременты не учитывают удаления событий — пересчёт исправляет дрейф.
+    Активные за 30 дней считаются только здесь: приращениями их не выразить,
+    пользователь выпадает из них просто с течением времени.
+    """
+    totals = await db.get_stats()
+    await db.recompute_counters({'active_users': totals['active_users']})
+    _snapshot.clear()
+
+
+def _recompute_in_background():
+    global _recompute_task
+    if _recompute_task is None or _recompute_task.done():
+        _recompute_task = asyncio.create_task(recompute())
+        _recompute_task.add_done_callback(_log_recompute_error)
+
+
+def _log_recompute_error(task):
+    if not task.cancelled() and task.exception():
+        logging.error(f"Ошибка пересчёта статистики: {task.exception()}")
+
+
+async def get_snapshot() -> dict:
+    """Статистика для админ-панели: один запрос по первичному ключу, кэш на SNAPSHOT_TTL"""
+    snapshot = _snapshot.get('stats')
+    if snapshot is not None:
+        return snapshot
+
+    calls_name, users_name = db.gift_counter_names(datetime.now().date())
+    counters = await db.get_counters(
+        ['total_users', 'active_users', calls_name, users_name, db.RECOMPUTED_AT]
+    )
+    if 'total_users' not in counters:
+        # Счётчиков ещё нет (первый запуск) — посчитаем в фоне, панель не ждёт
+        _recompute_in_background()
+    # Приращения, ещё не записанные в БД, тоже учитываем
+    deltas = db.fresh_counter_deltas(db.counter_deltas, counters.get(db.RECOMPUTED_AT, 0))
+
+    def value(name):
+        return counters.get(name, 0) + deltas[name]
+
+    snapshot = {
+        'total_users': value('total_users'),
+        'active_users': value('active_users'),
+        'gift_used': value(calls_name),
+        'gift_users': value(users_name),
+        'gift_limit': db.GIFT_DAILY_LIMIT,
+    }
+    _snapshot.set('stats', snapshot)
+    return snapshot
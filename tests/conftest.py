@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Свежая база SQLite со всеми миграциями; -> функция, выполняющая корутину на ней"""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/bot.db")
+    monkeypatch.setattr(db, "counter_deltas", db.Counter())
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(db.init_db_pool())
+    yield loop.run_until_complete
+    loop.run_until_complete(db.db_pool.close())
+    loop.close()
+    db.db_pool = None
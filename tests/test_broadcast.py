@@ -0,0 +1,122 @@
+import asyncio
+import time
+from datetime import datetime
+
+import broadcast
+import db
+from broadcast import Broadcast, ChatLimiter, TokenBucket
+
+
+def acquire_times(bucket, count: int) -> list[float]:
+    """Сколько секунд от старта прошло к выдаче каждого из count токенов"""
+    async def scenario():
+        started = time.monotonic()
+        times = []
+        for _ in range(count):
+            await bucket.acquire()
+            times.append(time.monotonic() - started)
+        return times
+
+    return asyncio.run(scenario())
+
+
+def test_bucket_gives_burst_then_rate():
+    times = acquire_times(TokenBucket(rate=100, capacity=5), 10)
+    assert times[4] < 0.04               # запас capacity — сразу
+    assert 0.04 <= times[9] < 0.5        # ещё 5 токенов по 100 в секунду
+
+
+def test_bucket_pause_stops_all_tokens():
+    bucket = TokenBucket(rate=1000)
+    bucket.pause(0.05)
+    assert acquire_times(bucket, 1)[0] >= 0.045
+
+
+def test_chat_limiter_keeps_separate_buckets_and_evicts_old():
+    async def scenario():
+        limiter = ChatLimiter(rate=1000, max_chats=2)
+        for chat_id in (1, 2, 1, 3):
+            await limiter.acquire(chat_id)
+        return list(limiter._buckets)
+
+    # Чат 2 использовался давнее всех — его ведро вытеснено
+    assert asyncio.run(scenario()) == [1, 3]
+
+
+class FakeMessage:
+    async def delete(self):
+        pass
+
+    async def edit_text(self, text):
+        pass
+
+
+class FakeBot:
+    def __init__(self, on_copy=None):
+        self.delivered = []
+        self.on_copy = on_copy
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return FakeMessage()
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        self.delivered.append(chat_id)
+        if self.on_copy:
+            await self.on_copy()
+
+
+def queue_job(run, users: int) -> int:
+    now = datetime.now()
+    run(db.save_users([(user_id, "u", "U", now) for user_id in range(1, users + 1)]))
+    return run(db.create_broadcast_job(100, 100, 1, "привет"))
+
+
+def test_queued_job_is_claimed_once(sqlite_db):
+    run = sqlite_db
+    job_id = queue_job(run, 1)
+    claimed = run(db.claim_queued_broadcast_jobs())
+    assert [job['id'] for job in claimed] == [job_id]
+    assert claimed[0]['status'] == 'running'
+    assert run(db.claim_queued_broadcast_jobs()) == []
+
+
+def test_cancel_from_another_process_stops_at_checkpoint(sqlite_db, monkeypatch):
+    run = sqlite_db
+    monkeypatch.setattr(broadcast, "CHECKPOINT_SIZE", 1)
+    job_id = queue_job(run, 3)
+    job, = run(db.claim_queued_broadcast_jobs())
+
+    async def cancel_elsewhere():
+        # Другой инстанс пишет отмену только в БД
+        await db.cancel_broadcast_job(job_id)
+
+    bot = FakeBot(on_copy=cancel_elsewhere)
+    runner = Broadcast(bot, job)
+    run(runner.run())
+
+    assert bot.delivered == [1]
+    assert runner.cancelled
+    assert run(db.get_broadcast_job_status(job_id)) == 'cancelled'
+
+
+def test_finished_job_does_not_overwrite_cancel(sqlite_db):
+    run = sqlite_db
+    job_id = queue_job(run, 1)
+    job, = run(db.claim_queued_broadcast_jobs())
+
+    async def cancel_elsewhere():
+        await db.cancel_broadcast_job(job_id)
+
+    # Отмена пришла во время последней порции: итог не затирает её словом done
+    run(Broadcast(FakeBot(on_copy=cancel_elsewhere), job).run())
+    assert run(db.get_broadcast_job_status(job_id)) == 'cancelled'
+
+
+def test_resume_requeues_paused_job(sqlite_db):
+    run = sqlite_db
+    job_id = queue_job(run, 1)
+    run(db.claim_queued_broadcast_jobs())
+    assert not run(db.set_broadcast_job_status(job_id, 'queued', 'paused'))
+    run(db.pause_interrupted_broadcast_jobs())
+    assert run(db.set_broadcast_job_status(job_id, 'queued', 'paused'))
+    assert [job['id'] for job in run(db.claim_queued_broadcast_jobs())] == [job_id]
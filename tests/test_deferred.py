@@ -0,0 +1,64 @@
+import json
+from datetime import datetime, timedelta
+
+import db
+import deferred
+from scheduler import scheduler
+
+calls = []
+
+
+@deferred.handler("test_job")
+async def record(value):
+    calls.append(value)
+
+
+def save(run, kind: str, run_at: datetime, **payload) -> int:
+    return run(db.save_deferred_job(kind, json.dumps(payload), run_at))
+
+
+def test_persisted_job_is_left_to_run_due(sqlite_db):
+    run = sqlite_db
+    run(deferred.defer("test_job", 0, persist=True, value=1))
+    # Поставивший процесс задачу не планирует — её выполнит run_due
+    assert not any(name.startswith("deferred:") for name in scheduler._jobs)
+    calls.clear()
+    run(deferred.run_due())
+    assert calls == [1]
+
+
+def test_run_due_runs_each_job_once(sqlite_db):
+    run = sqlite_db
+    calls.clear()
+    now = datetime.now()
+    save(run, "test_job", now - timedelta(seconds=1), value="due")
+    save(run, "test_job", now + timedelta(hours=1), value="later")
+    run(deferred.run_due())
+    run(deferred.run_due())
+    assert calls == ["due"]
+
+
+def test_stale_and_unknown_jobs_are_dropped(sqlite_db):
+    run = sqlite_db
+    calls.clear()
+    now = datetime.now()
+    save(run, "test_job", now - deferred.MAX_DELAY - timedelta(minutes=1), value="stale")
+    save(run, "gone", now, value="unknown")
+    run(deferred.run_due())
+    assert calls == []
+    assert run(db.get_due_deferred_jobs(now + timedelta(days=2), 10)) == []
+
+
+def test_failed_job_does_not_block_others(sqlite_db):
+    run = sqlite_db
+    calls.clear()
+
+    @deferred.handler("broken_job")
+    async def broken():
+        raise RuntimeError("boom")
+
+    now = datetime.now()
+    save(run, "broken_job", now - timedelta(seconds=2))
+    save(run, "test_job", now - timedelta(seconds=1), value="after")
+    run(deferred.run_due())
+    assert calls == ["after"]
@@ -0,0 +1,36 @@
+from datetime import date
+
+import db
+
+
+def delete_elsewhere(run, user_id: int):
+    """Удаление из другого процесса: мимо функций db.py и их сброса кэша"""
+    async def delete():
+        async with db.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM events WHERE user_id = %s", (user_id,))
+
+    run(delete())
+
+
+def test_no_cache_by_default_sees_other_processes(sqlite_db, monkeypatch):
+    run = sqlite_db
+    monkeypatch.setattr(db, "events_cache", None)
+    run(db.save_event(1, "a", "ДР мамы", date(2099, 1, 1)))
+    assert len(run(db.get_user_events(1))) == 1
+    delete_elsewhere(run, 1)
+    assert run(db.get_user_events(1)) == []
+    assert run(db.check_events_limit(1))
+
+
+def test_enabled_cache_is_dropped_by_own_writes(sqlite_db, monkeypatch):
+    run = sqlite_db
+    monkeypatch.setattr(db, "events_cache", None)
+    db.enable_events_cache(300)
+    run(db.save_event(1, "a", "ДР мамы", date(2099, 1, 1)))
+    [event] = run(db.get_user_events(1))
+    assert db.events_cache.get(1) == [event]
+    run(db.delete_user_event(1, date(2099, 1, 1), "ДР мамы"))
+    assert run(db.get_user_events(1)) == []
+    db.enable_events_cache(0)
+    assert db.events_cache is None
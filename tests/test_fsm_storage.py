@@ -0,0 +1,77 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+import db
+from fsm_storage import MySQLStorage
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=2)
+
+
+class SlowTable:
+    """fsm_states в памяти: запись коммитится, когда тест откроет commit"""
+
+    def __init__(self):
+        self.rows = {}
+        self.commit = asyncio.Event()
+
+    async def get_fsm_record(self, raw_key, fresh_after):
+        row = self.rows.get(raw_key)
+        await asyncio.sleep(0.01)
+        return row
+
+    async def save_fsm_records(self, rows, deleted_keys):
+        await self.commit.wait()
+        for raw_key, has_state, state, has_data, data in rows:
+            row = self.rows.setdefault(raw_key, {'state': None, 'data': None})
+            if has_state:
+                row['state'] = state
+            if has_data:
+                row['data'] = data
+
+
+def run_with_table(monkeypatch, scenario):
+    table = SlowTable()
+    monkeypatch.setattr(db, "get_fsm_record", table.get_fsm_record)
+    monkeypatch.setattr(db, "save_fsm_records", table.save_fsm_records)
+    return asyncio.run(scenario(table))
+
+
+def test_read_during_flush_sees_write(monkeypatch):
+    async def scenario(table):
+        writer, reader = MySQLStorage(), MySQLStorage()
+        await writer.set_state(KEY, "Form:date")
+        await asyncio.sleep(0.001)  # flush забрал изменения и ждёт БД
+        assert not writer._pending
+        assert await writer.get_state(KEY) == "Form:date"
+        table.commit.set()
+        await writer._flush_task
+        return await reader.get_state(KEY)
+
+    assert run_with_table(monkeypatch, scenario) == "Form:date"
+
+
+def test_commit_during_read_is_not_lost(monkeypatch):
+    async def scenario(table):
+        storage = MySQLStorage()
+        await storage.set_data(KEY, {"date": "01012025"})
+        await asyncio.sleep(0.001)
+        assert not storage._pending
+        read = asyncio.create_task(storage.get_data(KEY))
+        await asyncio.sleep(0)
+        table.commit.set()  # коммит приходит, пока чтение ещё ждёт БД
+        return await read
+
+    assert run_with_table(monkeypatch, scenario) == {"date": "01012025"}
+
+
+def test_without_cache_reads_other_process_writes(monkeypatch):
+    async def scenario(table):
+        table.commit.set()
+        first, second = MySQLStorage(cache_ttl=0), MySQLStorage(cache_ttl=0)
+        assert await first.get_state(KEY) is None
+        await second.set_state(KEY, "Form:gift_advice")
+        await second.flush()
+        return await first.get_state(KEY)
+
+    assert run_with_table(monkeypatch, scenario) == "Form:gift_advice"
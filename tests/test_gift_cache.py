@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from gift_cache import GiftCache, normalize
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Подарок маме, бюджет 3 000!", "подарок маме бюджет 3000"),
+    ("Ёлочные игрушки", "елочные  игрушки"),
+])
+def test_same_request_same_key(a, b):
+    assert normalize(a) == normalize(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Не люблю спорт, люблю книги", "не люблю книги, люблю спорт"),
+    ("очень очень дорого", "очень дорого"),
+])
+def test_word_order_and_repeats_change_key(a, b):
+    assert normalize(a) != normalize(b)
+
+
+def test_opposite_requests_are_not_shared():
+    async def scenario():
+        cache = GiftCache()
+        calls = []
+
+        async def create(text):
+            calls.append(text)
+            return f"ответ на «{text}»"
+
+        first = "Не люблю спорт, люблю книги"
+        second = "не люблю книги, люблю спорт"
+        assert await cache.get_or_create(first, lambda: create(first)) != \
+            await cache.get_or_create(second, lambda: create(second))
+        assert await cache.get_or_create(first.upper(), lambda: create("снова")) == f"ответ на «{first}»"
+        return calls
+
+    assert len(asyncio.run(scenario())) == 2
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import gift_cache
+import gift_catalog
+from gift_catalog import (MIN_ANSWER_LENGTH, SEVERAL_PERSONAS, GiftCatalog, _read_seed, budget_band,
+                          interests, persona)
+
+CATALOG = [
+    ("подарок маме бюджет 3000, она любит садоводство", "садоводство"),
+    ("подарок маме бюджет 3000, она любит книги", "книги"),
+    ("подарок коллеге 2000 кофе", "кофе"),
+    ("подарок коллеге 2000, любит настольные игры", "настольные игры"),
+]
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = GiftCatalog(str(tmp_path / "catalog"))
+    catalog.entries = list(CATALOG)
+    asyncio.run(catalog.rebuild())
+    return catalog
+
+
+@pytest.mark.parametrize("text, band", [
+    ("подарок маме 1 500", 2),
+    ("бюджет 2 500", 2),
+    ("до 3.000 рублей", 2),
+    ("подарок другу за 5к", 3),
+    ("коллеге на 2 тыс", 2),
+    ("сыну 5 лет, до 700 рублей", 1),
+    ("подарок папе", 0),
+])
+def test_budget_band(text, band):
+    assert budget_band(text) == band
+
+
+@pytest.mark.parametrize("text, code", [
+    ("подарок маме на юбилей", 1),
+    ("подарок для мамы", 1),
+    ("книга про математику для брата", 12),
+    ("подарок другой девушке", 8),
+    ("что подарить подруге", 10),
+    ("подарок для мамы моего друга", SEVERAL_PERSONAS),
+    ("что-нибудь на новоселье", 0),
+])
+def test_persona(text, code):
+    assert persona(text) == code
+
+
+def test_persona_ignores_word_order():
+    text = "подарок для мамы моего друга"
+    assert persona(text) == persona(" ".join(reversed(text.split()))) == persona(gift_cache.normalize(text))
+
+
+def test_seed_from_gift_cache_keeps_request(tmp_path):
+    path = tmp_path / "gift_cache.jsonl"
+    cache = gift_cache.GiftCache(path=str(path))
+    request = "Подарок маме, бюджет 1 500"
+
+    async def create():
+        return "ответ"
+
+    asyncio.run(cache.get_or_create(request, create))
+    [(seeded, answer)] = _read_seed(str(path))
+    assert (seeded, answer) == (request, "ответ")
+    assert (persona(seeded), budget_band(seeded)) == (persona(request), budget_band(request))
+
+
+def test_accept_survives_unwritable_catalog(tmp_path):
+    (tmp_path / "catalog").write_text("не каталог")
+    catalog = GiftCatalog(str(tmp_path / "catalog" / "gifts"))
+
+    async def accept():
+        catalog.accept("подарок маме", "ответ" * MIN_ANSWER_LENGTH)
+        await asyncio.gather(*catalog._tasks)
+
+    asyncio.run(accept())
+    assert catalog.entries == []
+
+
+def test_interests_drop_recipient_budget_and_boilerplate():
+    assert interests("Подарок маме, бюджет 3 000 рублей, она любит йогу") == "йогу"
+
+
+@pytest.mark.parametrize("text", [
+    "подарок маме бюджет 3000, она любит йогу",
+    "подарок маме бюджет 3000, она не любит садоводство",
+    "подарок коллеге 2000 чай",
+    "подарок маме бюджет 3000",
+])
+def test_different_interests_do_not_match(catalog, text):
+    assert catalog.search(text) is None
+
+
+@pytest.mark.parametrize("text, answer", [
+    ("что подарить маме до 3 000 рублей, увлекается садоводством", "садоводство"),
+    ("Подарок маме, бюджет 3000, любит книги", "книги"),
+    ("коллеге за 2000, любит кофе", "кофе"),
+])
+def test_same_interests_match(catalog, text, answer):
+    assert catalog.search(text) == answer
+
+
+def test_index_of_old_features_is_rebuilt(catalog, monkeypatch):
+    monkeypatch.setattr(gift_catalog, "FEATURES_VERSION", gift_catalog.FEATURES_VERSION + 1)
+    reopened = GiftCatalog(str(catalog.path))
+    assert reopened._index is None and reopened._indexed == 0
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import db
+
+os.environ.setdefault("TELEGRAM_TOKEN", "1:test")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+import bot  # noqa: E402  (читает токены при импорте)
+
+
+def test_reserve_up_to_the_daily_limit(sqlite_db):
+    run = sqlite_db
+    granted = [run(db.reserve_gift_call(1)) for _ in range(db.GIFT_DAILY_LIMIT + 2)]
+    assert granted == [True] * db.GIFT_DAILY_LIMIT + [False, False]
+    assert run(db.reserve_gift_call(2))
+
+
+def test_limit_resets_on_a_new_day(sqlite_db):
+    run = sqlite_db
+    for _ in range(db.GIFT_DAILY_LIMIT):
+        run(db.reserve_gift_call(1))
+
+    async def move_to_yesterday():
+        async with db.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("UPDATE gift_usage SET last_call_date = %s",
+                                  (datetime.now().date() - timedelta(days=1),))
+
+    run(move_to_yesterday())
+    assert run(db.reserve_gift_call(1))
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.from_user = type("User", (), {"id": 1})()
+
+    async def answer(self, text, **kwargs):
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        pass
+
+    async def delete(self):
+        pass
+
+
+def test_reservation_is_spent_before_generation(monkeypatch):
+    state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=1, user_id=1))
+
+    async def scenario():
+        await state.set_state(bot.Form.gift_advice)
+        await state.update_data(gift_reserved=True)
+        seen = {}
+
+        async def get_or_create(text, create):
+            # Пока идёт генерация, следующее сообщение уже не попадёт в gift_advice
+            seen['state'] = await state.get_state()
+            seen['data'] = await state.get_data()
+            return "ответ"
+
+        monkeypatch.setattr(bot.gift_suggestions, "get_or_create", get_or_create)
+        await bot.get_gift_advice(FakeMessage("подарок маме"), state)
+        return seen
+
+    assert asyncio.run(scenario()) == {'state': None, 'data': {}}
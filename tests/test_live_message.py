@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import live_message
+from live_message import CURSOR, LiveMessage, repair_markdown, split_text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("**жирный** и __курсив__", "*жирный* и _курсив_"),
+    ("незакрытый *жирный", "незакрытый *жирный*"),
+    ("код `print(1)", "код `print(1)`"),
+    ("```\nблок", "```\nблок\n```"),
+    ("snake_case имя", "snake\\_case имя"),
+    ("[ссылка](https://example.com) и [скобка", "[ссылка](https://example.com) и \\[скобка"),
+    ("`*не разметка*`", "`*не разметка*`"),
+    ("*жирный _внутри*", "*жирный _внутри*"),
+])
+def test_repair_markdown(text, expected):
+    assert repair_markdown(text) == expected
+
+
+def test_split_text_keeps_lines_and_limit():
+    text = "".join(f"строка {i}\n" for i in range(100))
+    parts = split_text(text, 50)
+    assert "".join(parts) == text
+    assert all(len(part) <= 50 for part in parts)
+    assert all(part.endswith("\n") for part in parts)
+
+
+def test_split_text_cuts_long_line():
+    assert split_text("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
+    assert split_text("") == [""]
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+def test_restarted_answer_replaces_shown_text(monkeypatch):
+    monkeypatch.setattr(live_message, "EDIT_INTERVAL", 0)
+
+    async def scenario():
+        message = FakeMessage()
+        live = LiveMessage(message)
+        first = "Ответ первой модели, который оборвался"
+        live.update(first)
+        await live._task
+        # Запасная модель начинает заново, текст короче показанного
+        live.update("Вто")
+        await live._task
+        return message.edits
+
+    edits = asyncio.run(scenario())
+    assert edits[-1] == "Вто" + CURSOR
@@ -0,0 +1,58 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import llm
+
+
+class FakeClient:
+    """OpenRouter: модель -> (задержка до ответа, фрагменты; исключение среди них — обрыв)"""
+
+    def __init__(self, models: dict):
+        self.models = models
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, stream, **kwargs):
+        self.calls.append(model)
+        delay, parts = self.models[model]
+        await asyncio.sleep(delay)
+
+        async def chunks():
+            for part in parts:
+                if isinstance(part, Exception):
+                    raise part
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+                await asyncio.sleep(0.01)
+        return chunks()
+
+
+def test_hang_until_deadline_counts_as_failure(monkeypatch):
+    monkeypatch.setattr(llm, "CALL_DEADLINE", 0.05)
+    gateway = llm.LLMGateway(FakeClient({"slow": (10, ["ответ"])}), ["slow"])
+
+    async def complete():
+        for _ in range(llm.FAILURE_THRESHOLD):
+            with pytest.raises(asyncio.TimeoutError):
+                await gateway.complete([])
+
+    asyncio.run(complete())
+    assert gateway._breakers["slow"].is_open
+
+
+def test_cancelled_hedge_model_stays_in_fallback():
+    client = FakeClient({"first": (0.01, ["ответ первой"]), "second": (0.01, ["ответ второй"])})
+    gateway = llm.LLMGateway(client, ["first", "second"], hedge=True)
+    gateway._first_token["first"].extend([0.01] * llm.HEDGE_MIN_SAMPLES)
+
+    async def complete():
+        # Первая молчит дольше p95 — запускается вторая; первая начинает отвечать
+        # раньше (вторую отменяют) и обрывается на середине
+        client.models["first"] = (0.05, ["начало ", RuntimeError("обрыв")])
+        client.models["second"] = (0.2, ["ответ второй"])
+        return await gateway.complete([])
+
+    assert asyncio.run(complete()) == "ответ второй"
+    assert client.calls == ["first", "second", "second"]
+    assert not gateway._breakers["second"].failures
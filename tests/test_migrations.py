@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+import db_backends
+import migrations
+
+
+def test_migrations_ignore_query_timeout(tmp_path, monkeypatch):
+    # Таймаут, в который не укладывается ни один запрос
+    monkeypatch.setenv("DB_QUERY_TIMEOUT", "0.000001")
+
+    async def scenario():
+        pool = await db_backends.connect(f"sqlite:///{tmp_path}/bot.db")
+        try:
+            await migrations.migrate(pool)
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    with pytest.raises(asyncio.TimeoutError):
+                        await cur.execute("SELECT MAX(version) FROM schema_version")
+                    cur.query_timeout = None
+                    await cur.execute("SELECT MAX(version) FROM schema_version")
+                    return (await cur.fetchone())[0]
+        finally:
+            await pool.close()
+
+    assert asyncio.run(scenario()) == migrations.MIGRATIONS[-1][0]
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import daily_reminder
+import db
+import reminder_time
+
+
+class FakeBot:
+    def __init__(self, failing: set[int]):
+        self.failing = failing
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.failing:
+            raise RuntimeError("сеть недоступна")
+        self.sent.append(chat_id)
+
+
+def query(run, sql: str, args=()):
+    async def fetch():
+        async with db.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, args)
+                return await cur.fetchall()
+
+    return run(fetch())
+
+
+def plan_and_drain(run, bot, monkeypatch):
+    """Сутки вперёд: напоминания всех пользователей запланированы и разобраны"""
+    monkeypatch.setattr(daily_reminder, "MAX_ATTEMPTS", 1)
+    now = reminder_time.utc_now() + timedelta(days=1)
+    run(daily_reminder.plan_reminders(now))
+    run(daily_reminder.drain_outbox(bot, now))
+    return now
+
+
+def test_history_is_written_on_delivery_only(sqlite_db, monkeypatch):
+    run = sqlite_db
+    for user_id in (1, 2):
+        run(db.save_event(user_id, "u", "ДР", date.today() + timedelta(days=30)))
+    bot = FakeBot(failing={2})
+    plan_and_drain(run, bot, monkeypatch)
+
+    assert bot.sent == [1]
+    assert [row[0] for row in query(run, "SELECT user_id FROM reminder_history")] == [1]
+    statuses = query(run, "SELECT user_id, status FROM reminder_outbox ORDER BY user_id")
+    assert [tuple(row) for row in statuses] == [(1, 'sent'), (2, 'failed')]
+
+
+def test_purge_keeps_unfinished_and_recent_rows(sqlite_db, monkeypatch):
+    run = sqlite_db
+    for user_id in (1, 2, 3):
+        run(db.save_event(user_id, "u", "ДР", date.today() + timedelta(days=30)))
+    now = plan_and_drain(run, FakeBot(failing={2}), monkeypatch)
+    [(pending_id,)] = query(run, "SELECT id FROM reminder_outbox WHERE user_id = 3")
+    run(db.reschedule_outbox([('pending', now, pending_id)]))  # третье ещё ждёт повтора
+
+    run(daily_reminder.purge_outbox(now + daily_reminder.OUTBOX_KEEP - timedelta(minutes=1)))
+    assert len(query(run, "SELECT id FROM reminder_outbox")) == 3
+
+    run(daily_reminder.purge_outbox(now + daily_reminder.OUTBOX_KEEP + timedelta(minutes=1)))
+    assert [tuple(row) for row in query(run, "SELECT user_id, status FROM reminder_outbox")] == \
+        [(3, 'pending')]
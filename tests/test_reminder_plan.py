@@ -0,0 +1,83 @@
+from datetime import date, timedelta
+
+import pytest
+
+import broadcast
+import daily_reminder
+import db
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+
+
+def next_remind_at(run, user_id: int):
+    async def fetch():
+        async with db.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT next_remind_at, local_date FROM reminder_settings WHERE user_id = %s",
+                    (user_id,)
+                )
+                return await cur.fetchone()
+
+    return run(fetch())
+
+
+@pytest.fixture(autouse=True)
+def unlimited_chats(monkeypatch):
+    # Время виртуальное, а лимит в 1 сообщение в секунду на чат считается по настоящему
+    monkeypatch.setattr(daily_reminder, "chat_limiter", broadcast.ChatLimiter(1e9))
+
+
+def remind(run, bot, now):
+    run(daily_reminder.daily_reminder_task(bot, now))
+
+
+def test_bucket_takes_only_users_whose_minute_came(sqlite_db):
+    run = sqlite_db
+    for user_id in (1, 2):
+        run(db.save_event(user_id, "u", "ДР", date.today() + timedelta(days=30)))
+        run(db.set_reminder_settings(user_id, "UTC", 20))
+    first, _ = next_remind_at(run, 1)
+    second, _ = next_remind_at(run, 2)
+    assert second - first == timedelta(minutes=1)  # минута — user_id % 60
+
+    bot = FakeBot()
+    remind(run, bot, first)
+    assert bot.sent == [1]
+    assert next_remind_at(run, 1)[0] == first + timedelta(days=1)
+    remind(run, bot, first)  # та же минута ещё раз — никого
+    remind(run, bot, second)
+    assert bot.sent == [1, 2]
+    assert next_remind_at(run, 2)[0] == second + timedelta(days=1)
+
+
+def reminder_days(run, event_in: int, days: int) -> list[int]:
+    """В какие из days дней подряд пришло напоминание о событии через event_in дней"""
+    run(db.set_reminder_settings(1, "UTC", 20))
+    start = next_remind_at(run, 1)[1]
+    run(db.save_event(1, "u", "ДР", start + timedelta(days=event_in)))
+    bot, delivered = FakeBot(), []
+    for _ in range(days):
+        now, local_date = next_remind_at(run, 1)
+        remind(run, bot, now)
+        if bot.sent:
+            delivered.append((local_date - start).days)
+            bot.sent.clear()
+    return delivered
+
+
+def test_far_event_is_reminded_weekly(sqlite_db):
+    # Раз в неделю — по дате последней доставки в reminder_history
+    assert reminder_days(sqlite_db, event_in=30, days=15) == [0, 7, 14]
+
+
+def test_near_event_is_reminded_daily_and_deleted_on_the_day(sqlite_db):
+    run = sqlite_db
+    assert reminder_days(run, event_in=3, days=6) == [0, 1, 2, 3]
+    assert run(db.get_user_events(1)) == []
@@ -0,0 +1,38 @@
+from datetime import date, datetime
+
+from reminder_time import DEFAULT_TIMEZONE, default_minute, get_zone, next_reminder
+
+
+def test_next_reminder_is_strictly_after():
+    fire, local_day = next_reminder("Europe/Moscow", 20, 5, datetime(2026, 5, 1, 17, 5))
+    assert (fire, local_day) == (datetime(2026, 5, 2, 17, 5), date(2026, 5, 2))
+
+
+def test_local_date_differs_from_utc_date():
+    # 08:00 в Токио — 23:00 UTC предыдущего дня
+    fire, local_day = next_reminder("Asia/Tokyo", 8, 0, datetime(2026, 5, 1, 12, 0))
+    assert (fire, local_day) == (datetime(2026, 5, 1, 23, 0), date(2026, 5, 2))
+
+
+def test_dst_gap_fires_once_after_the_jump():
+    # 8 марта 2026 в Нью-Йорке 02:00 -> 03:00: 02:30 не существует
+    fire, local_day = next_reminder("America/New_York", 2, 30, datetime(2026, 3, 8, 5, 0))
+    assert (fire, local_day) == (datetime(2026, 3, 8, 7, 30), date(2026, 3, 8))
+    following, next_day = next_reminder("America/New_York", 2, 30, fire)
+    assert (following, next_day) == (datetime(2026, 3, 9, 6, 30), date(2026, 3, 9))
+
+
+def test_repeated_hour_fires_once():
+    # 1 ноября 2026 в Нью-Йорке 01:30 бывает дважды: 05:30 и 06:30 UTC
+    fire, local_day = next_reminder("America/New_York", 1, 30, datetime(2026, 11, 1, 4, 0))
+    assert (fire, local_day) == (datetime(2026, 11, 1, 5, 30), date(2026, 11, 1))
+    following, next_day = next_reminder("America/New_York", 1, 30, fire)
+    assert (following, next_day) == (datetime(2026, 11, 2, 6, 30), date(2026, 11, 2))
+
+
+def test_unknown_zone_falls_back_to_default():
+    assert get_zone("Mars/Olympus") == get_zone(DEFAULT_TIMEZONE)
+
+
+def test_default_minute_spreads_users_over_the_hour():
+    assert {default_minute(user_id) for user_id in range(120)} == set(range(60))
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import Cron, Scheduler
+
+
+def test_parse_lists_ranges_and_steps():
+    cron = Cron("*/15 9-11,18 * * 1-5")
+    assert cron.minutes == [0, 15, 30, 45]
+    assert cron.hours == [9, 10, 11, 18]
+    assert cron.weekdays == {0, 1, 2, 3, 4}  # понедельник–пятница в нумерации Python
+
+
+def test_sunday_is_both_zero_and_seven():
+    assert Cron("0 0 * * 0").weekdays == Cron("0 0 * * 7").weekdays == {6}
+
+
+@pytest.mark.parametrize("expr", ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "5-1 * * * *"])
+def test_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        Cron(expr)
+
+
+@pytest.mark.parametrize("expr, moment, expected", [
+    # Строго после moment, секунды отбрасываются
+    ("* * * * *", datetime(2026, 1, 1, 10, 0, 30), datetime(2026, 1, 1, 10, 1)),
+    ("30 * * * *", datetime(2026, 1, 1, 10, 30), datetime(2026, 1, 1, 11, 30)),
+    # Переход через полночь и конец месяца
+    ("15 3 * * *", datetime(2026, 1, 31, 4, 0), datetime(2026, 2, 1, 3, 15)),
+    # 29 февраля — ближайший високосный год
+    ("0 12 29 2 *", datetime(2026, 3, 1), datetime(2028, 2, 29, 12, 0)),
+    # 1 мая 2026 — пятница, 2 мая — суббота
+    ("0 9 * * 6", datetime(2026, 5, 1, 10, 0), datetime(2026, 5, 2, 9, 0)),
+    # И день месяца, и день недели: срабатывает любой (10-е или суббота)
+    ("0 9 10 * 6", datetime(2026, 5, 3, 0, 0), datetime(2026, 5, 9, 9, 0)),
+])
+def test_next_after(expr, moment, expected):
+    assert Cron(expr).next_after(moment) == expected
+
+
+def test_never_firing_expression():
+    with pytest.raises(ValueError):
+        Cron("0 0 31 2 *").next_after(datetime(2026, 1, 1))
+
+
+def test_prev_before_finds_the_missed_run():
+    cron = Cron("*/10 * * * *")
+    moment = datetime(2026, 1, 1, 10, 25)
+    assert cron.prev_before(moment, timedelta(minutes=10)) == datetime(2026, 1, 1, 10, 20)
+    assert cron.prev_before(moment, timedelta(minutes=4)) is None
+
+
+def test_job_does_not_overlap_itself():
+    async def scenario():
+        scheduler = Scheduler()
+        running, started = asyncio.Event(), []
+
+        async def slow():
+            started.append(datetime.now())
+            await running.wait()
+
+        job = scheduler.at("slow", datetime.now(), slow)
+        scheduler._fire(job, datetime.now())
+        scheduler._fire(job, datetime.now())
+        await asyncio.sleep(0)
+        running.set()
+        await job.task
+        return started
+
+    assert len(asyncio.run(scenario())) == 1
@@ -0,0 +1,34 @@
+"""Каждый запрос db.py после translate() должен компилироваться в SQLite.
+
+translate() переписывает диалект MySQL регулярными выражениями, и то, что
+он поймёт запрос, зависит от того, как запрос написан. EXPLAIN в SQLite
+разбирает и планирует запрос по настоящей схеме, не выполняя его.
+"""
+from pathlib import Path
+
+import pytest
+
+import db
+import migrations
+
+# Ветки, которые выполняются только на MySQL (у SQLite рядом своя версия запроса)
+MYSQL_ONLY = {"_reserve_gift_call_mysql"}
+
+QUERIES = [
+    (func_name, sql) for func_name, sql in migrations.collect_queries(Path(db.__file__))
+    if func_name not in MYSQL_ONLY
+]
+
+
+def test_collects_queries():
+    assert len(QUERIES) > 40
+
+
+@pytest.mark.parametrize("func_name, sql", QUERIES, ids=[name for name, _ in QUERIES])
+def test_query_compiles_in_sqlite(sqlite_db, func_name, sql):
+    async def explain():
+        async with db.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("EXPLAIN " + sql, [None] * sql.count("%s"))
+
+    sqlite_db(explain())
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+import db
+import stats
+
+
+def total_users(run) -> int:
+    return run(db.get_counters(['total_users']))['total_users']
+
+
+def test_recompute_drops_deltas_it_already_counted(sqlite_db):
+    run = sqlite_db
+    now = datetime.now()
+    run(db.save_users([(1, "a", "A", now), (2, "b", "B", now)]))
+    # Приращения ещё не сброшены, а пересчёт уже посчитал этих пользователей
+    run(stats.recompute())
+    assert run(stats.get_snapshot())['total_users'] == 2
+    run(stats.flush())
+    assert total_users(run) == 2
+
+    run(db.save_users([(3, "c", "C", now)]))
+    run(stats.flush())
+    assert total_users(run) == 3
+
+
+def test_active_users_come_from_recompute(sqlite_db):
+    run = sqlite_db
+    run(db.save_event(1, "a", "ДР мамы", datetime.now().date()))
+    assert not db.counter_deltas
+    run(stats.recompute())
+    assert run(db.get_counters(['active_users']))['active_users'] == 1
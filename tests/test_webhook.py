@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook
+
+SECRET = "test-secret"
+
+
+def fake_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Тест"},
+            "text": text,
+        },
+    }
+
+
+def post_updates(monkeypatch, updates, headers):
+    """Отправляет апдейты POST-запросами в приложение create_app; -> (статусы, тексты обработанных)"""
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", SECRET)
+    dispatcher = Dispatcher()
+    bot = Bot("42:TEST")
+    handled = []
+
+    @dispatcher.message()
+    async def record(message):
+        handled.append(message.text)
+
+    async def scenario():
+        async with TestClient(TestServer(webhook.create_app(dispatcher, bot))) as client:
+            statuses = []
+            for update in updates:
+                response = await client.post(webhook.WEBHOOK_PATH, json=update, headers=headers)
+                statuses.append(response.status)
+            # Апдейты разбираются фоном после ответа Telegram
+            for _ in range(100):
+                if len(handled) == len(updates):
+                    break
+                await asyncio.sleep(0.01)
+            return statuses
+
+    return asyncio.run(scenario()), handled
+
+
+def test_updates_are_handled(monkeypatch):
+    updates = [fake_update(1, "/start"), fake_update(2, "привет")]
+    statuses, handled = post_updates(
+        monkeypatch, updates, {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    )
+    assert statuses == [200, 200]
+    assert sorted(handled) == ["/start", "привет"]
+
+
+def test_wrong_secret_is_rejected(monkeypatch):
+    statuses, handled = post_updates(
+        monkeypatch, [fake_update(1, "/start")], {"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+    )
+    assert statuses == [401]
+    assert handled == []
+
+
+def test_run_requires_secret(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", None)
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+        webhook.run(Dispatcher(), Bot("42:TEST"))
@@ -0,0 +1,46 @@
+"""Реестр пользователей: кто хоть раз писал боту, в таблице users.
+
+Обработчики не ходят в БД ради учёта: middleware запоминает отправителя в
+памяти, а задание планировщика раз в FLUSH_INTERVAL секунд пишет накопленное
+одним пакетом. Аудитория рассылок читается из users порциями (db.get_recipients_after).
+"""
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+
+import db
+
+FLUSH_INTERVAL = 10  # секунд между пакетной записью пользователей
+
+# user_id -> (username, first_name, время последнего апдейта)
+_pending = {}
+
+
+def remember(user):
+    """Отмечает пользователя Telegram для следующей пакетной записи"""
+    if user is None or user.is_bot:
+        return
+    _pending[user.id] = (user.username, user.first_name, datetime.now())
+
+
+async def flush():
+    """Пишет накопленных пользователей одним пакетом"""
+    if not _pending:
+        return
+    rows = [(user_id, *values) for user_id, values in _pending.items()]
+    _pending.clear()
+    try:
+        await db.save_users(rows)
+    except Exception:
+        # Не теряем пользователей; более свежие записи, пришедшие за это время, важнее
+        for user_id, *values in rows:
+            _pending.setdefault(user_id, tuple(values))
+        raise
+
+
+class UserRegistryMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: запоминает отправителя любого апдейта"""
+
+    async def __call__(self, handler, event, data):
+        remember(data.get("event_from_user"))
+        return await handler(event, data)
@@ -0,0 +1,74 @@
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import db
+import metrics
+
+WEBHOOK_PATH = "/webhook"
+# Публичный адрес приложения, например https://vibbot.osc-fr1.scalingo.io
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+# Telegram присылает его в X-Telegram-Bot-Api-Secret-Token; чужие запросы отклоняются.
+# Обязателен: без него апдейт от имени любого пользователя может прислать кто угодно
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Если задан, /metrics отдаётся только с заголовком Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+async def health(request: web.Request) -> web.Response:
+    """Проверка живости для балансировщика: процесс отвечает и пул БД создан"""
+    ok = db.db_pool is not None
+    return web.json_response(
+        {"status": "ok" if ok else "starting", "db": ok, "pool": db.db_pool.stats() if ok else None},
+        status=200 if ok else 503
+    )
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Метрики процесса в текстовом формате Prometheus"""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise web.HTTPUnauthorized()
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp-приложение: апдейты Telegram на WEBHOOK_PATH, /health и /metrics.
+
+    Обработчик сразу отвечает Telegram 200 и разбирает апдейт фоновой
+    задачей, поэтому медленный обработчик не задерживает доставку.
+    Для локальной проверки апдейт можно отправить POST-запросом с JSON
+    апдейта и заголовком секрета.
+    """
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_handler)
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True
+    ).register(app, path=WEBHOOK_PATH)
+    # Запуск и остановка диспетчера (startup/shutdown) вместе с приложением
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher):
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("WEBHOOK_BASE_URL не задана!")
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types()
+    )
+
+
+def run(dispatcher: Dispatcher, bot: Bot):
+    """Запускает веб-сервер на $PORT (блокирует до остановки)"""
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET не задана!")
+    dispatcher.startup.register(set_webhook)
+    web.run_app(create_app(dispatcher, bot), host="0.0.0.0", port=int(os.getenv("PORT", 8080)))